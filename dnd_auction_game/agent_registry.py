@@ -0,0 +1,154 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class AgentRegistry:
+    """Interned store of the agents in a game.
+
+    Every agent id gets a dense index in the order it joined. Gold, points,
+    priority and the points seen at the previous round are kept in contiguous
+    int64 arrays indexed by it, so per-round updates can be done on the whole
+    lobby at once. The arrays grow by doubling; always read them through the
+    properties, which return views of the live part.
+    """
+
+    def __init__(self, capacity:int=16):
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self._index: Dict[str, int] = {}
+
+        capacity = max(1, capacity)
+        self._gold = np.zeros(capacity, dtype=np.int64)
+        self._points = np.zeros(capacity, dtype=np.int64)
+        self._priority = np.zeros(capacity, dtype=np.int64)
+        self._prev_points = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, a_id:str):
+        return a_id in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    @property
+    def gold(self) -> np.ndarray:
+        return self._gold[:len(self.ids)]
+
+    @property
+    def points(self) -> np.ndarray:
+        return self._points[:len(self.ids)]
+
+    @property
+    def priority(self) -> np.ndarray:
+        return self._priority[:len(self.ids)]
+
+    @property
+    def prev_points(self) -> np.ndarray:
+        return self._prev_points[:len(self.ids)]
+
+    def add(self, a_id:str, name:str) -> int:
+        idx = self._index.get(a_id)
+        if idx is not None:
+            return idx
+
+        idx = len(self.ids)
+        if idx == len(self._gold):
+            self._grow(2 * len(self._gold))
+
+        self._index[a_id] = idx
+        self.ids.append(a_id)
+        self.names.append(name)
+        return idx
+
+    def _grow(self, capacity:int):
+        for attr in ("_gold", "_points", "_priority", "_prev_points"):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def index(self, a_id:str) -> int:
+        return self._index[a_id]
+
+    def get_index(self, a_id:str) -> Optional[int]:
+        return self._index.get(a_id)
+
+    def name(self, a_id:str) -> str:
+        return self.names[self._index[a_id]]
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        """(a_id, {"gold", "points"}) pairs; the dicts are copies."""
+        return zip(self.ids, self._state_dicts())
+
+    def to_dict(self) -> Dict[str, dict]:
+        """Snapshot as the {a_id: {"gold", "points"}} dict sent to agents."""
+        return dict(self.items())
+
+    def _state_dicts(self):
+        return ({"gold": g, "points": p} for g, p in zip(self.gold.tolist(), self.points.tolist()))
+
+
+class GainHistory:
+    """Points gained per round by every agent, the last `window` rounds.
+
+    One ring buffer row per agent index (as in AgentRegistry), all agents get a
+    gain every round so they share the write position. A running sum over the
+    last `short_window` gains is updated on every push, so averages cost
+    nothing to read.
+    """
+
+    def __init__(self, window:int=20, short_window:int=10, capacity:int=16):
+        self.window = window
+        self.short_window = min(short_window, window)
+        self.pos = 0
+
+        capacity = max(1, capacity)
+        self._ring = np.zeros((capacity, window), dtype=np.int64)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._short_sum = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self, n:int):
+        capacity = len(self._count)
+        while capacity < n:
+            capacity *= 2
+        ring = np.zeros((capacity, self.window), dtype=np.int64)
+        ring[:len(self._ring)] = self._ring
+        self._ring = ring
+        for attr in ("_count", "_short_sum"):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def push(self, gains:np.ndarray):
+        """Record one round: gains[i] of the agent with index i (agents that joined are appended)."""
+        n = len(gains)
+        if n > len(self._count):
+            self._grow(n)
+
+        leaving = self._ring[:n, (self.pos - self.short_window) % self.window]
+        full = self._count[:n] >= self.short_window
+        self._short_sum[:n] += gains - np.where(full, leaving, 0)
+        self._ring[:n, self.pos] = gains
+        self._count[:n] += 1
+        self.pos = (self.pos + 1) % self.window
+
+    def short_average(self, n:int) -> np.ndarray:
+        """Average of the last short_window gains of the first n agents (0 before the first gain)."""
+        if n > len(self._count):
+            self._grow(n)
+        counts = np.minimum(self._count[:n], self.short_window)
+        return np.where(counts > 0, self._short_sum[:n] / np.maximum(counts, 1), 0.0)
+
+    def cumulative(self, n:int) -> List[List[int]]:
+        """Per agent (first n), the running total of its last (up to window) gains, oldest first."""
+        if n > len(self._count):
+            self._grow(n)
+        order = (self.pos + np.arange(self.window)) % self.window
+        # rounds before an agent joined are zeros, they don't change the sums and are cut off below
+        sums = np.cumsum(self._ring[:n, order], axis=1).tolist()
+        skip = (self.window - np.minimum(self._count[:n], self.window)).tolist()
+        return [row[k:] for row, k in zip(sums, skip)]
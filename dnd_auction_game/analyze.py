@@ -0,0 +1,344 @@
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from dnd_auction_game.game_logger import log_segments, zstandard
+from dnd_auction_game import logs
+
+
+# per agent counters, summed over every resolved auction and pool buy
+FIELDS = (
+    "auctions",      # auctions bid on
+    "gold_bid",      # gold of all those bids
+    "wins",          # auctions won, ties the server settled in the agent's favour included
+    "ties",          # auctions where the agent was tied for the highest bid
+    "gold_won",      # gold paid for the auctions won
+    "points_won",    # points (rolls) of the auctions won
+    "margin",        # sum of (winning bid - second highest bid)
+    "margin_ratio",  # sum of margin / winning bid
+    "pool_buys",
+    "pool_points",
+    "unresolved",    # ties for the highest bid whose winner is not in the log (older logs)
+)
+_F = {name: i for i, name in enumerate(FIELDS)}
+
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+class LogStats:
+    """Incremental per agent statistics of one or more logs.
+
+    Only sums are kept, so memory does not depend on the length of the logs and
+    the stats of separately analyzed parts can be merged.
+    """
+
+    def __init__(self):
+        self.agents: Dict[str, List[float]] = {}
+        self.rounds = 0
+
+    def _agent(self, a_id:str) -> List[float]:
+        stats = self.agents.get(a_id)
+        if stats is None:
+            stats = [0] * len(FIELDS)
+            self.agents[a_id] = stats
+        return stats
+
+    def add_round(self, entry:dict):
+        """Count a round state: the resolved auctions and pool buys of the round before it."""
+        if "round" not in entry:
+            return
+        self.rounds += 1
+
+        for info in entry.get("prev_auctions", {}).values():
+            bids = info.get("bids")
+            if not bids:
+                continue
+
+            # bids are listed highest first; stats are indexed like FIELDS
+            for bid in bids:
+                stats = self._agent(bid["a_id"])
+                stats[0] += 1
+                stats[1] += bid["gold"]
+
+            top = bids[0]["gold"]
+            second = bids[1]["gold"] if len(bids) > 1 else 0
+            winner = bids[0]["a_id"]
+            if second == top:
+                winner = info.get("winner")
+                for bid in bids:
+                    if bid["gold"] != top:
+                        break
+                    stats = self._agent(bid["a_id"])
+                    stats[3] += 1
+                    if winner is None:
+                        stats[10] += 1
+                if winner is None:
+                    continue
+
+            stats = self._agent(winner)
+            stats[2] += 1
+            stats[4] += top
+            stats[5] += info["reward"]
+            stats[6] += top - second
+            stats[7] += (top - second) / top
+
+        for a_id, points in entry.get("prev_pool_buys", {}).items():
+            if points > 0:
+                stats = self._agent(a_id)
+                stats[8] += 1
+                stats[9] += points
+
+    def merge(self, other:"LogStats"):
+        self.rounds += other.rounds
+        for a_id, values in other.agents.items():
+            stats = self._agent(a_id)
+            for i, v in enumerate(values):
+                stats[i] += v
+
+    def table(self) -> List[dict]:
+        """One row per agent with the derived rates, best points first."""
+        rows = []
+        for a_id, values in self.agents.items():
+            s = dict(zip(FIELDS, values))
+            # a tie with an unknown winner is neither a win nor a loss
+            decided = s["auctions"] - s["unresolved"]
+            rows.append({
+                "a_id": a_id,
+                "auctions": int(s["auctions"]),
+                "wins": int(s["wins"]),
+                "ties": int(s["ties"]),
+                "unresolved_ties": int(s["unresolved"]),
+                "win_rate": s["wins"] / decided if decided else 0.0,
+                "points_won": int(s["points_won"]),
+                "gold_per_point": s["gold_won"] / s["points_won"] if s["points_won"] else None,
+                "avg_overbid": s["margin"] / s["wins"] if s["wins"] else None,
+                "avg_overbid_ratio": s["margin_ratio"] / s["wins"] if s["wins"] else None,
+                "avg_bid": s["gold_bid"] / s["auctions"] if s["auctions"] else None,
+                "pool_buys": int(s["pool_buys"]),
+                "pool_points": int(s["pool_points"]),
+            })
+        rows.sort(key=lambda r: -r["points_won"])
+        return rows
+
+
+def columnar_stats(log:logs.GameLog) -> LogStats:
+    """LogStats of a columnar log, computed with array operations."""
+    stats = LogStats()
+    stats.rounds = len(log)
+    n_agents = len(log.agents)
+
+    offsets = np.asarray(log["bid_offsets"])
+    bid_agent = np.asarray(log["bid_agent"])
+    bid_gold = np.asarray(log["bid_gold"])
+    reward = np.asarray(log["auction_reward"])
+
+    counts = np.diff(offsets)
+    first = offsets[:-1]
+    has_bids = (counts > 0) & np.asarray(log["auction_revealed"])
+    top_rows = first[has_bids]
+    has_second = counts[has_bids] > 1
+    top = bid_gold[top_rows]
+    second = np.where(has_second, bid_gold[np.minimum(top_rows + 1, len(bid_gold) - 1)], 0)
+    tie = second == top
+
+    # the winner of a tie is only known from logs that record it
+    if "auction_winner" in log:
+        logged_winner = np.asarray(log["auction_winner"])[has_bids]
+    else:
+        logged_winner = np.full(len(top_rows), -1, dtype=np.int64)
+    all_winners = np.where(tie, logged_winner, bid_agent[top_rows])
+    won = all_winners >= 0
+    winner = all_winners[won]
+    margin = (top - second)[won]
+
+    # every bid on a resolved auction, and those tied for the highest
+    resolved_bid = np.repeat(has_bids, counts)
+    tied_auction = np.zeros(len(counts), dtype=bool)
+    tied_auction[np.flatnonzero(has_bids)[tie]] = True
+    unresolved_auction = np.zeros(len(counts), dtype=bool)
+    unresolved_auction[np.flatnonzero(has_bids)[~won]] = True
+    top_of_auction = np.zeros(len(counts), dtype=np.int64)
+    top_of_auction[has_bids] = top
+    tied_bid = np.repeat(tied_auction, counts) & (bid_gold == np.repeat(top_of_auction, counts))
+    unresolved_bid = tied_bid & np.repeat(unresolved_auction, counts)
+
+    def per_agent(agents, weights=None):
+        return np.bincount(agents, weights=weights, minlength=n_agents)[:n_agents]
+
+    columns = np.zeros((n_agents, len(FIELDS)))
+    columns[:, _F["auctions"]] = per_agent(bid_agent[resolved_bid])
+    columns[:, _F["gold_bid"]] = per_agent(bid_agent[resolved_bid], bid_gold[resolved_bid])
+    columns[:, _F["wins"]] = per_agent(winner)
+    columns[:, _F["ties"]] = per_agent(bid_agent[tied_bid])
+    columns[:, _F["unresolved"]] = per_agent(bid_agent[unresolved_bid])
+    columns[:, _F["gold_won"]] = per_agent(winner, top[won])
+    columns[:, _F["points_won"]] = per_agent(winner, reward[has_bids][won])
+    columns[:, _F["margin"]] = per_agent(winner, margin)
+    columns[:, _F["margin_ratio"]] = per_agent(winner, margin / top[won])
+
+    pool_agent = np.asarray(log["pool_buy_agent"])
+    pool_points = np.asarray(log["pool_buy_points"])
+    bought = pool_points > 0
+    columns[:, _F["pool_buys"]] = per_agent(pool_agent[bought])
+    columns[:, _F["pool_points"]] = per_agent(pool_agent[bought], pool_points[bought])
+
+    for i, a_id in enumerate(log.agents):
+        if columns[i].any():
+            stats.agents[a_id] = columns[i].tolist()
+    return stats
+
+
+def _iter_lines(path:str, start:int=0, end:Optional[int]=None) -> Iterator[bytes]:
+    """The lines of a log file starting in [start, end), decompressing if needed."""
+    if path.endswith(".gz"):
+        fp = gzip.open(path, "rb")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("'{}' is zstd compressed, install zstandard to read it".format(path))
+        fp = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        fp = io.BufferedReader(fp)
+    else:
+        fp = open(path, "rb")
+
+    with fp:
+        pos = start
+        if start > 0:
+            # the line running over `start` belongs to the chunk before
+            fp.seek(start - 1)
+            pos = start - 1 + len(fp.readline())
+        for line in fp:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+
+def _analyze_part(path:str, start:int=0, end:Optional[int]=None) -> LogStats:
+    if os.path.isdir(path):
+        return columnar_stats(logs.load_log(path))
+
+    stats = LogStats()
+    for line in _iter_lines(path, start, end):
+        # skip parsing the lines that can't be round states
+        if b'"prev_auctions"' in line:
+            stats.add_round(json.loads(line))
+    return stats
+
+
+def plan_parts(paths:List[str], chunk_bytes:int=CHUNK_BYTES) -> List[Tuple[str, int, Optional[int]]]:
+    """Split logs into independent parts: columnar directories, compressed segments and
+    byte ranges of large uncompressed files. Every round line is self-contained, so the
+    parts can be analyzed in any order."""
+    parts = []
+    for path in paths:
+        if os.path.isdir(path):
+            parts.append((path, 0, None))
+            continue
+
+        files = log_segments(path)
+        if os.path.isfile(path):
+            files.append(path)
+        if not files:
+            raise ValueError("no log at '{}'".format(path))
+
+        for f in files:
+            if f.endswith((".gz", ".zst")):
+                parts.append((f, 0, None))
+                continue
+            size = os.path.getsize(f)
+            for start in range(0, max(size, 1), chunk_bytes):
+                parts.append((f, start, min(start + chunk_bytes, size)))
+    return parts
+
+
+def analyze(paths:List[str], workers:Optional[int]=None, chunk_bytes:int=CHUNK_BYTES) -> LogStats:
+    """Per agent statistics over all the logs (jsonln, agent jsonl or columnar directories).
+
+    With more than one part the parts are spread over a process pool of
+    `workers` processes (default: one per cpu), workers=1 analyzes in this process.
+    """
+    parts = plan_parts(paths, chunk_bytes)
+    total = LogStats()
+
+    if workers == 1 or len(parts) == 1:
+        for part in parts:
+            total.merge(_analyze_part(*part))
+        return total
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        for stats in pool.map(_analyze_part, *zip(*parts)):
+            total.merge(stats)
+    return total
+
+
+def player_names(path:str) -> Dict[str, str]:
+    """{a_id: name} from the player id log next to a server log, if there is one."""
+    m = re.match(r"^(.*)_(\d+)\.jsonln$", path)
+    if not m:
+        return {}
+    names_path = "{}_player_id_{}.jsonln".format(m.group(1), m.group(2))
+    names = {}
+    if os.path.isfile(names_path):
+        with open(names_path, "r", encoding="utf-8") as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    names[entry["agent_id"]] = entry["name"]
+    return names
+
+
+def _fmt(value, digits:int=2) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.{}f}".format(value, digits)
+    return str(value)
+
+
+def print_table(rows:List[dict], names:Dict[str, str]):
+    columns = ("agent", "auctions", "wins", "ties", "unresolved_ties", "win_rate", "points_won", "gold_per_point",
+               "avg_overbid", "avg_overbid_ratio", "pool_buys", "pool_points")
+    print("  ".join("{:>14}".format(c[:14]) for c in columns))
+    for row in rows:
+        agent = names.get(row["a_id"], row["a_id"])
+        values = [agent[:14]] + [_fmt(row[c]) for c in columns[1:]]
+        print("  ".join("{:>14}".format(v) for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m dnd_auction_game.analyze",
+                                     description="Per agent statistics of game logs.")
+    parser.add_argument("logs", nargs="+", help="server logs, agent logs or columnar log directories")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: one per cpu)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024),
+                        help="split uncompressed logs into parts of this size")
+    parser.add_argument("--json", action="store_true", help="print the table as json")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = analyze(args.logs, workers=args.workers, chunk_bytes=max(1, args.chunk_mb) * 1024 * 1024)
+    rows = stats.table()
+
+    if args.json:
+        print(json.dumps({"rounds": stats.rounds, "agents": rows}))
+        return
+
+    names = {}
+    for path in args.logs:
+        names.update(player_names(path))
+    print_table(rows, names)
+    print("<{} rounds from {} logs in {:.1f}s>".format(stats.rounds, len(args.logs), time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,44 @@
 
-from typing import List, Dict, Union
-import random
-from collections import defaultdict
-import json
+from typing import Dict, Optional
 import math
-import os
 
+import numpy as np
 
-def generate_gold_random_walk(n_steps:int) -> List[float]:
-
-    gold_per_round = 1000
-    step_size = 150
-    max_gold_per_round = 3000
-
-    gold = [gold_per_round]
-    for i in range(n_steps-1):
-        next_gold = gold[-1] + random.randint(-step_size, step_size) - 1
-
-        if next_gold < 10:
-            next_gold = 10
-
-        if next_gold > max_gold_per_round:
-            next_gold = max_gold_per_round
-
-        gold.append(next_gold)
-
-        if i % 500 == 0:
-            gold[-1] = gold_per_round + random.randint(-step_size // 2, step_size)
-
-    return gold
-
-def braavos_bank_limit_random_walk(n_steps:int) -> List[int]:
-
-    upper_limit_start = 5000
-    upper_limit_end = 20000
-    step_size = 150
-
-    upper_limits = [upper_limit_start]
-    for i in range(n_steps-1):
-        next_limit = upper_limits[-1] + random.randint(-step_size, step_size)
-
-        if next_limit < 50:
-            next_limit = 50
-
-        if next_limit > upper_limit_end:
-            next_limit = upper_limit_end
-
-        upper_limits.append(next_limit)
-
-        if i % 300 == 0:
-            upper_limits[-1] = upper_limit_start
-
-    return upper_limits
-
-def braavos_bank_interest_rate_random_walk(n_steps:int) -> List[float]:
-
-    start_rate = 1.00
-    min_rate = 1.0
-    max_rate = 1.1
-    step_size = 0.02
-
-    rates = [start_rate]
-    for i in range(n_steps-1):
-        next_rate = rates[-1] + random.uniform(-step_size, step_size)
-
-        if next_rate < min_rate:
-            next_rate = min_rate
-
-        if next_rate > max_rate:
-            next_rate = max_rate
-
-        rates.append(next_rate)
-
-        if i % 250 == 0:
-            rates[-1] = start_rate + random.uniform(-step_size, step_size)
-
-
-    return rates
+from dnd_auction_game import metrics
+from dnd_auction_game.agent_registry import AgentRegistry, GainHistory
+from dnd_auction_game.bid_book import BidBook
+from dnd_auction_game.dice import DiceTable
+from dnd_auction_game.game_logger import GameLogger, claim_log_file
+from dnd_auction_game.economy import (
+    RandomWalk,
+    gold_random_walk,
+    bank_limit_random_walk,
+    interest_rate_random_walk,
+)
 
 
+# the auction generator: one entry per kind of auction
+DIE_SIZES = [2,   3,  4,  6,   8, 10,  12,   20,  20]
+DIE_PROB =  [7,   8,  9,  8,   6,  6,   5,    2,   1]
+MAX_N_DIE = [6,   7, 10,  2,   3,  3,   6,    2,   4]
+MAX_BONUS = [11,  2, 16,  8,  21,  2,   5,    7,   3]
+MIN_BONUS = [-2, -8, -5, -5, -10, -4,  -5,  -4,  -4]
 
 
 class AuctionHouse:
-    def __init__(self, game_token:str, play_token:str, save_logs=False):
+    def __init__(self, game_token:str, play_token:str, save_logs=False, seed:Optional[int]=None, dice_stats=False,
+                 log_prefix:str="auction_house_log", log_rotate_bytes:Optional[int]=None,
+                 log_rotate_rounds:Optional[int]=None, log_compression:Optional[str]=None):
         self.is_done = False
         self.is_active = False
         
         self.log_player_id_file = None
         self.log_file = None
+        self.log_prefix = log_prefix
+        # written by a background thread, see game_logger.py
+        self.log_options = {"rotate_bytes": log_rotate_bytes, "rotate_rounds": log_rotate_rounds, "compression": log_compression}
+        self.logger : GameLogger = None
+        self.player_id_logger : GameLogger = None
         self.game_token = game_token
         self.play_token = play_token
         self.save_logs = save_logs
@@ -96,113 +47,162 @@ class AuctionHouse:
         self.gold_in_pool = 0 # the gold that was removed during the cashback
         self.convert_to_pool_fraction = 0.9 # the fraction of gold that is returned to the hoard
         
-        self.agents = {}
-        self.names = {}
-        self.points_gain_history = {}
-        self._prev_points = {}
+        self.agents = AgentRegistry()
+        self.gain_history = GainHistory()
         
         self.bank_interest_rate = 1.1
         self.auctions_per_agent = 1.5
         self.gold_back_fraction = 0.5
         
-        self.die_sizes = [2,   3,  4,  6,   8, 10,  12,   20,  20]
-        self.die_prob =  [7,   8,  9,  8,   6,  6,   5,    2,   1]
-        self.max_n_die = [6,   7, 10,  2,   3,  3,   6,    2,   4]
-        self.max_bonus = [11,  2, 16,  8,  21,  2,   5,    7,   3] 
-        self.min_bonus = [-2, -8, -5, -5, -10, -4,  -5,  -4,  -4]
+        self.die_sizes = list(DIE_SIZES)
+        self.die_prob =  list(DIE_PROB)
+        self.max_n_die = list(MAX_N_DIE)
+        self.max_bonus = list(MAX_BONUS)
+        self.min_bonus = list(MIN_BONUS)
+
+        # attach precomputed point distribution stats to every auction broadcast
+        self.dice_stats = dice_stats
+        self.dice_table = DiceTable.for_generator(self.die_sizes, self.max_n_die)
+
+        # every game owns its random streams, see _seed_streams
+        self.fixed_seed = seed
+        self.seed : int = None
+        self._seed_streams(seed)
 
         self.round_counter = 0
         self.auction_counter = 1
         self.current_auctions = {}
         self.current_rolls = {} 
-        self.current_bids = defaultdict(list)
+        self.current_bids = BidBook(self.agents.ids)
+        # auction id -> a_id of the winner, of the auctions settled last
+        self.current_winners = {}
         self.num_rounds_in_game = 10
-        self.priority = {}
         self.current_pool_buys = {}
 
         self.num_rounds_in_game : int = None
-        self.gold_income_per_round : List[int] = None
-        self.bank_limit_per_round : List[int] = None
-        self.bank_interest_per_round : List[float] = None
+        self.gold_income_per_round : RandomWalk = None
+        self.bank_limit_per_round : RandomWalk = None
+        self.bank_interest_per_round : RandomWalk = None
+        self._economy_schedule : Dict[str, list] = None
         self.set_num_rounds(10)
-        
-        # set the logfile
-        self._find_log_file()
-
-        print("logging to: '{}'".format(self.log_file))
+        # the log file is claimed once somebody joins, see _find_log_file
 
     
     def _find_log_file(self):
-        if self.log_file is None:            
-            i = 1
+        # every game gets a log file (and header, index) of its own, reset() lets go of it
+        if self.log_file is None and self.save_logs:
+            # the manifest keeps the next free number, see game_logger.claim_log_file
+            n, self.log_file = claim_log_file("./{}_{{}}.jsonln".format(self.log_prefix),
+                                              "./{}.manifest.json".format(self.log_prefix))
+            self.log_player_id_file = "./{}_player_id_{}.jsonln".format(self.log_prefix, n)
+            self.logger = GameLogger(self.log_file, index=True, **self.log_options)
+            self.player_id_logger = GameLogger(self.log_player_id_file)
+            print("logging to: '{}'".format(self.log_file))
+
 
-            f = "./auction_house_log_{}.jsonln".format(i)         
-            f_player_id = "./auction_house_log_player_id_{}.jsonln".format(i)   
-            while os.path.isfile(f):
-                f = "./auction_house_log_{}.jsonln".format(i)
-                f_player_id = "./auction_house_log_player_id_{}.jsonln".format(i)   
-                i += 1
 
-            self.log_file = f
-            self.log_player_id_file = f_player_id
+    def _seed_streams(self, seed:Optional[int]):
+        # Independent streams for the economy, the auctions on offer, the dice rolls
+        # and the priorities, all derived from one seed. Without a seed fresh entropy
+        # is drawn; either way self.seed can be used to replay the game.
+        seed_seq = np.random.SeedSequence(seed)
+        self.seed = seed_seq.entropy
 
+        economy_seq, auction_seq, dice_seq, priority_seq = seed_seq.spawn(4)
+        self._economy_seeds = economy_seq.spawn(3)
+        self.auction_rng = np.random.default_rng(auction_seq)
+        self.dice_rng = np.random.default_rng(dice_seq)
+        self.priority_rng = np.random.default_rng(priority_seq)
 
 
     def set_num_rounds(self, num_rounds:int):
         self.num_rounds_in_game = num_rounds
 
-        self.gold_income_per_round = generate_gold_random_walk(num_rounds)
-        self.bank_limit_per_round = braavos_bank_limit_random_walk(num_rounds)
-        self.bank_interest_per_round = braavos_bank_interest_rate_random_walk(num_rounds)
+        # the walks are generated lazily from their own seeds, so this is cheap for any
+        # number of rounds and the schedule only depends on the seed
+        gold_seed, limit_seed, interest_seed = self._economy_seeds
+        self.gold_income_per_round = gold_random_walk(num_rounds, gold_seed)
+        self.bank_limit_per_round = bank_limit_random_walk(num_rounds, limit_seed)
+        self.bank_interest_per_round = interest_rate_random_walk(num_rounds, interest_seed)
+        self._economy_schedule = None
+
+
+    def economy_schedule(self) -> Dict[str, list]:
+        """The full gold income, interest and bank limit schedule of the game, as lists."""
+        if self._economy_schedule is None:
+            self._economy_schedule = {
+                "gold_income_per_round": self.gold_income_per_round.tolist(),
+                "bank_interest_per_round": self.bank_interest_per_round.tolist(),
+                "bank_limit_per_round": self.bank_limit_per_round.tolist(),
+            }
+        return self._economy_schedule
+
+
+    def prepare_game(self, num_rounds:int):
+        """The slow part of starting a long game: the economy schedule as lists. It
+        changes nothing the running server reads, so the lobby does it in a worker thread."""
+        self.set_num_rounds(num_rounds)
+        self.economy_schedule()
+
+
+    def start_game(self, num_rounds:int):
+        if num_rounds != self.num_rounds_in_game or self._economy_schedule is None:
+            self.prepare_game(num_rounds)
+        self.assign_priorities()
+        self.is_active = True
+
+        self._find_log_file()
+        self._write_log({
+            "type": "header",
+            "seed": self.seed,
+            "num_rounds": self.num_rounds_in_game,
+            "economy": self.economy_schedule(),
+        })
+
 
+    def _write_log(self, entry:dict):
+        if self.save_logs and self.logger is not None:
+            self.logger.write(entry)
 
-    def reset(self):
+
+    def reset(self, seed:Optional[int]=None):
         self.is_done = False
         self.is_active = False
-        self.agents = {}
-        self.names = {}
-        self.points_gain_history = {}
-        self._prev_points = {}
+        self.agents = AgentRegistry()
+        self.gain_history = GainHistory()
         self.current_auctions = {}
         self.current_rolls = {} 
-        self.current_bids = defaultdict(list)
+        self.current_bids = BidBook(self.agents.ids)
+        self.current_winners = {}
+        self.current_pool_buys = {}
         self.round_counter = 0
         self.auction_counter = 1
         self.num_rounds_in_game = 10
-        self.priority = {}
         self.gold_in_pool = 0
+        self._seed_streams(seed if seed is not None else self.fixed_seed)
         self.set_num_rounds(10)
-        self._find_log_file()
+
+        # the next game is logged to a new file
+        self.log_file = None
+        self.log_player_id_file = None
+        self.logger = None
+        self.player_id_logger = None
         
     
     def assign_priorities(self):
-        self.priority = {}
-        used = set()
-        for a_id in self.agents.keys():
-            while True:
-                p = random.randint(1, 10**9)
-                if p not in used:
-                    used.add(p)
-                    self.priority[a_id] = p
-                    break
+        # unique random priorities in [1, 10**9]
+        self.agents.priority[:] = self.priority_rng.choice(10**9, size=len(self.agents), replace=False) + 1
         
     def add_agent(self, name:str, a_id:str, player_id:str):
         if a_id in self.agents:
             print("Agent {}  id:{} reconnected".format(name, a_id))
             return
 
-        try:
-            with open(self.log_player_id_file, 'a') as fp:
-                pid = {"player_id": player_id, "agent_id": a_id, "name": name}
-                fp.write("{}\n".format(json.dumps(pid)))
-        except Exception as e:
-            print("error writing player id log:", e)
-            self.save_logs = False
+        self._find_log_file()
+        if self.save_logs and self.player_id_logger is not None:
+            self.player_id_logger.write({"player_id": player_id, "agent_id": a_id, "name": name})
                     
-        self.agents[a_id] = {"gold": 0, "points": 0}
-        self.names[a_id] = name
-        self.points_gain_history.setdefault(a_id, [])
-        self._prev_points.setdefault(a_id, 0)
+        self.agents.add(a_id, name)
     
     
     def prepare_auctions_and_pool(self):        
@@ -210,7 +210,7 @@ class AuctionHouse:
         prev_bids = self.current_bids
         prev_rolls = self.current_rolls
         
-        self.current_bids = defaultdict(list)
+        self.current_bids = BidBook(self.agents.ids)
         self.current_auctions, self.current_rolls = self._generate_auctions()
 
         # copy the pool buys to broodcast, reset the pool buys
@@ -224,60 +224,42 @@ class AuctionHouse:
         gold_income = self.gold_income_per_round[self.round_counter]
         
         # update gold for agents
-        for agent in self.agents.values():
-
-            # bank of Braavos gives interest on stored gold
-            interest_available_gold = 0
-            if agent["gold"] >= upper_rate:
-                interest_available_gold = upper_rate
-            else:
-                interest_available_gold = agent["gold"]
+        gold = self.agents.gold
 
-            agent["gold"] += int(interest_available_gold * (interest_rate - 1))
-            agent["gold"] += gold_income
+        # bank of Braavos gives interest on stored gold
+        interest_available_gold = np.minimum(gold, upper_rate)
+        gold += (interest_available_gold * (interest_rate - 1)).astype(np.int64)
+        gold += gold_income
                 
                 
+        sorted_prev_bids = prev_bids.sorted_bids()
+        # auctions that got bids come first, in the order of their first bid (the order
+        # ties were settled in, which a replay of the log needs), then the others
         out_prev_state = {}
-        for auction_id, info in prev_auctions.items():
+        prev_order = list(sorted_prev_bids) + [a for a in prev_auctions if a not in sorted_prev_bids]
+        for auction_id in prev_order:
+            info = prev_auctions[auction_id]
             out_prev_state[auction_id] = {}
             out_prev_state[auction_id].update(info)            
             out_prev_state[auction_id]["reward"] = prev_rolls[auction_id]
-            
-            prev_bids[auction_id].sort(key=lambda x:x[1], reverse=True)            
-            out_prev_state[auction_id]["bids"] = [{"a_id": a_id, "gold": g} for a_id, g in prev_bids[auction_id]]
+            out_prev_state[auction_id]["bids"] = sorted_prev_bids.get(auction_id, [])
+            if auction_id in self.current_winners:
+                out_prev_state[auction_id]["winner"] = self.current_winners[auction_id]
 
         state = {
             "round": self.round_counter,
-            "states": self.agents,
+            "states": self.agents.to_dict(),
             "auctions": self.current_auctions,
             "prev_auctions": out_prev_state,
             "prev_pool_buys": buy_pool_copy,
             "pool": self.gold_in_pool,
-            "remainder_gold_income": self.gold_income_per_round[self.round_counter:],
-            "remainder_bank_limit": self.bank_limit_per_round[self.round_counter:],
-            "remainder_bank_interest": self.bank_interest_per_round[self.round_counter:],
         }
 
-        if self.save_logs and self.log_file is not None:
-            try:
-                with open(self.log_file, "a") as fp:
-                    fp.write("{}\n".format(json.dumps(state)))
-            except Exception as e:
-                print("error writing auction log:", e)
-                self.save_logs = False
+        self._write_log(state)
         
-        for a_id, info in self.agents.items():
-            current_points = info.get("points", 0)
-            prev_points = self._prev_points.get(a_id, 0)
-            gain = current_points - prev_points
-            history = self.points_gain_history.get(a_id)
-            if history is None:
-                history = []
-            history.append(gain)
-            if len(history) > 100:
-                history = history[-100:]
-            self.points_gain_history[a_id] = history
-            self._prev_points[a_id] = current_points
+        points = self.agents.points
+        self.gain_history.push(points - self.agents.prev_points)
+        self.agents.prev_points[:] = points
 
         self.round_counter += 1
         return state
@@ -286,30 +268,45 @@ class AuctionHouse:
     def _generate_auctions(self) -> Dict[str, dict]:
         auctions = {}
         rolls = {} # the amount rolled - hidden for agents
-        
-        indices = list(range(len(self.die_sizes)))
-                
+
         n_auctions = int(math.ceil(self.auctions_per_agent*len(self.agents)))
-                
-        for _ in range(n_auctions):
-            i = random.choices(indices, weights=self.die_prob, k=1)[0]            
-            die = self.die_sizes[i]
-            n_dices = random.randint(1, self.max_n_die[i])
-            bonus = random.randint(self.min_bonus[i], self.max_bonus[i])
-                                    
+        if n_auctions == 0:
+            return auctions, rolls
+
+        die_sizes = np.asarray(self.die_sizes, dtype=np.int64)
+        max_n_die = np.asarray(self.max_n_die, dtype=np.int64)
+        min_bonus = np.asarray(self.min_bonus, dtype=np.int64)
+        max_bonus = np.asarray(self.max_bonus, dtype=np.int64)
+        die_prob = np.asarray(self.die_prob, dtype=np.float64)
+
+        # draw the whole round at once: die type, number of dice and bonus per auction
+        kinds = self.auction_rng.choice(len(die_sizes), size=n_auctions, p=die_prob / die_prob.sum())
+        dies = die_sizes[kinds]
+        n_dices = self.auction_rng.integers(1, max_n_die[kinds], endpoint=True)
+        bonuses = self.auction_rng.integers(min_bonus[kinds], max_bonus[kinds], endpoint=True)
+
+        # roll every die of every auction in one call, then sum the dice per auction
+        die_rolls = self.dice_rng.integers(1, np.repeat(dies, n_dices), endpoint=True)
+        starts = np.cumsum(n_dices) - n_dices
+        points = np.add.reduceat(die_rolls, starts) + bonuses
+
+        for die, n_dice, bonus, p in zip(dies.tolist(), n_dices.tolist(), bonuses.tolist(), points.tolist()):
             auction_id = "a{}".format(self.auction_counter)
-            a = {"die": die, "num": n_dices, "bonus": bonus}
-            auctions[auction_id] = a
+            auctions[auction_id] = {"die": die, "num": n_dice, "bonus": bonus}
+            rolls[auction_id] = p
             self.auction_counter += 1
-            
-            points = sum( (random.randint(1, a["die"]) for _ in range(a["num"])) )
-            points += a["bonus"]
-            rolls[auction_id] = points
-                    
+
+        if self.dice_stats:
+            stats = self.dice_table.batch_stats(dies, n_dices, bonuses)
+            columns = [(name, values.tolist()) for name, values in stats.items()]
+            for i, auction in enumerate(auctions.values()):
+                auction["stats"] = {name: values[i] for name, values in columns}
+
         return auctions, rolls
 
     def register_pool_buy(self, a_id:str, points:int):
-        if a_id not in self.agents:
+        idx = self.agents.get_index(a_id)
+        if idx is None:
             return
         
         points = int(max(points, 0))
@@ -317,77 +314,104 @@ class AuctionHouse:
         self.current_pool_buys[a_id] = points
             
         # register the negative amount of points (if any)
-        self.agents[a_id]["points"] -= points
+        self.agents.points[idx] -= points
 
     
     def process_pool_buys(self):
+        if not self.current_pool_buys:
+            return
 
-        total_amount = max(1, sum(self.current_pool_buys.values()))
+        agent_idx = np.array([self.agents.index(a_id) for a_id in self.current_pool_buys.keys()], dtype=np.int64)
+        points = np.array(list(self.current_pool_buys.values()), dtype=np.int64)
 
-        # now divide the pool by the fraction each player has bought
-        for a_id, points in self.current_pool_buys.items():
+        total_amount = max(1, int(points.sum()))
 
-            fraction = points / total_amount
-            gold_return = int(self.gold_in_pool * fraction)
-            if points > 0:
-                gold_return = max(1, gold_return)
+        # now divide the pool by the fraction each player has bought
+        fraction = points / total_amount
+        gold_return = (self.gold_in_pool * fraction).astype(np.int64)
+        gold_return[points > 0] = np.maximum(1, gold_return[points > 0])
 
-            self.agents[a_id]["gold"] += gold_return
+        np.add.at(self.agents.gold, agent_idx, gold_return)
 
 
 
     def register_bid(self, a_id:str, auction_id:str, gold:int):       
+        if metrics.ENABLED:
+            metrics.inc("ah_bids_received_total")
+
         if auction_id not in self.current_auctions:
-            return
+            return self._bid_rejected("unknown_auction")
         
-        if a_id not in self.agents:
-            return
+        idx = self.agents.get_index(a_id)
+        if idx is None:
+            return self._bid_rejected("unknown_agent")
 
         gold = int(gold)
         if gold < 1:
-            return
+            return self._bid_rejected("invalid_gold")
 
-                
-        if self.agents[a_id]["gold"] < gold:
-            return
+        agents_gold = self.agents.gold
+        if agents_gold[idx] < gold:
+            return self._bid_rejected("not_enough_gold")
+
+        self.current_bids.add(idx, auction_id, gold)
+        agents_gold[idx] -= gold
 
-        self.current_bids[auction_id].append( (a_id, gold) )
-        self.agents[a_id]["gold"] -= gold
+    def _bid_rejected(self, reason:str):
+        if metrics.ENABLED:
+            metrics.inc("ah_bids_rejected_total", reason=reason)
 
     
-    def process_all_bids(self):        
-
-        gold_from_non_winning_bids = 0
-        for auction_id, bids in self.current_bids.items():
-            if not bids:
-                continue
-            points = self.current_rolls.get(auction_id)
-            if points is None:
-                continue
-            win_amount = max(bids, key=lambda x:x[1])[1]
-            tied = [a_id for a_id, bid in bids if bid == win_amount]
-            if len(tied) == 1:
-                winner = tied[0]
-            else:
-                winner = max(tied, key=lambda a: self.priority.get(a, 0))
-                losers_tied = [a for a in tied if a != winner]
-                if losers_tied:
-                    weights = [1.0 / max(self.priority.get(a, 1), 1) for a in losers_tied]
-                    swap_with = random.choices(losers_tied, weights=weights, k=1)[0]
-                    pw = self.priority.get(winner, 0)
-                    pl = self.priority.get(swap_with, 0)
-                    self.priority[winner] = pl
-                    self.priority[swap_with] = pw
-
-            # update now that we know the winners
-            for a_id, bid in bids:
-                if a_id == winner and bid == win_amount:
-                    self.agents[a_id]["points"] += points
-                else:
-                    back_value = int(bid * self.gold_back_fraction)
-                    removed_value = max(0, bid - back_value)
-                    gold_from_non_winning_bids += removed_value
-                    self.agents[a_id]["gold"] += back_value
+    def process_all_bids(self):
+        bids = self.current_bids
+        self.current_winners = {}
+        if len(bids) == 0:
+            self.gold_in_pool = len(self.agents)
+            return
+
+        auctions, agents, gold = bids.columns()
+        order, starts, ends, top_gold, top_count = bids.top_bids()
+
+        # every auction in the book has at least one bid, so group i is auction index i
+        winner_agent = agents[order[ends - 1]].copy()
+
+        # a tie is won by the highest priority, and the winner swaps priority with one
+        # of the tied losers. A swap changes the priorities seen by later ties, so the
+        # (rare) tied auctions are settled one at a time in the order they were bid on.
+        priority = self.agents.priority
+        for g in np.flatnonzero(top_count > 1).tolist():
+            group = order[starts[g]:ends[g]]
+            tied = agents[np.sort(group[gold[group] == top_gold[g]])].tolist()
+
+            winner = max(tied, key=lambda i: priority[i])
+            winner_agent[g] = winner
+
+            losers_tied = [i for i in tied if i != winner]
+            if losers_tied:
+                weights = np.array([1.0 / max(int(priority[i]), 1) for i in losers_tied])
+                swap_with = losers_tied[self.priority_rng.choice(len(losers_tied), p=weights / weights.sum())]
+                priority[winner], priority[swap_with] = priority[swap_with], priority[winner]
+
+        rolls = [self.current_rolls.get(auction_id) for auction_id in bids.auction_ids]
+        known = np.array([r is not None for r in rolls], dtype=bool)
+        points = np.array([0 if r is None else r for r in rolls], dtype=np.int64)
+
+        # logged with the auction, a tie can't be told from the bids alone
+        self.current_winners = {bids.auction_ids[g]: self.agents.ids[a]
+                                for g, a in enumerate(winner_agent.tolist()) if known[g]}
+
+        is_known = known[auctions]
+        wins = is_known & (agents == winner_agent[auctions]) & (gold == top_gold[auctions])
+        losers = is_known & ~wins
+
+        # losers get a fraction of their bid back, the rest goes to the pool
+        back_value = (gold[losers] * self.gold_back_fraction).astype(np.int64)
+        removed_value = np.maximum(0, gold[losers] - back_value)
+        gold_from_non_winning_bids = int(removed_value.sum())
+
+        # update now that we know the winners
+        # np.add.at sums in int64, bincount weights would go through float64
+        np.add.at(self.agents.gold, agents[losers], back_value)
+        np.add.at(self.agents.points, agents[wins], points[auctions[wins]])
 
         self.gold_in_pool = max(len(self.agents), int(gold_from_non_winning_bids * self.convert_to_pool_fraction))
-        
\ No newline at end of file
@@ -0,0 +1,89 @@
+from array import array
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class BidBook:
+    """Columnar store of the bids placed during one round.
+
+    Every bid is one row of (auction index, agent index, gold) in typed arrays.
+    Auctions are interned to dense indices in the order they are first bid on,
+    agents use their AgentRegistry index. Winner selection and refunds are then
+    computed with grouped array operations instead of per-auction python lists.
+    """
+
+    def __init__(self, agent_ids:List[str]):
+        self.agent_ids = agent_ids
+        self.auction_ids: List[str] = []
+        self._auction_index: Dict[str, int] = {}
+
+        self._auctions = array("q")
+        self._agents = array("q")
+        self._gold = array("q")
+
+    def __len__(self):
+        return len(self._gold)
+
+    def add(self, agent_idx:int, auction_id:str, gold:int):
+        auction_idx = self._auction_index.get(auction_id)
+        if auction_idx is None:
+            auction_idx = len(self.auction_ids)
+            self._auction_index[auction_id] = auction_idx
+            self.auction_ids.append(auction_id)
+
+        self._auctions.append(auction_idx)
+        self._agents.append(agent_idx)
+        self._gold.append(gold)
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Zero-copy (auction index, agent index, gold) views of all rows."""
+        return (np.frombuffer(self._auctions, dtype=np.int64),
+                np.frombuffer(self._agents, dtype=np.int64),
+                np.frombuffer(self._gold, dtype=np.int64))
+
+    def top_bids(self):
+        """Group the bids by auction and find the highest bid of each group.
+
+        Returns (order, starts, ends, top_gold, top_count): `order` sorts the rows
+        by (auction, gold), each auction occupies order[starts[i]:ends[i]] and
+        `top_count` is the number of bids equal to the highest bid `top_gold`.
+        Groups are in auction index order, which is the order of the first bid.
+        """
+        auctions, _, gold = self.columns()
+        order = np.lexsort((gold, auctions))
+        sorted_auctions = auctions[order]
+        sorted_gold = gold[order]
+
+        starts = np.flatnonzero(np.r_[True, sorted_auctions[1:] != sorted_auctions[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        top_gold = sorted_gold[ends - 1]
+
+        group_sizes = ends - starts
+        is_top = sorted_gold == np.repeat(top_gold, group_sizes)
+        top_count = np.add.reduceat(is_top.astype(np.int64), starts)
+
+        return order, starts, ends, top_gold, top_count
+
+    def sorted_bids(self) -> Dict[str, List[dict]]:
+        """The bids per auction, highest first and in arrival order for equal bids."""
+        out = {}
+        if len(self) == 0:
+            return out
+
+        auctions, agents, gold = self.columns()
+        order = np.lexsort((np.arange(len(gold)), -gold, auctions))
+
+        sorted_auctions = auctions[order].tolist()
+        sorted_agents = agents[order].tolist()
+        sorted_gold = gold[order].tolist()
+
+        for auction_idx, agent_idx, g in zip(sorted_auctions, sorted_agents, sorted_gold):
+            auction_id = self.auction_ids[auction_idx]
+            bids = out.get(auction_id)
+            if bids is None:
+                bids = []
+                out[auction_id] = bids
+            bids.append({"a_id": self.agent_ids[agent_idx], "gold": g})
+
+        return out
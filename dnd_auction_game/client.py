@@ -3,19 +3,28 @@ import random
 import asyncio
 import json
 import os
+from collections import OrderedDict
+from typing import Optional
 
 import machineid
 import websockets
 from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
 
+from dnd_auction_game.protocol import ENCODINGS, apply_states_delta, bank_state_from_round, decode_message, encode_message, msgpack
+
 
 class AuctionGameClient:
-    def __init__(self, host:str, agent_name:str, token:str="play123", player_id:str="<identifier>", port:int=8000):
+    def __init__(self, host:str, agent_name:str, token:str="play123", player_id:str="<identifier>", port:int=8000,
+                 economy_schedule:bool=True, game_id:str=None, encoding:str="json", delta:bool=False):
         self.host = host
         self.port = port
         self.player_id = player_id
+        self.economy_schedule = economy_schedule
 
         self.token = token
+        self.game_id = game_id
+        self.encoding = encoding
+        self.delta = delta
         self.agent_name = agent_name        
         self.log_file = None
         
@@ -24,6 +33,12 @@ class AuctionGameClient:
         
         if len(self.agent_name) > 64:
             raise ValueError("Agent name is too long: '{}'".format(self.agent_name))
+
+        if self.encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding: '{}'".format(self.encoding))
+
+        if self.encoding == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack encoding needs the msgpack package: pip install msgpack")
         
         if self.host.lower() == "localhost" or self.host == "127.0.0.1":
             self.agent_id = "local_rand_id_{}".format(random.randint(100, 1000000))
@@ -49,8 +64,21 @@ class AuctionGameClient:
         agent_info["name"] = self.agent_name
         agent_info["a_id"] = self.agent_id
         agent_info["player_id"] = self.player_id[0:128]
-
-        connection_str = "ws://{}:{}/ws/{}".format(self.host, self.port, self.token)
+        # ask for the economy schedule once instead of its remainder every round
+        agent_info["economy_schedule"] = self.economy_schedule
+        agent_info["encoding"] = self.encoding
+        # only receive the states that we can't predict from the last round we answered
+        # (needs the economy schedule)
+        agent_info["delta"] = self.delta and self.economy_schedule
+        economy = None
+        known_states = OrderedDict()
+        # json until the server answers in msgpack (it falls back to json if it can't)
+        encoding = "json"
+
+        if self.game_id is None:
+            connection_str = "ws://{}:{}/ws/{}".format(self.host, self.port, self.token)
+        else:
+            connection_str = "ws://{}:{}/ws/{}/{}".format(self.host, self.port, self.game_id, self.token)
         print("connecting to: {}".format(connection_str))
 
         try:
@@ -62,17 +90,24 @@ class AuctionGameClient:
                                 
                 while True:
                     round_data_raw = await sock.recv()
-                    round_data = json.loads(round_data_raw)
+                    if isinstance(round_data_raw, bytes):
+                        encoding = "msgpack"
+                    round_data = decode_message(round_data_raw)
+
+                    if "economy" in round_data:
+                        economy = round_data["economy"]
+
+                    if not self._read_states(round_data, known_states, economy):
+                        # delta against a round we don't have: skip it and ask for a keyframe
+                        await sock.send(encode_message({"round": round_data["round"], "resync": True}, encoding))
+                        continue
                     
                     round_data["current_agent"] = self.agent_id
                     with open(self.log_file, "a") as fp:
                         fp.write("{}\n".format(json.dumps(round_data)))
                         
 
-                    bank_state = {}
-                    bank_state["gold_income_per_round"] = round_data["remainder_gold_income"]
-                    bank_state["bank_interest_per_round"] = round_data["remainder_bank_interest"]
-                    bank_state["bank_limit_per_round"] = round_data["remainder_bank_limit"]
+                    bank_state = bank_state_from_round(round_data, economy)
                     
                     new_bids = bid_callback(self.agent_id, 
                                             round_data["round"],
@@ -83,7 +118,10 @@ class AuctionGameClient:
                                             round_data["prev_pool_buys"],
                                             bank_state)    
 
-                    await sock.send(json.dumps(new_bids))
+                    # tag the answer with the round, so the server knows who is done
+                    answer = dict(new_bids) if new_bids else {}
+                    answer["round"] = round_data["round"]
+                    await sock.send(encode_message(answer, encoding))
         
         except ConnectionClosedError:
             print("<ERROR: Connection to server closed>")
@@ -91,6 +129,27 @@ class AuctionGameClient:
         except ConnectionClosedOK:
             pass
 
+    @staticmethod
+    def _read_states(round_data:dict, known_states:OrderedDict, economy:Optional[dict]) -> bool:
+        """Put the full states of a round message in round_data["states"] and remember them.
+
+        False if the message is a delta against a round that is not known. make_bid
+        gets copies, so changing them does not alter the states later deltas are
+        applied to.
+        """
+        states = apply_states_delta(round_data, known_states, economy)
+        if states is None:
+            return False
+
+        known_states[round_data["round"]] = states
+        while len(known_states) > 32:
+            known_states.popitem(last=False)
+
+        round_data.pop("states_base", None)
+        round_data.pop("states_delta", None)
+        round_data["states"] = {a_id: dict(state) for a_id, state in states.items()}
+        return True
+
 
 
       
@@ -1,28 +1,263 @@
-from typing import List
+
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
 import asyncio
+import time
 from fastapi import (
     WebSocket,
+    WebSocketDisconnect,
 )
 
+from dnd_auction_game import metrics
+from dnd_auction_game.protocol import Payloads, decode_message
+
+
+class AgentConnection:
+    """A connected websocket plus the protocol options from its handshake.
+
+    Messages to the agent go through a bounded queue that a writer task
+    drains, so a slow agent only falls behind itself. Round states are
+    droppable: a newer one replaces any round state still waiting, since only
+    the newest round matters to a bidder. If the queue is full anyway, the
+    oldest message waiting is dropped to make room, the agent stays connected.
+    """
+
+    def __init__(self, websocket: WebSocket, a_id: Optional[str] = None, economy_schedule: bool = False,
+                 encoding: str = "json", delta: bool = False, max_queue: int = 8):
+        self.websocket = websocket
+        self.a_id = a_id
+        self.economy_schedule = economy_schedule
+        self.encoding = encoding
+        self.schedule_sent = False
+
+        # delta protocol: the last round the agent answered, i.e. has the states of
+        self.delta = delta
+        self.acked_round: Optional[int] = None
+
+        self.last_send_latency: Optional[float] = None
+        self.send_failures = 0
+
+        self.max_queue = max(1, max_queue)
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.n_overflowed = 0
+        self.max_depth = 0
+        self._pending: Deque[Tuple[Union[str, bytes], Optional[Callable], bool]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self.writer_task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def _events(self) -> Tuple[asyncio.Event, asyncio.Event]:
+        # created lazily so they belong to the running event loop
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._wakeup, self._idle
+
+    def enqueue(self, data: Union[str, bytes], on_sent: Optional[Callable] = None, droppable: bool = False) -> bool:
+        """Queue a message for the writer. False if the queue was full and older messages were dropped."""
+        if droppable and self._pending:
+            kept = deque(item for item in self._pending if not item[2])
+            self.n_dropped += len(self._pending) - len(kept)
+            self._pending = kept
+
+        overflowed = False
+        while len(self._pending) >= self.max_queue:
+            self._pending.popleft()
+            self.n_dropped += 1
+            self.n_overflowed += 1
+            overflowed = True
+
+        self._pending.append((data, on_sent, droppable))
+        self.max_depth = max(self.max_depth, len(self._pending))
+        wakeup, idle = self._events()
+        idle.clear()
+        wakeup.set()
+        return not overflowed
+
+    async def drain(self, timeout: float):
+        """Wait until everything queued has been sent (or the timeout passed)."""
+        _, idle = self._events()
+        try:
+            await asyncio.wait_for(idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_writer(self, send_timeout: Optional[float], semaphore: asyncio.Semaphore, on_failure: Callable):
+        wakeup, idle = self._events()
+        while True:
+            if not self._pending:
+                idle.set()
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+
+            data, on_sent, _ = self._pending.popleft()
+            try:
+                async with semaphore:
+                    send_started = time.perf_counter()
+                    if send_timeout:
+                        # a send that was cut off may have left half a frame, so it ends the connection
+                        await asyncio.wait_for(send_encoded(self.websocket, data), timeout=send_timeout)
+                    else:
+                        await send_encoded(self.websocket, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.send_failures += 1
+                idle.set()
+                await on_failure(self, repr(e))
+                return
+
+            self.last_send_latency = time.perf_counter() - send_started
+            self.n_sent += 1
+            if metrics.ENABLED:
+                metrics.mark("ah_ws_messages_sent_total")
+                metrics.observe("ah_send_latency_seconds", self.last_send_latency)
+            # only now, e.g. the economy schedule counts as delivered
+            if on_sent is not None:
+                on_sent(self)
+
+
+async def receive_message(websocket: WebSocket):
+    """The next message from an agent, json from text frames or msgpack from binary ones."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+
+    if metrics.ENABLED:
+        metrics.mark("ah_ws_messages_received_total")
+    if message.get("bytes") is not None:
+        return decode_message(message["bytes"])
+    return decode_message(message["text"])
+
+
+async def send_encoded(websocket: WebSocket, data: Union[str, bytes]):
+    if isinstance(data, str):
+        await websocket.send_text(data)
+    else:
+        await websocket.send_bytes(data)
+
+
+class BroadcastStats:
+    """Outcome of one broadcast: how many messages were queued, how many older
+    round states they replaced, and which connections had a full queue and lost
+    their oldest waiting messages."""
 
-class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.duration = 0.0
+        self.queued = 0
+        self.coalesced = 0
+        self.overflowed: List[Optional[str]] = []
 
-    async def add_connection(self, websocket: WebSocket):
-        self.active_connections.append(websocket)
+    def summary(self) -> dict:
+        return {
+            "duration": self.duration,
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "overflowed": len(self.overflowed),
+        }
 
-    def disconnect(self, websocket: WebSocket):
+
+class ConnectionManager:
+    # send_timeout: seconds a single send may take before the agent is disconnected, 0 or None waits forever
+    def __init__(self, max_concurrent_sends: int = 64, max_queue: int = 8, send_timeout: Optional[float] = 10.0):
+        self.active_connections: List[AgentConnection] = []
+        self.max_concurrent_sends = max_concurrent_sends
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.last_broadcast: Optional[BroadcastStats] = None
+        self.total_failed = 0
+        self.total_overflowed = 0
+        # what connections that are gone had sent and dropped
+        self._closed_sent = 0
+        self._closed_dropped = 0
+
+    def _send_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrent_sends))
+        return self._semaphore
+
+    @property
+    def total_sent(self) -> int:
+        return self._closed_sent + sum(c.n_sent for c in self.active_connections)
+
+    @property
+    def total_dropped(self) -> int:
+        return self._closed_dropped + sum(c.n_dropped for c in self.active_connections)
+
+    def queue_depths(self) -> Dict[Optional[str], int]:
+        return {c.a_id: c.queue_depth for c in self.active_connections}
+
+    def stats(self) -> dict:
+        """Counters for monitoring: sends, superseded round states dropped, failures and queue depths."""
+        depths = [c.queue_depth for c in self.active_connections]
+        latencies = sorted(c.last_send_latency for c in self.active_connections if c.last_send_latency is not None)
+        return {
+            "connections": len(self.active_connections),
+            "sent": self.total_sent,
+            "dropped": self.total_dropped,
+            "failed": self.total_failed,
+            "overflowed": self.total_overflowed,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            "last_send_latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "last_send_latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    async def add_connection(self, websocket: WebSocket, a_id: Optional[str] = None, economy_schedule: bool = False,
+                             encoding: str = "json", delta: bool = False) -> AgentConnection:
+        connection = AgentConnection(websocket, a_id=a_id, economy_schedule=economy_schedule, encoding=encoding,
+                                     delta=delta, max_queue=self.max_queue)
+        connection.writer_task = asyncio.create_task(
+            connection.run_writer(self.send_timeout, self._send_semaphore(), self._writer_failed))
+        self.active_connections.append(connection)
+        return connection
+
+    def _remove(self, connection: AgentConnection):
         try:
-            self.active_connections.remove(websocket)
-        except ValueError: #already removed from list
+            self.active_connections.remove(connection)
+        except ValueError:
+            return
+
+        self._closed_sent += connection.n_sent
+        self._closed_dropped += connection.n_dropped
+        if connection.writer_task is not None and connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+
+    async def _writer_failed(self, connection: AgentConnection, error: str):
+        print("agent: {} dropped, send failed: {}".format(connection.a_id, error))
+        self.total_failed += 1
+        self._remove(connection)
+        try:
+            await connection.websocket.close()
+        except:
             pass
-        
-    async def disconnect_all(self):
+
+    def disconnect(self, websocket: WebSocket):
+        for connection in [c for c in self.active_connections if c.websocket is websocket]:
+            self._remove(connection)
+
+    async def disconnect_all(self, drain_timeout: float = 1.0):
         print("disconnect all")
-        for ws in self.active_connections:
+        # let the writers deliver what is queued first, e.g. the last round
+        connections = list(self.active_connections)
+        await asyncio.gather(*(c.drain(drain_timeout) for c in connections))
+
+        for connection in connections:
+            self._remove(connection)
             try:
-                await ws.close()            
+                await connection.websocket.close()
+            except RuntimeError:
+                # already closed by its handler while we were draining
+                pass
             except:
                 print("error closing connection")
                 pass
@@ -32,19 +267,32 @@ class ConnectionManager:
     async def send_message(self, message: dict, websocket: WebSocket):
         await websocket.send_json(message)
 
-    async def broadcast(self, message: dict, timeout: float = 1.0):
-        stale = []
+    async def broadcast(self, message) -> BroadcastStats:
+        """Queue a message for every connection.
+
+        `message` is a dict sent to everyone or a protocol.RoundPayloads that picks
+        the variant each connection gets. Every distinct payload is encoded once
+        per wire encoding (json or msgpack). The writer task of each connection
+        does the sending, so a slow client only delays itself. A round state
+        replaces an older one still waiting in the queue; a connection whose queue
+        is full anyway loses its oldest waiting messages but stays connected.
+        """
+        if isinstance(message, dict):
+            message = Payloads(message)
+
+        stats = BroadcastStats()
+        started = time.perf_counter()
+
         for connection in list(self.active_connections):
-            try:
-                await asyncio.wait_for(connection.send_json(message), timeout=timeout)
-            except Exception:
-                stale.append(connection)
-        for ws in stale:
-            try:
-                await ws.close()
-            except:
-                pass
-            try:
-                self.active_connections.remove(ws)
-            except ValueError:
-                pass
+            dropped_before = connection.n_dropped
+            overflowed_before = connection.n_overflowed
+            queued = connection.enqueue(message.encoded_for(connection), on_sent=message.sent, droppable=message.droppable)
+            stats.queued += 1
+            stats.coalesced += (connection.n_dropped - dropped_before) - (connection.n_overflowed - overflowed_before)
+            if not queued:
+                stats.overflowed.append(connection.a_id)
+                self.total_overflowed += connection.n_overflowed - overflowed_before
+
+        stats.duration = time.perf_counter() - started
+        self.last_broadcast = stats
+        return stats
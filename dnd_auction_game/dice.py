@@ -0,0 +1,204 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def _sum_counts(die:int, num:int) -> Tuple[int, ...]:
+    # number of ways to roll each total 0..num*die with `num` dice of size `die`
+    counts = np.zeros(1, dtype=np.int64)
+    counts[0] = 1
+    face = np.ones(die + 1, dtype=np.int64)
+    face[0] = 0
+    for _ in range(num):
+        counts = np.convolve(counts, face)
+    return tuple(counts.tolist())
+
+
+class DiceTable:
+    """Precomputed distributions of `num`d`die` rolls.
+
+    Each (die, num) combination is one row of a padded CDF matrix over the dice
+    total, the bonus only shifts the distribution. Scalar lookups are O(1) and
+    the batch_* methods take arrays of auctions. Combinations that were not
+    precomputed are added on first use.
+    """
+
+    def __init__(self, combinations:Iterable[Tuple[int, int]]=()):
+        self._rows: Dict[Tuple[int, int], int] = {}
+        self._row_die = np.zeros(0, dtype=np.int64)
+        self._row_num = np.zeros(0, dtype=np.int64)
+        self._cdf = np.ones((0, 1), dtype=np.float64)
+        self._stats_cache: Dict[Tuple[int, int, int], dict] = {}
+        self._index = np.full((1, 1), -1, dtype=np.int64)
+
+        self.add(combinations)
+
+    @classmethod
+    def for_generator(cls, die_sizes, max_n_die) -> "DiceTable":
+        """Table covering every (die, num) the AuctionHouse auction generator can emit."""
+        combinations = set()
+        for die, max_n in zip(die_sizes, max_n_die):
+            for num in range(1, max_n + 1):
+                combinations.add((die, num))
+        return cls(sorted(combinations))
+
+    def add(self, combinations:Iterable[Tuple[int, int]]):
+        new = [(int(d), int(n)) for d, n in combinations if (int(d), int(n)) not in self._rows]
+        new = sorted(set(new))
+        if not new:
+            return
+
+        combos = list(self._rows.keys()) + new
+        width = max(die * num for die, num in combos) + 1
+
+        cdf = np.ones((len(combos), width), dtype=np.float64)
+        for row, (die, num) in enumerate(combos):
+            counts = np.asarray(_sum_counts(die, num), dtype=np.int64)
+            cumulative = np.cumsum(counts)
+            cdf[row, :len(counts)] = cumulative / cumulative[-1]
+
+        self._rows = {combo: row for row, combo in enumerate(combos)}
+        self._row_die = np.array([d for d, _ in combos], dtype=np.int64)
+        self._row_num = np.array([n for _, n in combos], dtype=np.int64)
+        self._cdf = cdf
+
+        # dense (die, num) -> row lookup for the batch methods
+        index = np.full((self._row_die.max() + 1, self._row_num.max() + 1), -1, dtype=np.int64)
+        index[self._row_die, self._row_num] = np.arange(len(combos))
+        self._index = index
+
+    def _row(self, die:int, num:int) -> int:
+        row = self._rows.get((die, num))
+        if row is None:
+            self.add([(die, num)])
+            row = self._rows[(die, num)]
+        return row
+
+    def _batch_rows(self, dies:np.ndarray, nums:np.ndarray) -> np.ndarray:
+        dies = np.asarray(dies, dtype=np.int64)
+        nums = np.asarray(nums, dtype=np.int64)
+
+        in_range = (dies < self._index.shape[0]) & (nums < self._index.shape[1])
+        rows = np.full(dies.shape, -1, dtype=np.int64)
+        rows[in_range] = self._index[dies[in_range], nums[in_range]]
+        if (rows < 0).any():
+            self.add(zip(dies[rows < 0].tolist(), nums[rows < 0].tolist()))
+            return self._batch_rows(dies, nums)
+        return rows
+
+    def pmf(self, die:int, num:int, bonus:int=0) -> Tuple[np.ndarray, np.ndarray]:
+        """(points, probability) arrays for every possible outcome."""
+        counts = np.asarray(_sum_counts(die, num), dtype=np.float64)
+        values = np.arange(num, num * die + 1)
+        return values + bonus, counts[num:] / counts.sum()
+
+    def mean(self, die:int, num:int, bonus:int=0) -> float:
+        return num * (die + 1) / 2 + bonus
+
+    def variance(self, die:int, num:int, bonus:int=0) -> float:
+        return num * (die * die - 1) / 12
+
+    def std(self, die:int, num:int, bonus:int=0) -> float:
+        return self.variance(die, num) ** 0.5
+
+    def cdf(self, die:int, num:int, bonus:int, k:int) -> float:
+        """P(points <= k)"""
+        row = self._row(die, num)
+        cdf_row = self._cdf[row]
+        idx = k - bonus
+        if idx < 0:
+            return 0.0
+        if idx >= len(cdf_row):
+            return 1.0
+        return float(cdf_row[idx])
+
+    def prob_at_least(self, die:int, num:int, bonus:int, k:int) -> float:
+        """P(points >= k)"""
+        return 1.0 - self.cdf(die, num, bonus, k - 1)
+
+    def quantile(self, die:int, num:int, bonus:int, q:float) -> int:
+        """Smallest number of points p with P(points <= p) >= q."""
+        row = self._row(die, num)
+        cdf_row = self._cdf[row]
+        return int(np.searchsorted(cdf_row, q - 1e-12)) + bonus
+
+    def stats(self, die:int, num:int, bonus:int=0) -> dict:
+        """Summary of one auction, memoized per (die, num, bonus)."""
+        key = (die, num, bonus)
+        stats = self._stats_cache.get(key)
+        if stats is None:
+            stats = {
+                "mean": self.mean(die, num, bonus),
+                "std": self.std(die, num, bonus),
+                "min": num + bonus,
+                "max": num * die + bonus,
+                "p10": self.quantile(die, num, bonus, 0.1),
+                "p50": self.quantile(die, num, bonus, 0.5),
+                "p90": self.quantile(die, num, bonus, 0.9),
+            }
+            self._stats_cache[key] = stats
+        return stats
+
+    def batch_stats(self, dies, nums, bonuses) -> Dict[str, np.ndarray]:
+        """Same fields as stats() for arrays of auctions."""
+        dies = np.asarray(dies, dtype=np.int64)
+        nums = np.asarray(nums, dtype=np.int64)
+        bonuses = np.asarray(bonuses, dtype=np.int64)
+        rows = self._batch_rows(dies, nums)
+        cdf = self._cdf[rows]
+
+        out = {
+            "mean": nums * (dies + 1) / 2 + bonuses,
+            "std": np.sqrt(nums * (dies * dies - 1) / 12),
+            "min": nums + bonuses,
+            "max": nums * dies + bonuses,
+        }
+        for name, q in (("p10", 0.1), ("p50", 0.5), ("p90", 0.9)):
+            out[name] = (cdf < q - 1e-12).sum(axis=1) + bonuses
+        return out
+
+    def batch_prob_at_least(self, dies, nums, bonuses, k) -> np.ndarray:
+        """P(points >= k) for arrays of auctions; k may be a scalar or an array."""
+        bonuses = np.asarray(bonuses, dtype=np.int64)
+        rows = self._batch_rows(dies, nums)
+        idx = np.asarray(k, dtype=np.int64) - 1 - bonuses
+        idx = np.broadcast_to(idx, rows.shape)
+
+        below = np.ones(rows.shape, dtype=np.float64)
+        below[idx < 0] = 0.0
+        inside = (idx >= 0) & (idx < self._cdf.shape[1])
+        below[inside] = self._cdf[rows[inside], idx[inside]]
+        return 1.0 - below
+
+    def batch_from_auctions(self, auctions:Dict[str, dict]) -> Tuple[list, np.ndarray, np.ndarray, np.ndarray]:
+        """Split an auctions dict into (auction ids, dies, nums, bonuses) arrays."""
+        auction_ids = list(auctions.keys())
+        values = list(auctions.values())
+        dies = np.fromiter((a["die"] for a in values), dtype=np.int64, count=len(values))
+        nums = np.fromiter((a["num"] for a in values), dtype=np.int64, count=len(values))
+        bonuses = np.fromiter((a["bonus"] for a in values), dtype=np.int64, count=len(values))
+        return auction_ids, dies, nums, bonuses
+
+
+_default_table: Optional[DiceTable] = None
+
+
+def default_table() -> DiceTable:
+    """Shared table for the default AuctionHouse auction generator."""
+    global _default_table
+    if _default_table is None:
+        from dnd_auction_game.auction_house import DIE_SIZES, MAX_N_DIE
+        _default_table = DiceTable.for_generator(DIE_SIZES, MAX_N_DIE)
+    return _default_table
+
+
+def auction_stats(auction:dict) -> dict:
+    """Mean, std, min, max and 10/50/90% quantiles of the points an auction gives."""
+    return default_table().stats(auction["die"], auction["num"], auction["bonus"])
+
+
+def prob_at_least(auction:dict, k:int) -> float:
+    """Probability that an auction gives at least k points."""
+    return default_table().prob_at_least(auction["die"], auction["num"], auction["bonus"], k)
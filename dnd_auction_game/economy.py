@@ -0,0 +1,170 @@
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+
+# Each walk restarts from a fresh value every `reset_every` rounds, so the game is
+# made of independent segments: [start, reset, step, step, ..., reset, step, ...].
+# The steps of all segments in a block are drawn in one call and the clamped walk
+# is advanced for every segment of the block at once, one position at a time.
+BLOCK_ROUNDS = 1 << 16
+
+SeedLike = Union[None, int, np.random.SeedSequence]
+
+
+def _gold_draws(rng:np.random.Generator, n_segments:int, n_steps:int) -> Tuple[np.ndarray, np.ndarray]:
+    step_size = 150
+    resets = 1000 + rng.integers(-step_size // 2, step_size, size=n_segments, endpoint=True)
+    steps = rng.integers(-step_size, step_size, size=(n_segments, n_steps), endpoint=True) - 1
+    return resets, steps
+
+def _bank_limit_draws(rng:np.random.Generator, n_segments:int, n_steps:int) -> Tuple[np.ndarray, np.ndarray]:
+    step_size = 150
+    resets = np.full(n_segments, 5000, dtype=np.int64)
+    steps = rng.integers(-step_size, step_size, size=(n_segments, n_steps), endpoint=True)
+    return resets, steps
+
+def _interest_draws(rng:np.random.Generator, n_segments:int, n_steps:int) -> Tuple[np.ndarray, np.ndarray]:
+    step_size = 0.02
+    resets = 1.00 + rng.uniform(-step_size, step_size, size=n_segments)
+    steps = rng.uniform(-step_size, step_size, size=(n_segments, n_steps))
+    return resets, steps
+
+
+class RandomWalk:
+    """A clamped random walk with periodic resets, materialized lazily in blocks.
+
+    Behaves like a read-only list of length `n_steps`: indexing returns python
+    numbers and slicing returns lists. Only the blocks that are touched get
+    generated, and every block has its own random stream derived from `seed`,
+    so the values do not depend on the order in which they are accessed.
+    """
+
+    def __init__(self, n_steps:int, start, min_value, max_value, reset_every:int,
+                 draws:Callable, dtype, seed:SeedLike=None):
+        self.n_steps = max(0, int(n_steps))
+        self.start = start
+        self.min_value = min_value
+        self.max_value = max_value
+        self.reset_every = reset_every
+        self.dtype = dtype
+        self._draws = draws
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self._seed = seed
+
+        self.segments_per_block = max(1, BLOCK_ROUNDS // reset_every)
+        self.block_rounds = self.segments_per_block * reset_every
+        self._blocks: Dict[int, np.ndarray] = {}
+
+    def __len__(self):
+        return self.n_steps
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, (RandomWalk, list, tuple)):
+            return len(self) == len(other) and self.tolist() == list(other)
+        return NotImplemented
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.n_steps)
+            if step != 1:
+                return self.tolist()[key]
+            return self.values(start, stop).tolist()
+
+        if key < 0:
+            key += self.n_steps
+        if key < 0 or key >= self.n_steps:
+            raise IndexError("random walk index out of range")
+        if key == 0:
+            return self.dtype(self.start).item()
+
+        b = self._block_of(key)
+        return self._block(b)[key - 1 - b * self.block_rounds].item()
+
+    def tolist(self) -> list:
+        # a block at a time, so a worker thread building a long walk lets the event loop run in between
+        out = []
+        for start in range(0, self.n_steps, self.block_rounds):
+            out.extend(self.values(start, start + self.block_rounds).tolist())
+        return out
+
+    def values(self, start:int, stop:int) -> np.ndarray:
+        """The walk between start and stop as a numpy array."""
+        start = max(0, start)
+        stop = min(self.n_steps, stop)
+        if stop <= start:
+            return np.zeros(0, dtype=self.dtype)
+
+        parts = []
+        if start == 0:
+            parts.append(np.array([self.start], dtype=self.dtype))
+            start = 1
+
+        if stop > start:
+            first = self._block_of(start)
+            last = self._block_of(stop - 1)
+            offset = 1 + first * self.block_rounds
+            chunk = np.concatenate([self._block(b) for b in range(first, last + 1)])
+            parts.append(chunk[start - offset:stop - offset])
+
+        return np.concatenate(parts)
+
+    def _block_of(self, index:int) -> int:
+        return (index - 1) // self.block_rounds
+
+    def _block(self, b:int) -> np.ndarray:
+        block = self._blocks.get(b)
+        if block is None:
+            block = self._generate_block(b)
+            self._blocks[b] = block
+        return block
+
+    def _generate_block(self, b:int) -> np.ndarray:
+        # only generate the segments that fall inside the walk
+        first_round = 1 + b * self.block_rounds
+        remaining = self.n_steps - first_round
+        n_segments = min(self.segments_per_block, -(-remaining // self.reset_every))
+
+        block_seed = np.random.SeedSequence(self._seed.entropy, spawn_key=self._seed.spawn_key + (b,))
+        rng = np.random.default_rng(block_seed)
+        resets, steps = self._draws(rng, n_segments, self.reset_every - 1)
+
+        out = np.empty((n_segments, self.reset_every), dtype=self.dtype)
+        x = resets.astype(self.dtype)
+        out[:, 0] = x
+        for j in range(self.reset_every - 1):
+            x = np.minimum(np.maximum(x + steps[:, j], self.min_value), self.max_value)
+            out[:, j + 1] = x
+
+        return out.reshape(-1)[:remaining]
+
+
+def gold_random_walk(n_steps:int, seed:SeedLike=None) -> RandomWalk:
+    return RandomWalk(n_steps, start=1000, min_value=10, max_value=3000, reset_every=500,
+                      draws=_gold_draws, dtype=np.int64, seed=seed)
+
+def bank_limit_random_walk(n_steps:int, seed:SeedLike=None) -> RandomWalk:
+    return RandomWalk(n_steps, start=5000, min_value=50, max_value=20000, reset_every=300,
+                      draws=_bank_limit_draws, dtype=np.int64, seed=seed)
+
+def interest_rate_random_walk(n_steps:int, seed:SeedLike=None) -> RandomWalk:
+    return RandomWalk(n_steps, start=1.00, min_value=1.0, max_value=1.1, reset_every=250,
+                      draws=_interest_draws, dtype=np.float64, seed=seed)
+
+
+def generate_gold_random_walk(n_steps:int, seed:SeedLike=None) -> List[int]:
+    return gold_random_walk(n_steps, seed).tolist()
+
+def braavos_bank_limit_random_walk(n_steps:int, seed:SeedLike=None) -> List[int]:
+    return bank_limit_random_walk(n_steps, seed).tolist()
+
+def braavos_bank_interest_rate_random_walk(n_steps:int, seed:SeedLike=None) -> List[float]:
+    return interest_rate_random_walk(n_steps, seed).tolist()
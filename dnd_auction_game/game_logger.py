@@ -0,0 +1,427 @@
+import atexit
+import glob
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from dnd_auction_game import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIONS = (None, "gzip", "zstd")
+_COMPRESSED_EXT = {"gzip": ".gz", "zstd": ".zst"}
+
+# Index sidecars of a log file: <file>.idx holds a (round, byte offset, length)
+# record per round line of that file (offsets into the uncompressed text), and
+# <log>.agents has a json line {"a_id", "round"} for the first round of every agent.
+INDEX_DTYPE = np.dtype([("round", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+
+def segment_path(path:str, n:int) -> str:
+    """Name of the n-th closed segment of a rotated log: log_1.jsonln -> log_1.0001.jsonln"""
+    stem, ext = os.path.splitext(path)
+    return "{}.{:04d}{}".format(stem, n, ext)
+
+
+def log_segments(path:str) -> List[str]:
+    """The closed (rotated) segments of a log, oldest first, compressed or not."""
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"\.(\d{4})" + re.escape(ext) + r"(\.gz|\.zst)?$")
+
+    segments = []
+    for candidate in glob.glob(glob.escape(stem) + ".[0-9][0-9][0-9][0-9]" + ext + "*"):
+        m = pattern.match(os.path.basename(candidate))
+        if m:
+            segments.append((int(m.group(1)), candidate))
+    return [p for _, p in sorted(segments)]
+
+
+def log_exists(path:str) -> bool:
+    return os.path.isfile(path) or len(log_segments(path)) > 0
+
+
+def uncompressed_path(path:str) -> str:
+    for ext in _COMPRESSED_EXT.values():
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def index_path(path:str) -> str:
+    """The round index of a log file or segment (the same for its compressed version)."""
+    return uncompressed_path(path) + ".idx"
+
+
+def agents_index_path(path:str) -> str:
+    return path + ".agents"
+
+
+def _log_numbers(template:str) -> Iterator[int]:
+    directory, name = os.path.split(template)
+    head, tail = name.split("{}")
+    pattern = re.compile(re.escape(head) + r"(\d+)(\.\d{4})?" + re.escape(tail) + r"(\.gz|\.zst)?$")
+    try:
+        entries = os.listdir(directory or ".")
+    except OSError:
+        return
+    for entry in entries:
+        m = pattern.match(entry)
+        if m:
+            yield int(m.group(1))
+
+
+def claim_log_file(template:str, manifest:str) -> Tuple[int, str]:
+    """Create the first free log file template.format(n) and return (n, path).
+
+    The manifest remembers the next number, so a directory with thousands of
+    logs is not probed one number at a time; without it the directory is listed
+    once. The file is created with O_EXCL, so two processes never get the same
+    log, and a stale manifest only costs a few extra probes.
+    """
+    n = None
+    try:
+        with open(manifest, "r", encoding="utf-8") as fp:
+            n = int(json.load(fp)["next"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if n is None or n < 1:
+        n = max(_log_numbers(template), default=0) + 1
+
+    while True:
+        path = template.format(n)
+        if not log_exists(path):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                break
+            except FileExistsError:
+                pass
+        n += 1
+
+    tmp = "{}.{}.tmp".format(manifest, os.getpid())
+    try:
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump({"next": n + 1}, fp)
+        os.replace(tmp, manifest)
+    except OSError as e:
+        print("error writing log manifest '{}': {}".format(manifest, e))
+    return n, path
+
+
+def open_segment(path:str):
+    """Open one log file for reading text, whatever its compression."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("'{}' is zstd compressed, install zstandard to read it".format(path))
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_log_lines(path:str) -> Iterator[str]:
+    """Every line of a log, through all its rotated segments and the active file."""
+    files = log_segments(path)
+    if os.path.isfile(path):
+        files.append(path)
+
+    for f in files:
+        with open_segment(f) as fp:
+            for line in fp:
+                if line.strip():
+                    yield line
+
+
+def _compress(path:str, compression:str) -> str:
+    out = path + _COMPRESSED_EXT[compression]
+    if compression == "gzip":
+        with open(path, "rb") as src, gzip.open(out, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    else:
+        with open(path, "rb") as src, open(out, "wb") as dst:
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+    os.remove(path)
+    return out
+
+
+class GameLogger:
+    """Appends json lines to one log file, through the shared LogWriter thread.
+
+    write() never touches the disk: entries are encoded and written in batches
+    by the writer thread. With rotate_bytes or rotate_rounds set, the active
+    file is closed and renamed to the next segment (see segment_path) when it
+    gets too large or holds that many round states, and closed segments can be
+    compressed. Write errors are retried with a backoff, meanwhile the entries
+    wait in memory (at most max_pending, then the oldest are dropped).
+
+    With index=True the round index and the agents index (see INDEX_DTYPE) are
+    written next to the log, for logs.LogReader.
+    """
+
+    def __init__(self, path:str, rotate_bytes:Optional[int]=None, rotate_rounds:Optional[int]=None,
+                 compression:Optional[str]=None, max_pending:int=100000, writer:Optional["LogWriter"]=None,
+                 index:bool=False):
+        if compression not in COMPRESSIONS:
+            raise ValueError("unknown log compression: '{}'".format(compression))
+        if compression == "zstd" and zstandard is None:
+            print("zstandard is not installed, compressing logs with gzip")
+            compression = "gzip"
+
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        self.rotate_rounds = rotate_rounds
+        self.compression = compression
+        self.max_pending = max_pending
+        self.writer = writer
+        self.index = index
+
+        self.n_written = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+
+        # only touched by the writer thread
+        self._pending: List[Tuple[str, Optional[int], Optional[list]]] = []  # (json line, round, agent ids)
+        self._agents = set()
+        self._retry_at = 0.0
+        self._backoff = 0.0
+        self._size: Optional[int] = None
+        self._rounds = 0
+        self._next_segment: Optional[int] = None
+
+    def write(self, entry:dict) -> bool:
+        writer = self.writer or default_writer()
+        if not writer.put(self, entry):
+            self.n_dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout:Optional[float]=None) -> bool:
+        """Wait until everything written so far is on disk (or the timeout passed)."""
+        writer = self.writer or default_writer()
+        return writer.flush(timeout)
+
+    def _write_batch(self, entries:List[dict], now:float):
+        """Called by the writer thread."""
+        for entry in entries:
+            agents = list(entry["states"]) if self.index and "states" in entry else None
+            self._pending.append((json.dumps(entry), entry.get("round"), agents))
+        if len(self._pending) > self.max_pending:
+            dropped = len(self._pending) - self.max_pending
+            self.n_dropped += dropped
+            del self._pending[:dropped]
+            print("log '{}': buffer full, dropped {} entries".format(self.path, dropped))
+
+        if not self._pending or now < self._retry_at:
+            return
+
+        try:
+            self._append_pending()
+            self._backoff = 0.0
+        except OSError as e:
+            self.n_errors += 1
+            self._backoff = min(30.0, max(0.5, self._backoff * 2))
+            self._retry_at = now + self._backoff
+            print("error writing log '{}' (retrying in {}s): {}".format(self.path, self._backoff, e))
+
+    def _append_pending(self):
+        if self._size is None:
+            self._size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+        while self._pending:
+            # lines up to the next rotation point go out in one write
+            chunk = []
+            chunk_size = 0
+            chunk_rounds = 0
+            records = []
+            new_agents = []
+            for line, round, agents in self._pending:
+                if chunk and self._should_rotate(self._size + chunk_size, self._rounds + chunk_rounds):
+                    break
+                length = len(line.encode("utf-8"))
+                chunk.append(line)
+                if round is not None:
+                    chunk_rounds += 1
+                    records.append((round, self._size + chunk_size, length))
+                    for a_id in agents or ():
+                        if a_id not in self._agents:
+                            self._agents.add(a_id)
+                            new_agents.append((a_id, round))
+                chunk_size += length + 1
+
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write("\n".join(chunk) + "\n")
+
+            del self._pending[:len(chunk)]
+            self.n_written += len(chunk)
+            self._size += chunk_size
+            self._rounds += chunk_rounds
+            self._write_index(records, new_agents)
+
+            if self._should_rotate(self._size, self._rounds):
+                self._rotate()
+
+    def _write_index(self, records:list, new_agents:list):
+        if not self.index:
+            return
+        try:
+            if records:
+                with open(index_path(self.path), "ab") as fp:
+                    fp.write(np.array(records, dtype=INDEX_DTYPE).tobytes())
+            if new_agents:
+                with open(agents_index_path(self.path), "a", encoding="utf-8") as fp:
+                    fp.write("".join(json.dumps({"a_id": a_id, "round": r}) + "\n" for a_id, r in new_agents))
+        except OSError as e:
+            # an incomplete index is worse than none: readers rebuild a missing one
+            print("error writing index of log '{}', not indexing it any more: {}".format(self.path, e))
+            self.index = False
+            for p in (index_path(self.path), agents_index_path(self.path)):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def _should_rotate(self, size:int, rounds:int) -> bool:
+        if self.rotate_bytes is not None and size >= self.rotate_bytes:
+            return True
+        if self.rotate_rounds is not None and rounds >= self.rotate_rounds:
+            return True
+        return False
+
+    def _rotate(self):
+        if self._next_segment is None:
+            existing = log_segments(self.path)
+            self._next_segment = 1
+            if existing:
+                m = re.search(r"\.(\d{4})\.", os.path.basename(existing[-1]))
+                self._next_segment = int(m.group(1)) + 1
+
+        closed = segment_path(self.path, self._next_segment)
+        os.replace(self.path, closed)
+        if os.path.isfile(index_path(self.path)):
+            os.replace(index_path(self.path), index_path(closed))
+        self._next_segment += 1
+        self._size = 0
+        self._rounds = 0
+
+        if self.compression is not None:
+            try:
+                _compress(closed, self.compression)
+            except OSError as e:
+                print("error compressing log segment '{}': {}".format(closed, e))
+
+
+class LogWriter:
+    """One background thread writing the entries of every GameLogger.
+
+    Entries wait in a bounded queue; the thread takes them in batches and
+    writes each logger's share with one open/write, at least every
+    flush_interval seconds. If the queue is full, write() drops the entry.
+    """
+
+    def __init__(self, max_buffer:int=100000, flush_interval:float=0.2, batch_size:int=5000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Tuple[Optional[GameLogger], object]]" = queue.Queue(maxsize=max_buffer)
+        self._loggers: Dict[int, GameLogger] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="auction-log-writer", daemon=True)
+                    self._thread.start()
+
+    def put(self, logger:GameLogger, entry:dict) -> bool:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((logger, entry))
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self, timeout:Optional[float]=None) -> bool:
+        """Block until everything queued before this call has been handled."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+
+    def _write(self, batch):
+        # keep the order per logger, and only signal a flush once what came before it is written
+        by_logger: Dict[int, List[dict]] = {}
+        flushed = []
+        for logger, entry in batch:
+            if logger is None:
+                flushed.append(entry)
+                continue
+            self._loggers[id(logger)] = logger
+            by_logger.setdefault(id(logger), []).append(entry)
+
+        now = time.monotonic()
+        started = time.perf_counter()
+        for key, logger in list(self._loggers.items()):
+            try:
+                logger._write_batch(by_logger.get(key, []), now)
+            except Exception as e:
+                print("error in log writer:", e)
+            if not logger._pending:
+                del self._loggers[key]
+        if metrics.ENABLED and by_logger:
+            metrics.observe("ah_log_write_seconds", time.perf_counter() - started)
+            metrics.inc("ah_log_entries_total", len(batch) - len(flushed))
+
+        for done in flushed:
+            done.set()
+
+
+_default_writer: Optional[LogWriter] = None
+_default_writer_lock = threading.Lock()
+
+
+def default_writer() -> LogWriter:
+    global _default_writer
+    if _default_writer is None:
+        with _default_writer_lock:
+            if _default_writer is None:
+                _default_writer = LogWriter()
+    return _default_writer
+
+
+def flush_all(timeout:float=5.0) -> bool:
+    """Wait for the logs to reach the disk, e.g. before the process exits."""
+    if _default_writer is None:
+        return True
+    return _default_writer.flush(timeout)
+
+
+atexit.register(flush_all)
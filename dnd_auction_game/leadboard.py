@@ -1,5 +1,10 @@
+import bisect
 import html
+import json
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 
@@ -9,7 +14,7 @@ env = Environment(
     autoescape=select_autoescape(["html", "xml"]),
 )
 
-def generate_leadboard(players, round, is_done, bank_state, gold_in_pool):
+def generate_leadboard(players, round, is_done, bank_state, gold_in_pool, api_url="/api/leadboard", watch_url="/ws_watch"):
 
     template = env.get_template("leadboard.html")
     return template.render(
@@ -20,8 +25,124 @@ def generate_leadboard(players, round, is_done, bank_state, gold_in_pool):
         interest_rate=bank_state["bank_interest_per_round"],
         gold_limit=bank_state["bank_limit_per_round"],
         gold_in_pool=gold_in_pool,
+        api_url=api_url,
+        watch_url=watch_url,
     )
 
 
+class LeadboardRanks:
+    """Leaderboard order and rank move signals, kept up to date incrementally.
+
+    Agents are referred to by their AgentRegistry index. The order is a sorted
+    list of (-points, index), so ties keep join order; on every sync only the
+    agents whose points changed are moved. A rank move shows for 5 rounds
+    (up) or 10 rounds (down).
+    """
+
+    def __init__(self):
+        self.round = -1
+        self._keys: List[Tuple[int, int]] = []
+        self._points = np.zeros(0, dtype=np.int64)
+        self._prev_rank = np.zeros(0, dtype=np.int64)
+        self.move = np.zeros(0, dtype=np.int8)
+        self.remaining = np.zeros(0, dtype=np.int64)
+
+    def sync(self, points:np.ndarray) -> List[int]:
+        """Agent indexes, most points first."""
+        known = len(self._points)
+        for i in np.flatnonzero(points[:known] != self._points).tolist():
+            del self._keys[bisect.bisect_left(self._keys, (-int(self._points[i]), i))]
+            bisect.insort(self._keys, (-int(points[i]), i))
+        for i in range(known, len(points)):
+            bisect.insort(self._keys, (-int(points[i]), i))
+        self._points = np.array(points, dtype=np.int64)
+        return [i for _, i in self._keys]
+
+    def next_round(self, points:np.ndarray, round:int) -> List[int]:
+        """Sync, and once per round decay the rank signals and flag the agents that moved."""
+        order = self.sync(points)
+        if round == self.round:
+            return order
+        self.round = round
+
+        n = len(order)
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(1, n + 1)
+
+        keep = (self.remaining > 1) & (self.move != 0)
+        self.remaining = np.where(keep, self.remaining - 1, 0)
+        self.move = np.where(keep, self.move, 0).astype(np.int8)
+        self.remaining.resize(n, refcheck=False)
+        self.move.resize(n, refcheck=False)
+
+        known = len(self._prev_rank)
+        up = np.flatnonzero(rank[:known] < self._prev_rank)
+        down = np.flatnonzero(rank[:known] > self._prev_rank)
+        self.move[up], self.remaining[up] = 1, 5
+        self.move[down], self.remaining[down] = -1, 10
+        self._prev_rank = rank
+        return order
+
+
+class LeadboardSnapshot:
+    """The leaderboard of one game at one version, encoded once for every request.
+
+    `data` is what /api/leadboard returns (and what spectators are sent) and
+    `page` what the html page is rendered from. The json is encoded up front,
+    the html per url pair on first use. `etag` identifies the version, see
+    Lobby.leadboard_version.
+    """
+
+    def __init__(self, etag:str, data:dict, page:dict):
+        self.etag = etag
+        self.data = data
+        self.page = page
+        self.text = json.dumps(data)
+        self.json = self.text.encode("utf-8")
+        self._html: Dict[Tuple[str, str], bytes] = {}
+
+    def html(self, api_url:str="/api/leadboard", watch_url:str="/ws_watch") -> bytes:
+        rendered = self._html.get((api_url, watch_url))
+        if rendered is None:
+            state = self.page["state"]
+            rendered = generate_leadboard(
+                state["players"],
+                self.page["round"],
+                self.page["is_done"],
+                bank_state={
+                    "gold_income_per_round": state["gold_income"],
+                    "bank_interest_per_round": state["interest_rate"],
+                    "bank_limit_per_round": state["gold_limit"],
+                },
+                gold_in_pool=state["gold_in_pool"],
+                api_url=api_url,
+                watch_url=watch_url,
+            ).encode("utf-8")
+            self._html[(api_url, watch_url)] = rendered
+        return rendered
+
+    def matches(self, if_none_match:Optional[str]) -> bool:
+        """True if an If-None-Match header names this version."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or "W/" + self.etag in tags
+
+
+class SnapshotPayload:
+    """A leaderboard snapshot as a ConnectionManager.broadcast message for spectators.
+
+    Every spectator gets the same text frame, and a newer snapshot replaces one
+    that is still waiting in a slow spectator's queue.
+    """
+
+    droppable = True
+
+    def __init__(self, snapshot:LeadboardSnapshot):
+        self.snapshot = snapshot
 
+    def encoded_for(self, connection) -> str:
+        return self.snapshot.text
 
+    def sent(self, connection):
+        pass
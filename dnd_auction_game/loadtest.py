@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.request import urlopen
+
+import numpy as np
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+from dnd_auction_game.play import AuctionGameRunner
+from dnd_auction_game.protocol import ENCODINGS, apply_states_delta, bank_state_from_round, decode_message, encode_message
+from dnd_auction_game.replay import load_callback
+from dnd_auction_game.sim import BidCallback
+
+
+# Capacity benchmark: thousands of agents on one event loop, each speaking the
+# AuctionGameClient protocol on its own websocket, in one game started with
+# play.AuctionGameRunner.
+#
+#   python -m dnd_auction_game.loadtest --agents 2000 --rounds 50 --round-mode event
+#
+# Every agent gets the same round messages, so a message is decoded (and its
+# states rebuilt from a delta) once for all the agents that receive it. The bid
+# behaviours are shared by the agents and must treat their arguments as read-only.
+
+
+def bid_random(agent_id:str, round:int, states:dict, auctions:dict, prev_auctions:dict, pool:int,
+               prev_pool_buys:dict, bank_state:dict) -> dict:
+    """A few random bids, up to a tenth of the gold each."""
+    gold = states[agent_id]["gold"]
+    bids = {}
+    for auction_id in random.sample(list(auctions), min(len(auctions), 3)):
+        bid = random.randint(1, max(1, gold // 10))
+        if bid > gold:
+            break
+        bids[auction_id] = bid
+        gold -= bid
+    return {"bids": bids, "pool": 0}
+
+
+def bid_tiny(agent_id:str, round:int, states:dict, auctions:dict, prev_auctions:dict, pool:int,
+             prev_pool_buys:dict, bank_state:dict) -> dict:
+    """1 gold on every auction."""
+    gold = states[agent_id]["gold"]
+    return {"bids": {auction_id: 1 for auction_id in list(auctions)[:gold]}, "pool": 0}
+
+
+def bid_all_in(agent_id:str, round:int, states:dict, auctions:dict, prev_auctions:dict, pool:int,
+               prev_pool_buys:dict, bank_state:dict) -> dict:
+    """Everything on one auction: many ties and rejected bids once the gold runs out."""
+    gold = states[agent_id]["gold"]
+    if not auctions:
+        return {}
+    return {"bids": {random.choice(list(auctions)): gold + 1 if random.random() < 0.1 else gold}, "pool": 0}
+
+
+def bid_pool(agent_id:str, round:int, states:dict, auctions:dict, prev_auctions:dict, pool:int,
+             prev_pool_buys:dict, bank_state:dict) -> dict:
+    """Buys from the pool with some points now and then."""
+    points = states[agent_id]["points"]
+    return {"bids": {}, "pool": random.randint(1, points) if points > 0 and random.random() < 0.2 else 0}
+
+
+def bid_idle(agent_id:str, round:int, states:dict, auctions:dict, prev_auctions:dict, pool:int,
+             prev_pool_buys:dict, bank_state:dict) -> dict:
+    """Only answers the round."""
+    return {}
+
+
+BEHAVIOURS: Dict[str, BidCallback] = {
+    "random": bid_random,
+    "tiny": bid_tiny,
+    "all_in": bid_all_in,
+    "pool": bid_pool,
+    "idle": bid_idle,
+}
+
+
+def parse_mix(spec:str) -> List[Tuple[str, BidCallback, float]]:
+    """'random=3,tiny=1,mypkg.agent:make_bid=1' -> [(name, make_bid, weight)]"""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().rpartition("=") if "=" in part else (part.strip(), "", "1")
+        callback = BEHAVIOURS.get(name)
+        if callback is None:
+            if ":" not in name:
+                raise ValueError("unknown behaviour '{}', use one of {} or module:function".format(name, sorted(BEHAVIOURS)))
+            callback = load_callback(name)
+        mix.append((name, callback, float(weight)))
+    return mix
+
+
+def percentiles(values:List[float]) -> dict:
+    if not values:
+        return {"n": 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {"n": len(values), "p50": p50, "p90": p90, "p99": p99, "max": max(values)}
+
+
+class LoadTest:
+    """N agents in one game: connects them, starts the game and collects the numbers for report()."""
+
+    def __init__(self, host:str="localhost", port:int=8000, n_agents:int=100, n_rounds:int=20,
+                 token:str="play123", play_token:str="play123", game_id:Optional[str]=None,
+                 mix:Optional[List[Tuple[str, BidCallback, float]]]=None, encoding:str="json", delta:bool=True,
+                 round_mode:Optional[str]=None, round_time:Optional[float]=None, connect_concurrency:int=200):
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding: '{}'".format(encoding))
+
+        self.host = host
+        self.port = port
+        self.n_agents = n_agents
+        self.n_rounds = n_rounds
+        self.token = token
+        self.play_token = play_token
+        self.game_id = game_id
+        self.mix = mix or parse_mix("random")
+        self.encoding = encoding
+        self.delta = delta
+        self.round_mode = round_mode
+        self.round_time = round_time
+        self.connect_concurrency = connect_concurrency
+
+        self.run_id = random.randint(100, 1000000)
+        self.a_ids = set()
+        self.connected = 0
+        self.failed = 0
+        self.errors = 0
+
+        # first time any agent saw a round, and how much later every other agent did
+        self.first_seen: Dict[int, float] = {}
+        self.fanout: List[float] = []
+        self.callback_time: List[float] = []
+        self.bids_sent: Dict[int, int] = {}
+        self.bids_accepted: Dict[int, int] = {}
+
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.bytes_received = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+        self._decoded: Dict[Union[str, bytes], Tuple[dict, Optional[dict]]] = {}
+        self._decoded_round = -1
+
+    def _url(self, path:str) -> str:
+        if self.game_id is None:
+            return "ws://{}:{}/{}/{}".format(self.host, self.port, path, self.token)
+        return "ws://{}:{}/{}/{}/{}".format(self.host, self.port, path, self.game_id, self.token)
+
+    def _decode(self, raw:Union[str, bytes], known_states:Dict[int, dict], economy:Optional[dict]):
+        cached = self._decoded.get(raw)
+        if cached is not None:
+            return cached
+
+        round_data = decode_message(raw)
+        if "economy" in round_data:
+            economy = round_data["economy"]
+        states = apply_states_delta(round_data, known_states, economy)
+        if states is None:
+            return round_data, None
+
+        # only the messages of the newest round are kept
+        if round_data["round"] > self._decoded_round:
+            self._decoded = {}
+            self._decoded_round = round_data["round"]
+        self._decoded[raw] = (round_data, states)
+        return round_data, states
+
+    def _round_seen(self, round_data:dict):
+        now = time.perf_counter()
+        r = round_data["round"]
+        first = self.first_seen.get(r)
+        if first is not None:
+            self.fanout.append(now - first)
+            return
+
+        self.first_seen[r] = now
+        # the first agent to see a round counts how many of last round's bids made it
+        accepted = 0
+        for info in round_data.get("prev_auctions", {}).values():
+            accepted += sum(1 for bid in info.get("bids", []) if bid["a_id"] in self.a_ids)
+        self.bids_accepted[r - 1] = accepted
+
+    async def agent(self, i:int, make_bid:BidCallback, connect_slots:asyncio.Semaphore):
+        a_id = "load_{}_{}".format(self.run_id, i)
+        self.a_ids.add(a_id)
+        agent_info = {
+            "name": "load_{}".format(i),
+            "a_id": a_id,
+            "player_id": "loadtest",
+            "economy_schedule": True,
+            "encoding": self.encoding,
+            "delta": self.delta,
+        }
+        economy = None
+        known_states: Dict[int, dict] = OrderedDict()
+
+        try:
+            async with connect_slots:
+                sock = await websockets.connect(self._url("ws"), max_size=None, ping_interval=None)
+                await sock.send(json.dumps(agent_info))
+            self.connected += 1
+        except Exception as e:
+            self.failed += 1
+            if self.failed <= 5:
+                print("agent {} could not connect: {!r}".format(i, e))
+            return
+
+        try:
+            while True:
+                raw = await sock.recv()
+                self.messages_received += 1
+                self.bytes_received += len(raw)
+                encoding = "msgpack" if isinstance(raw, bytes) else "json"
+
+                round_data, states = self._decode(raw, known_states, economy)
+                if "economy" in round_data:
+                    economy = round_data["economy"]
+                if states is None:
+                    await sock.send(encode_message({"round": round_data["round"], "resync": True}, encoding))
+                    self.messages_sent += 1
+                    continue
+
+                r = round_data["round"]
+                known_states[r] = states
+                while len(known_states) > 32:
+                    known_states.popitem(last=False)
+                self._round_seen(round_data)
+
+                started = time.perf_counter()
+                try:
+                    answer = make_bid(a_id, r, states, round_data["auctions"], round_data["prev_auctions"],
+                                      round_data["pool"], round_data["prev_pool_buys"],
+                                      bank_state_from_round(round_data, economy))
+                except Exception as e:
+                    self.errors += 1
+                    if self.errors <= 5:
+                        print("error in make_bid for agent {}: {!r}".format(a_id, e))
+                    answer = {}
+                self.callback_time.append(time.perf_counter() - started)
+
+                answer = dict(answer) if answer else {}
+                answer["round"] = r
+                self.bids_sent[r] = self.bids_sent.get(r, 0) + len(answer.get("bids", {}))
+                await sock.send(encode_message(answer, encoding))
+                self.messages_sent += 1
+
+        except ConnectionClosed:
+            pass
+        finally:
+            await sock.close()
+
+    def _num_players(self) -> Optional[int]:
+        try:
+            lobbies = json.loads(urlopen("http://{}:{}/api/lobbies".format(self.host, self.port), timeout=5).read())
+        except Exception:
+            return None
+        game_id = self.game_id or "default"
+        for lobby in lobbies.get("lobbies", []):
+            if lobby["game_id"] == game_id:
+                return lobby["num_players"]
+        return None
+
+    async def wait_for_players(self, timeout:float=60.0):
+        """Until the server has every connected agent (or the timeout passed)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            n = await asyncio.to_thread(self._num_players)
+            if n is not None and n >= self.connected:
+                return
+            await asyncio.sleep(0.5)
+        print("<only {} of {} agents joined>".format(self._num_players(), self.connected))
+
+    def server_metrics(self) -> Optional[dict]:
+        try:
+            return json.loads(urlopen("http://{}:{}/api/metrics".format(self.host, self.port), timeout=5).read())
+        except Exception:
+            return None
+
+    async def run(self) -> dict:
+        weights = [w for _, _, w in self.mix]
+        chosen = random.choices(self.mix, weights=weights, k=self.n_agents)
+        connect_slots = asyncio.Semaphore(max(1, self.connect_concurrency))
+
+        connect_started = time.perf_counter()
+        tasks = [asyncio.create_task(self.agent(i, make_bid, connect_slots)) for i, (_, make_bid, _) in enumerate(chosen)]
+        while self.connected + self.failed < self.n_agents:
+            await asyncio.sleep(0.1)
+        connect_time = time.perf_counter() - connect_started
+        print("<{} agents connected in {:.1f}s, {} failed>".format(self.connected, connect_time, self.failed))
+        await self.wait_for_players()
+
+        metrics_before = await asyncio.to_thread(self.server_metrics)
+        runner = AuctionGameRunner(self.host, self.play_token, n_rounds=self.n_rounds, port=self.port,
+                                   round_mode=self.round_mode, time_per_round=self.round_time, game_id=self.game_id)
+        self.started = time.perf_counter()
+        await asyncio.to_thread(runner.run)
+        await asyncio.gather(*tasks)
+        self.finished = time.perf_counter()
+        metrics_after = await asyncio.to_thread(self.server_metrics)
+
+        report = self.report(connect_time)
+        report["behaviours"] = {name: sum(1 for c in chosen if c[0] == name) for name, _, _ in self.mix}
+        report["server"] = server_summary(metrics_before, metrics_after)
+        return report
+
+    def report(self, connect_time:float=0.0) -> dict:
+        rounds = sorted(self.first_seen)
+        intervals = [b - a for a, b in zip([self.first_seen[r] for r in rounds], [self.first_seen[r] for r in rounds[1:]])]
+        settled = [r for r in self.bids_sent if r in self.bids_accepted]
+        sent = sum(self.bids_sent[r] for r in settled)
+        accepted = sum(self.bids_accepted[r] for r in settled)
+        duration = max(self.finished - self.started, 1e-9)
+
+        return {
+            "agents": self.n_agents,
+            "connected": self.connected,
+            "failed": self.failed,
+            "connect_seconds": connect_time,
+            "rounds": len(rounds),
+            "duration": duration,
+            "rounds_per_second": len(rounds) / duration,
+            "round_interval": percentiles(intervals),
+            "fanout_delay": percentiles(self.fanout),
+            "make_bid_time": percentiles(self.callback_time),
+            "bids_sent": sent,
+            "bids_accepted": accepted,
+            "bid_acceptance": accepted / sent if sent else None,
+            "make_bid_errors": self.errors,
+            "messages_received_per_second": self.messages_received / duration,
+            "messages_sent_per_second": self.messages_sent / duration,
+            "mb_received_per_second": self.bytes_received / duration / 2**20,
+        }
+
+
+def server_summary(before:Optional[dict], after:Optional[dict]) -> Optional[dict]:
+    """Mean time per tick phase and bid counters of the server during the test (needs AH_METRICS=1)."""
+    if after is None or not after["process"]["enabled"]:
+        return None
+
+    def totals(export):
+        sums = {}
+        for h in (export or {"process": {"histograms": []}})["process"]["histograms"]:
+            name = h["name"] + "".join("/{}".format(v) for v in h["labels"].values())
+            sums[name] = (h["sum"], h["count"])
+        for c in (export or {"process": {"counters": []}})["process"]["counters"]:
+            name = c["name"] + "".join("/{}".format(v) for v in c["labels"].values())
+            sums[name] = (c["value"], None)
+        return sums
+
+    start, end = totals(before), totals(after)
+    summary = {}
+    for name, (total, count) in end.items():
+        prev_total, prev_count = start.get(name, (0, 0))
+        if count is None:
+            summary[name] = total - prev_total
+        elif count > (prev_count or 0):
+            summary[name + " mean_ms"] = 1000 * (total - prev_total) / (count - (prev_count or 0))
+    return summary
+
+
+def _ms(p:dict) -> str:
+    if not p.get("n"):
+        return "-"
+    return "p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f} ms".format(*(1000 * p[k] for k in ("p50", "p90", "p99", "max")))
+
+
+def print_report(report:dict):
+    print("agents:            {} connected, {} failed ({:.1f}s to connect)".format(
+        report["connected"], report["failed"], report["connect_seconds"]))
+    print("behaviours:        {}".format(", ".join("{} {}".format(k, v) for k, v in report["behaviours"].items())))
+    print("rounds:            {} in {:.1f}s ({:.2f}/s)".format(report["rounds"], report["duration"], report["rounds_per_second"]))
+    print("round interval:    {}".format(_ms(report["round_interval"])))
+    print("fan-out delay:     {}".format(_ms(report["fanout_delay"])))
+    print("make_bid:          {}".format(_ms(report["make_bid_time"])))
+    acceptance = report["bid_acceptance"]
+    print("bids:              {} sent, {} accepted ({})".format(
+        report["bids_sent"], report["bids_accepted"], "-" if acceptance is None else "{:.1%}".format(acceptance)))
+    print("messages:          {:.0f}/s received ({:.2f} MB/s), {:.0f}/s sent".format(
+        report["messages_received_per_second"], report["mb_received_per_second"], report["messages_sent_per_second"]))
+    if report["server"]:
+        print("server (AH_METRICS):")
+        for name, value in sorted(report["server"].items()):
+            print("  {:<60} {:.3f}".format(name, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m dnd_auction_game.loadtest",
+                                     description="Play one game with many simulated agents and report the server's capacity.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--token", default="play123", help="game token")
+    parser.add_argument("--play-token", default="play123")
+    parser.add_argument("--game-id", default=None, help="lobby to play in (default: the default game)")
+    parser.add_argument("--behaviours", default="random",
+                        help="weighted mix of {} or module:function, e.g. random=3,tiny=1".format(",".join(BEHAVIOURS)))
+    parser.add_argument("--encoding", choices=ENCODINGS, default="json")
+    parser.add_argument("--no-delta", action="store_true", help="ask for the full states every round")
+    parser.add_argument("--round-mode", choices=("fixed", "event"), default=None)
+    parser.add_argument("--round-time", type=float, default=None, help="(maximum) seconds per round")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="connections opened at once")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    try:
+        import resource
+        # one file descriptor per agent
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = args.agents + 256
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+    except (ImportError, ValueError, OSError) as e:
+        print("could not raise the open file limit:", e)
+
+    test = LoadTest(args.host, args.port, n_agents=args.agents, n_rounds=args.rounds, token=args.token,
+                    play_token=args.play_token, game_id=args.game_id, mix=parse_mix(args.behaviours),
+                    encoding=args.encoding, delta=not args.no_delta, round_mode=args.round_mode,
+                    round_time=args.round_time, connect_concurrency=args.connect_concurrency)
+    report = asyncio.run(test.run())
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,726 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from fastapi import (
+    WebSocket,
+    WebSocketDisconnect,
+)
+
+from dnd_auction_game import metrics
+from dnd_auction_game.connection_manager import ConnectionManager, receive_message
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.leadboard import LeadboardRanks, LeadboardSnapshot, SnapshotPayload
+from dnd_auction_game.protocol import ENCODINGS, RoundPayloads, StateHistory, encode_schedule, negotiate_encoding
+from dnd_auction_game.scheduler import RoundScheduler
+
+
+DEFAULT_GAME_ID = "default"
+GAME_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Lobby:
+    """One game: an AuctionHouse, its connections, round scheduler and tick task."""
+
+    def __init__(self, game_id:str, auction_house:AuctionHouse, connection_manager:ConnectionManager, scheduler:RoundScheduler,
+                 spectators:Optional[ConnectionManager]=None, max_spectators:int=1000):
+        self.game_id = game_id
+        self.auction_house = auction_house
+        self.connection_manager = connection_manager
+        self.scheduler = scheduler
+        # leaderboard watchers, sent a snapshot whenever it changes
+        self.spectators = spectators if spectators is not None else ConnectionManager(max_queue=2)
+        self.max_spectators = max_spectators
+        self._published_etag: Optional[str] = None
+        self.state_history = StateHistory(keep=int(os.environ.get("AH_KEYFRAME_EVERY", "16")))
+        # the economy schedule of the current game, encoded once per encoding
+        self.encoded_schedule: Dict[str, Union[str, bytes]] = {}
+
+        self.ranks = LeadboardRanks()
+        self._reset_lock = threading.Lock()
+
+        # the leaderboard is computed once per version, see leadboard_version
+        self._snapshot: Optional[LeadboardSnapshot] = None
+        self._generation = 0
+        self._etag_prefix = os.urandom(4).hex()
+
+        self.task: Optional[asyncio.Task] = None
+        self.last_activity = time.monotonic()
+
+    def start(self):
+        """Start the tick task on the running event loop (once)."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.server_tick())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.spectators.active_connections:
+            await self.spectators.disconnect_all(drain_timeout=0.0)
+
+    def is_idle(self) -> bool:
+        return not self.auction_house.is_active and len(self.connection_manager.active_connections) == 0
+
+    def reset_game_state(self):
+        """Reset auction house and clear leaderboard rank tracking state."""
+        self.auction_house.reset()
+        self.scheduler.reset()
+        self.state_history.clear()
+        self.encoded_schedule = {}
+        self.ranks = LeadboardRanks()
+        self._generation += 1
+        self._snapshot = None
+
+    def _reset_if_done(self):
+        if self.auction_house.is_done:
+            with self._reset_lock:
+                if self.auction_house.is_done:
+                    self.reset_game_state()
+
+    def compute_leadboard_state(self):
+        auction_house = self.auction_house
+
+        gold_income = 1000
+        interest_rate = 1.0
+        gold_limit = 2000
+        gold_in_pool = max(auction_house.gold_in_pool, 0)
+
+        # 20-round change calculations
+        gold_income_change = 0.0
+        interest_rate_change = 0.0
+        gold_limit_change = 0.0
+
+        try:
+            rc = auction_house.round_counter
+            gold_income = auction_house.gold_income_per_round[rc]
+            interest_rate = auction_house.bank_interest_per_round[rc]
+            gold_limit = auction_house.bank_limit_per_round[rc]
+
+            # Calculate 20-round change (compare current to 20 rounds ago)
+            if rc >= 20:
+                old_income = auction_house.gold_income_per_round[rc - 20]
+                old_interest = auction_house.bank_interest_per_round[rc - 20]
+                old_limit = auction_house.bank_limit_per_round[rc - 20]
+                if old_income > 0:
+                    gold_income_change = ((gold_income - old_income) / old_income) * 100
+                if old_interest > 0:
+                    interest_rate_change = ((interest_rate - old_interest) / old_interest) * 100
+                if old_limit > 0:
+                    gold_limit_change = ((gold_limit - old_limit) / old_limit) * 100
+        except IndexError:
+            pass
+
+        agents = auction_house.agents
+        n_players = len(agents)
+        order = self.ranks.next_round(agents.points, auction_house.round_counter)
+
+        # grade by leaderboard position, the other columns are by agent index
+        rank_fraction = (n_players - np.arange(n_players)) / max(n_players, 1)
+        grades = np.select([rank_fraction > 0.89, rank_fraction > 0.75, rank_fraction > 0.60, rank_fraction > 0.40],
+                           ["A", "B", "C", "D"], "E").tolist()
+        points = agents.points.tolist()
+        gold = agents.gold.tolist()
+        avg_gain_10 = auction_house.gain_history.short_average(n_players).tolist()
+        sparklines = auction_house.gain_history.cumulative(n_players)
+        moves = self.ranks.move.tolist()
+
+        all_players = []
+        for idx, i in enumerate(order):
+            move_val = moves[i]
+            if move_val > 0:
+                rank_move = "up"
+            elif move_val < 0:
+                rank_move = "down"
+            else:
+                rank_move = "none"
+
+            all_players.append(
+                {
+                    "id": agents.ids[i],
+                    "grade": grades[idx] if points[i] > 10 else "F",
+                    "name": agents.names[i],
+                    "gold": gold[i],
+                    "points": points[i],
+                    "avg_gain_10": avg_gain_10[i],
+                    "rank_move": rank_move,
+                    "sparkline": sparklines[i],
+                }
+            )
+
+        # Calculate min/max gold for volume bar normalization (relative scaling)
+        gold_values = [p["gold"] for p in all_players] if all_players else [0]
+        max_gold = max(gold_values) if gold_values else 1
+        min_gold = min(gold_values) if gold_values else 0
+
+        return {
+            "players": all_players,
+            "gold_income": gold_income,
+            "interest_rate": interest_rate,
+            "gold_limit": gold_limit,
+            "gold_in_pool": gold_in_pool,
+            "gold_income_change": round(gold_income_change, 1),
+            "interest_rate_change": round(interest_rate_change, 1),
+            "gold_limit_change": round(gold_limit_change, 1),
+            "max_gold": max_gold,
+            "min_gold": min_gold,
+        }
+
+    def leadboard_version(self) -> str:
+        """ETag of the leaderboard: it changes with the round, the players and every reset.
+
+        Gold spent on bids during a round shows up with the next round.
+        """
+        auction_house = self.auction_house
+        return '"{}-{}-{}-{}-{}{}"'.format(self._etag_prefix, self._generation, auction_house.round_counter,
+                                         len(auction_house.agents), int(auction_house.is_active), int(auction_house.is_done))
+
+    def leadboard_snapshot(self) -> LeadboardSnapshot:
+        version = self.leadboard_version()
+        if self._snapshot is None or self._snapshot.etag != version:
+            state = self.compute_leadboard_state()
+            page = {
+                "state": state,
+                "round": self.auction_house.round_counter,
+                "is_done": self.auction_house.is_done,
+            }
+            self._snapshot = LeadboardSnapshot(version, self._leadboard_data(state), page)
+        return self._snapshot
+
+    def leadboard_data(self) -> dict:
+        return self.leadboard_snapshot().data
+
+    def _leadboard_data(self, state:dict) -> dict:
+        return {
+            "round": self.auction_house.round_counter,
+            "is_done": self.auction_house.is_done,
+            "bank_state": {
+                "gold_income_per_round": state["gold_income"],
+                "bank_interest_per_round": state["interest_rate"],
+                "bank_limit_per_round": state["gold_limit"],
+            },
+            "gold_in_pool": state["gold_in_pool"],
+            "players": state["players"],
+            "max_gold": state["max_gold"],
+            "min_gold": state["min_gold"],
+            "gold_income_change": state["gold_income_change"],
+            "gold_limit_change": state["gold_limit_change"],
+            "interest_rate_change": state["interest_rate_change"],
+        }
+
+    def leadboard_page(self) -> dict:
+        """What the html leaderboard is rendered from."""
+        return self.leadboard_snapshot().page
+
+    async def publish_leadboard(self):
+        """Send the leaderboard to the spectators if it changed since the last time."""
+        if not self.spectators.active_connections:
+            return
+        snapshot = self.leadboard_snapshot()
+        if snapshot.etag == self._published_etag:
+            return
+        self._published_etag = snapshot.etag
+        await self.spectators.broadcast(SnapshotPayload(snapshot))
+
+    def summary(self) -> dict:
+        return {
+            "game_id": self.game_id,
+            "round": self.auction_house.round_counter,
+            "num_rounds": self.auction_house.num_rounds_in_game,
+            "is_active": self.auction_house.is_active,
+            "is_done": self.auction_house.is_done,
+            "num_players": len(self.auction_house.agents),
+            "num_connections": len(self.connection_manager.active_connections),
+            "connections": self.connection_manager.stats(),
+            "num_spectators": len(self.spectators.active_connections),
+        }
+
+    def _connected_agent_ids(self):
+        return {c.a_id for c in self.connection_manager.active_connections if c.a_id in self.auction_house.agents}
+
+    async def server_tick(self):
+        auction_house = self.auction_house
+        connection_manager = self.connection_manager
+        scheduler = self.scheduler
+
+        while True:
+            if not auction_house.is_active:
+                await scheduler.wait_for_game(timeout=1.0)
+                continue
+
+            self.last_activity = time.monotonic()
+            tick_started = time.perf_counter()
+
+            try:
+                with metrics.timer("ah_tick_phase_seconds", phase="process_pool_buys"):
+                    auction_house.process_pool_buys()
+            except Exception as e:
+                print("error in process_pool_buys:", e)
+
+            try:
+                with metrics.timer("ah_tick_phase_seconds", phase="process_all_bids"):
+                    auction_house.process_all_bids()
+            except Exception as e:
+                print("error in process_all_bids:", e)
+
+            round_data = None
+            try:
+                with metrics.timer("ah_tick_phase_seconds", phase="prepare_auctions_and_pool"):
+                    round_data = auction_house.prepare_auctions_and_pool()
+            except Exception as e:
+                print("error in prepare_auctions_and_pool:", e)
+
+            if round_data is not None:
+                self.state_history.record(round_data["round"], auction_house.agents.gold, auction_house.agents.points)
+
+                # start the round before sending it, so fast answers are not missed
+                scheduler.round_started(round_data["round"], self._connected_agent_ids())
+                try:
+                    with metrics.timer("ah_tick_phase_seconds", phase="broadcast"):
+                        payloads = RoundPayloads(round_data, auction_house.economy_schedule(), self.state_history,
+                                                 self.encoded_schedule)
+                        await connection_manager.broadcast(payloads)
+                except Exception as e:
+                    print("error in broadcast:", e)
+
+            if auction_house.round_counter >= auction_house.num_rounds_in_game:
+                auction_house.is_active = False
+                auction_house.is_done = True
+
+                try:
+                    await connection_manager.disconnect_all()
+                except Exception as e:
+                    print("error in disconnect_all:", e)
+
+            try:
+                with metrics.timer("ah_tick_phase_seconds", phase="publish_leadboard"):
+                    await self.publish_leadboard()
+            except Exception as e:
+                print("error publishing leaderboard:", e)
+
+            if metrics.ENABLED:
+                metrics.observe("ah_tick_seconds", time.perf_counter() - tick_started)
+                metrics.inc("ah_rounds_total")
+
+            await scheduler.wait_round_end()
+
+    async def handle_agent(self, websocket:WebSocket, token:str):
+        auction_house = self.auction_house
+        connection_manager = self.connection_manager
+        scheduler = self.scheduler
+
+        if token != auction_house.game_token:
+            return
+
+        self.last_activity = time.monotonic()
+        self._reset_if_done()
+
+        try:
+            await websocket.accept()
+            agent_info = await websocket.receive_json()
+
+            a_id = agent_info.get("a_id", "")
+            name = agent_info.get("name", "")
+            player_id = agent_info.get("player_id", "")
+
+            if len(a_id) < 5 or len(name) < 1 or len(name) > 64:
+                await websocket.close()
+                return
+
+            if len(player_id) < 1:
+                await websocket.close()
+                return
+
+            agent_info["a_id"] = a_id
+            agent_info["name"] = name
+            agent_info["player_id"] = player_id
+            economy_schedule = agent_info.get("economy_schedule", False) is True
+            encoding = negotiate_encoding(agent_info.get("encoding"))
+            delta = agent_info.get("delta", False) is True
+
+        except WebSocketDisconnect:
+            return
+
+        except Exception:
+            return
+
+
+        # Block new players after the game has started; allow reconnections only
+        if auction_house.is_active and agent_info["a_id"] not in auction_house.agents:
+            try:
+                await websocket.close()
+            except:
+                pass
+            return
+
+        try:
+            connection = await connection_manager.add_connection(websocket, a_id=agent_info["a_id"], economy_schedule=economy_schedule,
+                                                                 encoding=encoding, delta=delta)
+            auction_house.add_agent(agent_info["name"], agent_info["a_id"], agent_info["player_id"])
+            a_id = agent_info["a_id"]
+            await self.publish_leadboard()
+
+            while auction_house.is_done is False:
+                bids = {}
+                pool = 0
+
+                bids_and_pool = await receive_message(websocket)
+                try:
+                    round_tag = bids_and_pool.get("round") if isinstance(bids_and_pool, dict) else None
+                    round_tag = round_tag if isinstance(round_tag, int) else None
+                    scheduler.submitted(a_id, round_tag)
+
+                    # the answer acknowledges the round, deltas are based on it from now on
+                    if round_tag is not None:
+                        connection.acked_round = round_tag
+                    if isinstance(bids_and_pool, dict) and bids_and_pool.get("resync"):
+                        connection.acked_round = None
+
+                    if bids_and_pool is None or bids_and_pool == {}:
+                        continue
+
+                    bids = bids_and_pool.get("bids", {})
+                    pool = bids_and_pool.get("pool", 0)
+
+                except Exception as e:
+                    print("error in receive_json:", e)
+                    continue
+
+                try:
+                    if pool > 0:
+                        auction_house.register_pool_buy(a_id, pool)
+
+                    for auction_id, gold in bids.items():
+                        auction_house.register_bid(a_id, auction_id, gold)
+
+                except Exception as e:
+                    print("error in receive_json:", e)
+                    continue
+
+            await websocket.close()
+
+        except WebSocketDisconnect:
+            print("agent: {} disconnected.".format(agent_info["a_id"]))
+            connection_manager.disconnect(websocket)
+            scheduler.agent_left(agent_info["a_id"])
+            return
+
+        except:
+            print("agent: {} was disconnected due to error.".format(agent_info["a_id"]))
+            connection_manager.disconnect(websocket)
+            scheduler.agent_left(agent_info["a_id"])
+            return
+
+    async def handle_runner(self, websocket:WebSocket, play_token:str):
+        auction_house = self.auction_house
+        scheduler = self.scheduler
+
+        print("websocket_endpoint_runner - GAME: {} PLAY TOKEN: {}".format(self.game_id, play_token))
+
+        if play_token != auction_house.play_token:
+            print("wrong play token")
+            return
+
+        self.last_activity = time.monotonic()
+        if auction_house.is_done:
+            print("starting new game")
+        self._reset_if_done()
+
+        try:
+            await websocket.accept()
+
+            game_info = await websocket.receive_json()
+            num_rounds = max(1, int(game_info.get("num_rounds", 10)))
+
+            try:
+                scheduler.configure(
+                    mode=game_info.get("round_mode"),
+                    min_round_time=game_info.get("min_round_time"),
+                    max_round_time=game_info.get("max_round_time"),
+                )
+            except (ValueError, TypeError) as e:
+                print("ignoring round settings:", e)
+
+            print("starting game with {} rounds ({} rounds, {}-{}s)".format(
+                num_rounds, scheduler.mode, scheduler.min_round_time, scheduler.max_round_time))
+
+            # the schedule of a long game takes a while to build and encode, keep it off the event loop.
+            # Before answering, the runner may hang up once it has the answer.
+            self.encoded_schedule = await asyncio.to_thread(self._prepare_game, num_rounds)
+
+            game_info = {
+                "game_id": self.game_id,
+                "game_token": auction_house.game_token,
+                "num_players": len(auction_house.agents),
+            }
+
+            await websocket.send_json(game_info)
+
+        except WebSocketDisconnect:
+            print("game not started due to disconnect.")
+            return
+
+
+        auction_house.start_game(num_rounds)
+        scheduler.game_started()
+        print("<started game '{}', seed: {}>".format(self.game_id, auction_house.seed))
+
+        try:
+            await websocket.close()
+        except:
+            print("game not started due to error.")
+
+    def _prepare_game(self, num_rounds:int) -> Dict[str, Union[str, bytes]]:
+        self.auction_house.prepare_game(num_rounds)
+        schedule = self.auction_house.economy_schedule()
+        return {encoding: encode_schedule(schedule, encoding) for encoding in ENCODINGS
+                if negotiate_encoding(encoding) == encoding}
+
+    async def reset(self, play_token:str) -> dict:
+        print("reset_server - GAME: {} PLAY TOKEN: {}".format(self.game_id, play_token))
+        if play_token != self.auction_house.play_token:
+            return {"ok": False, "error": "wrong play token"}
+
+        # Disconnect any existing clients and reset state
+        try:
+            await self.connection_manager.disconnect_all()
+        except Exception as e:
+            print("error in disconnect_all during reset:", e)
+
+        self.reset_game_state()
+        await self.publish_leadboard()
+        print("<server reset>")
+        return {"ok": True}
+
+    async def handle_spectator(self, websocket:WebSocket):
+        """Stream the leaderboard: the current one, then every change (once per round)."""
+        if len(self.spectators.active_connections) >= self.max_spectators:
+            return
+
+        try:
+            await websocket.accept()
+        except Exception:
+            return
+
+        connection = await self.spectators.add_connection(websocket)
+        try:
+            connection.enqueue(self.leadboard_snapshot().text, droppable=True)
+            # spectators have nothing to say, just wait for them to leave
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        except Exception:
+            pass
+        finally:
+            self.spectators.disconnect(websocket)
+
+
+def create_lobby(game_id:str) -> Lobby:
+    """A lobby configured from the AH_* environment variables."""
+    game_token = os.environ.get("AH_GAME_TOKEN", "play123")
+    play_token = os.environ.get("AH_PLAY_TOKEN", "play123")
+    game_seed = int(os.environ["AH_SEED"]) if os.environ.get("AH_SEED") else None
+    dice_stats = os.environ.get("AH_DICE_STATS", "0") == "1"
+
+    log_prefix = "auction_house_log" if game_id == DEFAULT_GAME_ID else "auction_house_{}_log".format(game_id)
+    rotate_mb = os.environ.get("AH_LOG_ROTATE_MB")
+    rotate_rounds = os.environ.get("AH_LOG_ROTATE_ROUNDS")
+    auction_house = AuctionHouse(game_token=game_token, play_token=play_token, save_logs=True, seed=game_seed,
+                                 dice_stats=dice_stats, log_prefix=log_prefix,
+                                 log_rotate_bytes=int(float(rotate_mb) * 2**20) if rotate_mb else None,
+                                 log_rotate_rounds=int(rotate_rounds) if rotate_rounds else None,
+                                 log_compression=os.environ.get("AH_LOG_COMPRESS") or None)
+    connection_manager = ConnectionManager(
+        max_concurrent_sends=int(os.environ.get("AH_MAX_CONCURRENT_SENDS", "64")),
+        max_queue=int(os.environ.get("AH_SEND_QUEUE", "8")),
+        send_timeout=float(os.environ.get("AH_SEND_TIMEOUT", "10.0")),
+    )
+    scheduler = RoundScheduler(
+        mode=os.environ.get("AH_ROUND_MODE", "fixed"),
+        min_round_time=float(os.environ.get("AH_MIN_ROUND_TIME", "0.0")),
+        max_round_time=float(os.environ.get("AH_MAX_ROUND_TIME", "1.0")),
+    )
+    spectators = ConnectionManager(
+        max_concurrent_sends=int(os.environ.get("AH_MAX_CONCURRENT_SENDS", "64")),
+        max_queue=2,
+        send_timeout=float(os.environ.get("AH_SEND_TIMEOUT", "10.0")),
+    )
+    return Lobby(game_id, auction_house, connection_manager, scheduler, spectators=spectators,
+                 max_spectators=int(os.environ.get("AH_MAX_SPECTATORS", "1000")))
+
+
+class LobbyManager:
+    """Independent games keyed by game id, created on first use.
+
+    Every lobby has its own AuctionHouse, connections, scheduler and tick task,
+    so one server process can host many small games at once. Lobbies other than
+    the default one are dropped after being idle for `idle_timeout` seconds.
+    A lobby is only created for an agent or runner with the right token (the
+    tokens every lobby is created with), so strangers can't fill the server.
+
+    The async methods at the bottom are what the server routes call, the
+    shard.ShardRouter offers the same ones for games hosted in other processes.
+    """
+
+    def __init__(self, lobby_factory:Callable[[str], Lobby]=create_lobby, max_lobbies:int=256, idle_timeout:float=600.0,
+                 game_token:str="play123", play_token:str="play123"):
+        self.lobby_factory = lobby_factory
+        self.game_token = game_token
+        self.play_token = play_token
+        self.max_lobbies = max_lobbies
+        self.idle_timeout = idle_timeout
+        self.lobbies: Dict[str, Lobby] = {}
+        self._started = False
+        self._prune_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "LobbyManager":
+        return cls(
+            create_lobby,
+            max_lobbies=int(os.environ.get("AH_MAX_LOBBIES", "256")),
+            idle_timeout=float(os.environ.get("AH_LOBBY_IDLE_TIMEOUT", "600")),
+            game_token=os.environ.get("AH_GAME_TOKEN", "play123"),
+            play_token=os.environ.get("AH_PLAY_TOKEN", "play123"),
+        )
+
+    @staticmethod
+    def valid_game_id(game_id:str) -> bool:
+        return GAME_ID_PATTERN.match(game_id) is not None
+
+    def get(self, game_id:str) -> Optional[Lobby]:
+        return self.lobbies.get(game_id)
+
+    def get_or_create(self, game_id:str) -> Optional[Lobby]:
+        """The lobby for game_id, or None if the id is invalid or the server is full."""
+        lobby = self.lobbies.get(game_id)
+        if lobby is not None:
+            return lobby
+
+        if not self.valid_game_id(game_id):
+            print("invalid game id: '{}'".format(game_id))
+            return None
+
+        if len(self.lobbies) >= self.max_lobbies:
+            print("too many lobbies, not creating: '{}'".format(game_id))
+            return None
+
+        lobby = self.lobby_factory(game_id)
+        self.lobbies[game_id] = lobby
+        if self._started:
+            lobby.start()
+        return lobby
+
+    async def start(self):
+        self._started = True
+        for lobby in self.lobbies.values():
+            lobby.start()
+        if self._prune_task is None:
+            self._prune_task = asyncio.create_task(self.prune_forever())
+
+    async def stop(self):
+        self._started = False
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            try:
+                await self._prune_task
+            except asyncio.CancelledError:
+                pass
+            self._prune_task = None
+
+        for lobby in list(self.lobbies.values()):
+            await lobby.stop()
+
+    async def prune(self) -> List[str]:
+        """Drop lobbies (except the default one) that have been idle for too long."""
+        now = time.monotonic()
+        removed = []
+        for game_id, lobby in list(self.lobbies.items()):
+            if game_id == DEFAULT_GAME_ID:
+                continue
+            if lobby.is_idle() and now - lobby.last_activity > self.idle_timeout:
+                await lobby.stop()
+                del self.lobbies[game_id]
+                removed.append(game_id)
+        return removed
+
+    async def prune_forever(self, interval:float=30.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.prune()
+                if removed:
+                    print("removed idle lobbies:", removed)
+            except Exception as e:
+                print("error pruning lobbies:", e)
+
+    def _authorized(self, game_id:str, token:str, expected:str) -> Optional[Lobby]:
+        # an existing lobby checks the token itself, a new one is only made for the right token
+        lobby = self.get(game_id)
+        if lobby is None and token == expected:
+            lobby = self.get_or_create(game_id)
+        return lobby
+
+    async def handle_agent(self, websocket:WebSocket, game_id:str, token:str):
+        lobby = self._authorized(game_id, token, self.game_token)
+        if lobby is not None:
+            await lobby.handle_agent(websocket, token)
+
+    async def handle_runner(self, websocket:WebSocket, game_id:str, play_token:str):
+        lobby = self._authorized(game_id, play_token, self.play_token)
+        if lobby is not None:
+            await lobby.handle_runner(websocket, play_token)
+
+    def _lookup(self, game_id:str) -> Optional[Lobby]:
+        # the default game always exists, others only once someone connected
+        if game_id == DEFAULT_GAME_ID:
+            return self.get_or_create(game_id)
+        return self.get(game_id)
+
+    async def handle_spectator(self, websocket:WebSocket, game_id:str):
+        lobby = self._lookup(game_id)
+        if lobby is not None:
+            await lobby.handle_spectator(websocket)
+
+    async def reset(self, game_id:str, play_token:str) -> dict:
+        lobby = self._lookup(game_id)
+        if lobby is None:
+            return {"ok": False, "error": "unknown game"}
+        return await lobby.reset(play_token)
+
+    async def leadboard_data(self, game_id:str) -> Optional[dict]:
+        lobby = self._lookup(game_id)
+        return lobby.leadboard_data() if lobby is not None else None
+
+    async def leadboard_page(self, game_id:str) -> Optional[dict]:
+        lobby = self._lookup(game_id)
+        return lobby.leadboard_page() if lobby is not None else None
+
+    async def leadboard_snapshot(self, game_id:str) -> Optional[LeadboardSnapshot]:
+        lobby = self._lookup(game_id)
+        return lobby.leadboard_snapshot() if lobby is not None else None
+
+    async def leadboard_export(self, game_id:str, etag:Optional[str]=None) -> Optional[dict]:
+        """The snapshot for a front end that caches it, only its etag if that is still current."""
+        snapshot = await self.leadboard_snapshot(game_id)
+        if snapshot is None:
+            return None
+        if snapshot.etag == etag:
+            return {"etag": snapshot.etag}
+        return {"etag": snapshot.etag, "data": snapshot.data, "page": snapshot.page}
+
+    async def summaries(self) -> List[dict]:
+        return [lobby.summary() for lobby in self.lobbies.values()]
+
+    async def metrics(self) -> dict:
+        """The metrics of this process and the summaries of its lobbies, see metrics.py."""
+        return {"process": metrics.export(), "lobbies": await self.summaries()}
@@ -0,0 +1,552 @@
+import gzip
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from dnd_auction_game.game_logger import (
+    INDEX_DTYPE,
+    agents_index_path,
+    index_path,
+    iter_log_lines,
+    log_segments,
+    zstandard,
+)
+
+
+# Columnar game logs: a directory of .npy arrays plus a meta.json, converted
+# from the jsonln logs of the server (auction_house_log_N.jsonln) or of an agent
+# (logs/agent_*.jsonl). np.load() memory maps the arrays, so reading a column of
+# a huge log costs neither parsing nor a copy.
+#
+# Columns, one row per ...
+#   round:    round, pool
+#   round x agent (2d): gold, points, present (the agent was in the states)
+#   auction:  auction_round (sorted), auction_id (the number of "a123"), auction_die,
+#             auction_num, auction_bonus, auction_reward (the roll, can be negative),
+#             auction_revealed (false if the reward never made it into the log),
+#             auction_winner (agent index, -1 if nobody bid or the log predates it),
+#             bid_offsets (n_auctions + 1: the bids on auction row i are bid
+#             rows bid_offsets[i]:bid_offsets[i+1])
+#   bid:      bid_auction (auction row), bid_agent (agent index), bid_gold;
+#             grouped by auction, highest bid first
+#   pool buy: pool_buy_round (the round it was made in), pool_buy_agent, pool_buy_points
+#   economy:  economy_<key> for each schedule in the header (if any)
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+
+def _int_array(values) -> np.ndarray:
+    return np.frombuffer(values, dtype=np.int64) if len(values) else np.zeros(0, dtype=np.int64)
+
+
+class _LogColumns:
+    """Accumulates the rows of a jsonln log in compact arrays."""
+
+    def __init__(self):
+        self.meta = {"version": FORMAT_VERSION, "header": None, "current_agent": None}
+        self.economy: Dict[str, list] = {}
+        self.agents: List[str] = []
+        self._agent_index: Dict[str, int] = {}
+        self._auction_row: Dict[str, int] = {}
+
+        self.round = array("q")
+        self.pool = array("q")
+        # (round row, agent, gold, points) for every agent state
+        self.state_row = array("q")
+        self.state_agent = array("q")
+        self.state_gold = array("q")
+        self.state_points = array("q")
+
+        self.auction_round = array("q")
+        self.auction_id = array("q")
+        self.auction_die = array("q")
+        self.auction_num = array("q")
+        self.auction_bonus = array("q")
+        self.auction_reward = array("q")
+        self.auction_revealed = array("q")
+        self.auction_winner = array("q")
+
+        self.bid_auction = array("q")
+        self.bid_agent = array("q")
+        self.bid_gold = array("q")
+
+        self.pool_buy_round = array("q")
+        self.pool_buy_agent = array("q")
+        self.pool_buy_points = array("q")
+
+    def agent(self, a_id:str) -> int:
+        idx = self._agent_index.get(a_id)
+        if idx is None:
+            idx = len(self.agents)
+            self._agent_index[a_id] = idx
+            self.agents.append(a_id)
+        return idx
+
+    def auction(self, auction_id:str, info:dict, round:int) -> int:
+        row = self._auction_row.get(auction_id)
+        if row is None:
+            row = len(self.auction_id)
+            self._auction_row[auction_id] = row
+            self.auction_round.append(round)
+            self.auction_id.append(int(auction_id.lstrip("a")))
+            self.auction_die.append(info["die"])
+            self.auction_num.append(info["num"])
+            self.auction_bonus.append(info["bonus"])
+            self.auction_reward.append(0)
+            self.auction_revealed.append(0)
+            self.auction_winner.append(-1)
+        return row
+
+    def add_line(self, entry:dict):
+        if entry.get("type") == "header":
+            if self.meta["header"] is not None or len(self.round):
+                raise ValueError("the log holds more than one game")
+            self.meta["header"] = {k: v for k, v in entry.items() if k not in ("type", "economy")}
+            self.economy = entry.get("economy") or {}
+            return
+        if "round" not in entry:
+            return
+
+        if "economy" in entry:
+            self.economy = entry["economy"]
+        if "current_agent" in entry:
+            self.meta["current_agent"] = entry["current_agent"]
+
+        r = entry["round"]
+        row = len(self.round)
+        if row and r < self.round[-1]:
+            # logs written before every game got its own file can hold several games
+            raise ValueError("the log holds more than one game")
+        self.round.append(r)
+        self.pool.append(entry.get("pool", 0))
+
+        for a_id, state in entry.get("states", {}).items():
+            self.state_row.append(row)
+            self.state_agent.append(self.agent(a_id))
+            self.state_gold.append(state["gold"])
+            self.state_points.append(state["points"])
+
+        # the previous round's auctions come back with their reward and bids
+        for auction_id, info in entry.get("prev_auctions", {}).items():
+            a_row = self.auction(auction_id, info, r - 1)
+            self.auction_reward[a_row] = info["reward"]
+            self.auction_revealed[a_row] = 1
+            if "winner" in info:
+                self.auction_winner[a_row] = self.agent(info["winner"])
+            for bid in info.get("bids", []):
+                self.bid_auction.append(a_row)
+                self.bid_agent.append(self.agent(bid["a_id"]))
+                self.bid_gold.append(bid["gold"])
+
+        for a_id, points in entry.get("prev_pool_buys", {}).items():
+            self.pool_buy_round.append(r - 1)
+            self.pool_buy_agent.append(self.agent(a_id))
+            self.pool_buy_points.append(points)
+
+        for auction_id, info in entry.get("auctions", {}).items():
+            self.auction(auction_id, info, r)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        cols = {}
+        n_rounds = len(self.round)
+        n_agents = len(self.agents)
+
+        rounds = _int_array(self.round)
+        cols["round"] = rounds
+        cols["pool"] = _int_array(self.pool)
+
+        state_row = _int_array(self.state_row)
+        state_agent = _int_array(self.state_agent)
+        for name, values in (("gold", self.state_gold), ("points", self.state_points)):
+            table = np.zeros((n_rounds, n_agents), dtype=np.int64)
+            table[state_row, state_agent] = _int_array(values)
+            cols[name] = table
+        present = np.zeros((n_rounds, n_agents), dtype=bool)
+        present[state_row, state_agent] = True
+        cols["present"] = present
+
+        # auctions ordered by round (an auction first seen as a previous auction may be out of order)
+        auction_round = _int_array(self.auction_round)
+        order = np.argsort(auction_round, kind="stable")
+        new_row = np.empty_like(order)
+        new_row[order] = np.arange(len(order))
+        for name in ("auction_round", "auction_id", "auction_die", "auction_num", "auction_bonus", "auction_reward",
+                     "auction_winner"):
+            cols[name] = _int_array(getattr(self, name))[order]
+        cols["auction_revealed"] = _int_array(self.auction_revealed)[order].astype(bool)
+
+        # bids grouped by auction, keeping the (highest first) order within an auction
+        bid_auction = new_row[_int_array(self.bid_auction)] if len(self.bid_auction) else _int_array(self.bid_auction)
+        bid_order = np.argsort(bid_auction, kind="stable")
+        cols["bid_auction"] = bid_auction[bid_order]
+        cols["bid_agent"] = _int_array(self.bid_agent)[bid_order]
+        cols["bid_gold"] = _int_array(self.bid_gold)[bid_order]
+        cols["bid_offsets"] = np.searchsorted(cols["bid_auction"], np.arange(len(order) + 1)).astype(np.int64)
+
+        for name in ("pool_buy_round", "pool_buy_agent", "pool_buy_points"):
+            cols[name] = _int_array(getattr(self, name))
+
+        for key, values in self.economy.items():
+            cols["economy_" + key] = np.asarray(values)
+
+        return cols
+
+
+def _default_out_dir(path:str) -> str:
+    base = path
+    for ext in (".gz", ".zst", ".jsonln", ".jsonl"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + ".cols"
+
+
+def read_jsonln(path:str) -> "GameLog":
+    """Parse a jsonln log (all its rotated segments) into an in-memory GameLog."""
+    builder = _LogColumns()
+    for line in iter_log_lines(path):
+        builder.add_line(json.loads(line))
+
+    meta = dict(builder.meta)
+    meta["agents"] = builder.agents
+    meta["source"] = path
+    return GameLog(builder.columns(), meta)
+
+
+def convert_log(path:str, out_dir:Optional[str]=None) -> str:
+    """Convert a jsonln log to a columnar log directory, returns the directory.
+
+    meta.json is written last, so a directory without it is an unfinished conversion.
+    """
+    if out_dir is None:
+        out_dir = _default_out_dir(path)
+
+    log = read_jsonln(path)
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    for name, values in log.columns.items():
+        np.save(os.path.join(out_dir, name + ".npy"), values)
+
+    meta = dict(log.meta)
+    meta["columns"] = sorted(log.columns)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        json.dump(meta, fp)
+    os.replace(tmp_path, meta_path)
+    return out_dir
+
+
+def is_columnar(path:str) -> bool:
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def load_log(path:str, mmap:bool=True) -> "GameLog":
+    """Open a game log: a columnar directory (memory mapped unless mmap=False) or a jsonln log."""
+    if not os.path.isdir(path):
+        return read_jsonln(path)
+
+    if not is_columnar(path):
+        raise ValueError("'{}' is not a columnar log (no {})".format(path, META_FILE))
+
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as fp:
+        meta = json.load(fp)
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError("'{}' has log format version {}, expected {}".format(path, meta.get("version"), FORMAT_VERSION))
+
+    mmap_mode = "r" if mmap else None
+    columns = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in meta["columns"]}
+    return GameLog(columns, meta)
+
+
+class GameLog:
+    """The columns of one game log, see the top of logs.py for what they hold.
+
+    Columns are numpy arrays (memory mapped when loaded from a directory):
+    log["gold"][:, log.agent_index("a1")] is the gold of agent a1 in every round.
+    """
+
+    def __init__(self, columns:Dict[str, np.ndarray], meta:dict):
+        self.columns = columns
+        self.meta = meta
+        self.agents: List[str] = meta.get("agents", [])
+        self._agent_index = {a_id: i for i, a_id in enumerate(self.agents)}
+        self._round_row: Optional[Dict[int, int]] = None
+
+    def __getitem__(self, name:str) -> np.ndarray:
+        return self.columns[name]
+
+    def __contains__(self, name:str) -> bool:
+        return name in self.columns
+
+    def __len__(self):
+        return len(self.columns["round"])
+
+    @property
+    def header(self) -> Optional[dict]:
+        return self.meta.get("header")
+
+    @property
+    def rounds(self) -> np.ndarray:
+        return self.columns["round"]
+
+    def agent_index(self, a_id:str) -> int:
+        return self._agent_index[a_id]
+
+    def round_row(self, round:int) -> int:
+        """Row of a round number (the last one if it was logged twice)."""
+        if self._round_row is None:
+            self._round_row = {r: i for i, r in enumerate(self.rounds.tolist())}
+        return self._round_row[round]
+
+    def agent_column(self, name:str, a_id:str) -> np.ndarray:
+        """gold, points or present of one agent in every round."""
+        return self.columns[name][:, self.agent_index(a_id)]
+
+    def auction_rows(self, round:int) -> slice:
+        """The auction rows offered in a round."""
+        auction_round = self.columns["auction_round"]
+        return slice(int(np.searchsorted(auction_round, round, side="left")),
+                     int(np.searchsorted(auction_round, round, side="right")))
+
+    def bid_rows(self, auction_row:int) -> slice:
+        offsets = self.columns["bid_offsets"]
+        return slice(int(offsets[auction_row]), int(offsets[auction_row + 1]))
+
+    def economy(self) -> Dict[str, np.ndarray]:
+        return {name[len("economy_"):]: values for name, values in self.columns.items() if name.startswith("economy_")}
+
+
+def _read_bytes(path:str):
+    """The (uncompressed) content of a log file, memory mapped if it is not compressed."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as fp:
+            return fp.read()
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("'{}' is zstd compressed, install zstandard to read it".format(path))
+        with open(path, "rb") as fp:
+            return zstandard.ZstdDecompressor().stream_reader(fp).read()
+
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _scan_index(data) -> np.ndarray:
+    """Index a log file by parsing it, for logs written without an index."""
+    records = []
+    offset = 0
+    size = len(data)
+    while offset < size:
+        end = data.find(b"\n", offset)
+        if end < 0:
+            end = size
+        line = data[offset:end]
+        if line.strip():
+            entry = json.loads(line)
+            if "round" in entry:
+                records.append((entry["round"], offset, end - offset))
+        offset = end + 1
+    return np.array(records, dtype=INDEX_DTYPE)
+
+
+def _load_index(path:str, size:Optional[int]=None) -> Optional[np.ndarray]:
+    idx = index_path(path)
+    if not os.path.isfile(idx):
+        return None
+    with open(idx, "rb") as fp:
+        raw = fp.read()
+    index = np.frombuffer(raw, dtype=INDEX_DTYPE, count=len(raw) // INDEX_DTYPE.itemsize)
+    if size is not None:
+        # records past the end of the data belong to an unfinished write
+        index = index[index["offset"] + index["length"] <= size]
+    return index
+
+
+def build_index(path:str) -> int:
+    """Write the round index of every file of a log that has none yet (e.g. older logs).
+
+    Returns the number of files indexed. The agents index is rebuilt as well if missing.
+    """
+    n = 0
+    for f in log_segments(path) + ([path] if os.path.isfile(path) else []):
+        if os.path.isfile(index_path(f)):
+            continue
+        with open(index_path(f), "wb") as fp:
+            fp.write(_scan_index(_read_bytes(f)).tobytes())
+        n += 1
+
+    if not os.path.isfile(agents_index_path(path)):
+        with LogReader(path) as reader:
+            first_rounds = reader.agents()
+        with open(agents_index_path(path), "w", encoding="utf-8") as fp:
+            for a_id, r in first_rounds.items():
+                fp.write(json.dumps({"a_id": a_id, "round": r}) + "\n")
+    return n
+
+
+class LogReader:
+    """Random access to the rounds of a jsonln log, without parsing what comes before.
+
+    Uses the round index written next to the log (game_logger.INDEX_DTYPE),
+    or indexes a file by scanning it if it has none. Uncompressed files are
+    memory mapped; a compressed segment is decompressed when one of its rounds
+    is read (the last one is kept). The reader sees the log as it was when
+    opened.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.files = log_segments(path)
+        if os.path.isfile(path):
+            self.files.append(path)
+
+        self._data: Dict[int, object] = {}
+        rounds, file_numbers, offsets, lengths = [], [], [], []
+        for i, f in enumerate(self.files):
+            if f.endswith((".gz", ".zst")):
+                # closed segments are complete, no need to decompress them now
+                index = _load_index(f)
+            else:
+                index = _load_index(f, len(self._file_data(i)))
+            if index is None:
+                index = _scan_index(self._file_data(i))
+            rounds.append(index["round"])
+            offsets.append(index["offset"])
+            lengths.append(index["length"])
+            file_numbers.append(np.full(len(index), i, dtype=np.int64))
+
+        def concat(parts):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+        self.rounds = concat(rounds)
+        if np.any(np.diff(self.rounds) < 0):
+            # logs written before every game got its own file can hold several games
+            raise ValueError("'{}' holds more than one game, its rounds can't be looked up".format(path))
+        self._file_numbers = concat(file_numbers)
+        self._offsets = concat(offsets)
+        self._lengths = concat(lengths)
+        self._agents: Optional[Dict[str, int]] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def close(self):
+        for data in self._data.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self._data = {}
+
+    def _file_data(self, i:int):
+        data = self._data.get(i)
+        if data is None:
+            if self.files[i].endswith((".gz", ".zst")):
+                # keep at most one decompressed segment in memory
+                for key in [k for k, v in self._data.items() if not isinstance(v, mmap.mmap)]:
+                    del self._data[key]
+            data = _read_bytes(self.files[i])
+            self._data[i] = data
+        return data
+
+    def _raw_at(self, pos:int) -> bytes:
+        data = self._file_data(int(self._file_numbers[pos]))
+        offset = int(self._offsets[pos])
+        return data[offset:offset + int(self._lengths[pos])]
+
+    def _position(self, round:int) -> int:
+        # the last line of a round (rounds only grow within a log, see __init__)
+        pos = int(np.searchsorted(self.rounds, round, side="right")) - 1
+        if pos < 0 or self.rounds[pos] != round:
+            raise KeyError(round)
+        return pos
+
+    def raw(self, round:int) -> bytes:
+        """The json line of a round, unparsed."""
+        return self._raw_at(self._position(round))
+
+    def round(self, round:int) -> dict:
+        return json.loads(self._raw_at(self._position(round)))
+
+    def range(self, start:int, stop:Optional[int]=None) -> Iterator[dict]:
+        """The states of the rounds start <= round < stop, in order."""
+        first = int(np.searchsorted(self.rounds, start, side="left"))
+        last = len(self.rounds) if stop is None else int(np.searchsorted(self.rounds, stop, side="left"))
+        for pos in range(first, last):
+            yield json.loads(self._raw_at(pos))
+
+    def header(self) -> Optional[dict]:
+        """The header line of the game, if the log starts with one."""
+        if not self.files:
+            return None
+        data = self._file_data(0)
+        end = data.find(b"\n")
+        line = data[:end if end >= 0 else len(data)]
+        if not line.strip():
+            return None
+        entry = json.loads(line)
+        return entry if entry.get("type") == "header" else None
+
+    def agents(self) -> Dict[str, int]:
+        """{a_id: first round} of every agent in the log."""
+        if self._agents is None:
+            self._agents = {}
+            if os.path.isfile(agents_index_path(self.path)):
+                with open(agents_index_path(self.path), "r", encoding="utf-8") as fp:
+                    for line in fp:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._agents.setdefault(entry["a_id"], entry["round"])
+            else:
+                for pos in range(len(self.rounds)):
+                    entry = json.loads(self._raw_at(pos))
+                    for a_id in entry.get("states", {}):
+                        self._agents.setdefault(a_id, entry["round"])
+        return self._agents
+
+    def agent_rounds(self, a_id:str) -> np.ndarray:
+        """The logged rounds an agent took part in (agents stay in a game once joined)."""
+        first = self.agents()[a_id]
+        return self.rounds[np.searchsorted(self.rounds, first, side="left"):]
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("convert", "info", "index"):
+        print("usage: python -m dnd_auction_game.logs convert LOG [OUT_DIR]")
+        print("       python -m dnd_auction_game.logs info LOG")
+        print("       python -m dnd_auction_game.logs index LOG")
+        sys.exit(1)
+
+    if sys.argv[1] == "index":
+        n = build_index(sys.argv[2])
+        print("<indexed {} files of '{}'>".format(n, sys.argv[2]))
+        return
+
+    if sys.argv[1] == "convert":
+        out_dir = sys.argv[3] if len(sys.argv) >= 4 else None
+        out_dir = convert_log(sys.argv[2], out_dir)
+        print("<converted '{}' to '{}'>".format(sys.argv[2], out_dir))
+        return
+
+    log = load_log(sys.argv[2])
+    print("rounds: {}  agents: {}  auctions: {}  bids: {}".format(
+        len(log), len(log.agents), len(log["auction_id"]), len(log["bid_gold"])))
+    for name, values in sorted(log.columns.items()):
+        print("  {:<24} {} {}".format(name, values.dtype, values.shape))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import bisect
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Server instrumentation: counters, latency histograms and message rates of this
+# process. Off unless AH_METRICS=1; callers check ENABLED before counting, and
+# timer() hands out a shared no-op context, so the disabled cost is an attribute
+# lookup. The server exports it on /metrics (prometheus text) and /api/metrics
+# (json), summed over the shards.
+ENABLED = os.environ.get("AH_METRICS", "0") == "1"
+
+# seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# messages per second are averaged over the last RATE_WINDOW full seconds
+RATE_WINDOW = 10
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name:str, labels:dict) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, bounds:Tuple[float, ...]=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # the last count is for values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Rate:
+    """Events per second over a sliding window of one second slots."""
+
+    def __init__(self):
+        self.seconds = [0] * RATE_WINDOW
+        self.counts = [0] * RATE_WINDOW
+
+    def add(self, n:int, now:int):
+        slot = now % RATE_WINDOW
+        if self.seconds[slot] != now:
+            self.seconds[slot] = now
+            self.counts[slot] = 0
+        self.counts[slot] += n
+
+    def per_second(self, now:int) -> float:
+        return sum(c for s, c in zip(self.seconds, self.counts) if now - RATE_WINDOW <= s < now) / RATE_WINDOW
+
+
+class _Timer:
+    __slots__ = ("registry", "key", "started")
+
+    def __init__(self, registry:"Registry", key:Key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._observe(self.key, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    """The metrics of one process. The log writer thread observes too, hence the lock."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.rates: Dict[Key, _Rate] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name:str, n:float=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def mark(self, name:str, n:int=1, **labels):
+        """inc, and count towards the per second rate of the counter."""
+        key = _key(name, labels)
+        now = int(time.monotonic())
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+            rate = self.rates.get(key)
+            if rate is None:
+                rate = self.rates[key] = _Rate()
+            rate.add(n, now)
+
+    def observe(self, name:str, value:float, **labels):
+        self._observe(_key(name, labels), value)
+
+    def _observe(self, key:Key, value:float):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name:str, **labels) -> _Timer:
+        return _Timer(self, _key(name, labels))
+
+    def export(self) -> dict:
+        """Everything as json, mergeable with merge()."""
+        now = int(time.monotonic())
+        with self._lock:
+            return {
+                "enabled": ENABLED,
+                "uptime": time.time() - self.started,
+                "counters": [{"name": k[0], "labels": dict(k[1]), "value": v} for k, v in self.counters.items()],
+                "histograms": [{"name": k[0], "labels": dict(k[1]), "buckets": list(h.bounds), "counts": list(h.counts),
+                                "sum": h.sum, "count": h.count} for k, h in self.histograms.items()],
+                "rates": [{"name": k[0], "labels": dict(k[1]), "per_second": r.per_second(now)}
+                          for k, r in self.rates.items()],
+            }
+
+
+_registry = Registry()
+
+
+def enable(on:bool=True):
+    global ENABLED
+    ENABLED = on
+
+
+def inc(name:str, n:float=1, **labels):
+    _registry.inc(name, n, **labels)
+
+
+def mark(name:str, n:int=1, **labels):
+    _registry.mark(name, n, **labels)
+
+
+def observe(name:str, value:float, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def timer(name:str, **labels):
+    """`with metrics.timer(name):` observes the duration of the block, if enabled."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _registry.timer(name, **labels)
+
+
+def export() -> dict:
+    return _registry.export()
+
+
+def merge(exports:Iterable[dict]) -> dict:
+    """One export of the metrics of several processes: counters, histograms and rates are summed."""
+    merged = {"enabled": False, "uptime": 0.0, "counters": {}, "histograms": {}, "rates": {}}
+    for e in exports:
+        merged["enabled"] = merged["enabled"] or e["enabled"]
+        merged["uptime"] = max(merged["uptime"], e["uptime"])
+        for c in e["counters"]:
+            key = _key(c["name"], c["labels"])
+            merged["counters"][key] = merged["counters"].get(key, 0) + c["value"]
+        for r in e["rates"]:
+            key = _key(r["name"], r["labels"])
+            merged["rates"][key] = merged["rates"].get(key, 0.0) + r["per_second"]
+        for h in e["histograms"]:
+            key = _key(h["name"], h["labels"])
+            total = merged["histograms"].get(key)
+            if total is None:
+                merged["histograms"][key] = dict(h, counts=list(h["counts"]))
+                continue
+            total["counts"] = [a + b for a, b in zip(total["counts"], h["counts"])]
+            total["sum"] += h["sum"]
+            total["count"] += h["count"]
+
+    return {
+        "enabled": merged["enabled"],
+        "uptime": merged["uptime"],
+        "counters": [{"name": k[0], "labels": dict(k[1]), "value": v} for k, v in merged["counters"].items()],
+        "histograms": list(merged["histograms"].values()),
+        "rates": [{"name": k[0], "labels": dict(k[1]), "per_second": v} for k, v in merged["rates"].items()],
+    }
+
+
+def _labels(labels:dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in sorted(labels.items()):
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append('{}="{}"'.format(k, v))
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# HELP text of the series the server records, unknown names are described by their name
+_HELP = {
+    "ah_metrics_enabled": "1 if the server records metrics (AH_METRICS=1).",
+    "ah_uptime_seconds": "Seconds since the server process started.",
+    "ah_rounds_total": "Rounds played.",
+    "ah_tick_seconds": "Time to play one round.",
+    "ah_tick_phase_seconds": "Time spent in each phase of a round.",
+    "ah_bids_received_total": "Bids received from agents.",
+    "ah_bids_rejected_total": "Bids rejected, by reason.",
+    "ah_ws_messages_sent_total": "Websocket messages sent.",
+    "ah_ws_messages_sent_per_second": "Websocket messages sent per second.",
+    "ah_ws_messages_received_total": "Websocket messages received.",
+    "ah_ws_messages_received_per_second": "Websocket messages received per second.",
+    "ah_send_latency_seconds": "Time to send one websocket message.",
+    "ah_log_write_seconds": "Time to write one batch of log entries.",
+    "ah_log_entries_total": "Log entries written.",
+}
+
+# gauges and counters of every lobby, from Lobby.summary
+_LOBBY_SERIES = (
+    ("ah_round", "gauge", "Current round of the game.", lambda s: s["round"]),
+    ("ah_players", "gauge", "Agents in the game.", lambda s: s["num_players"]),
+    ("ah_connections", "gauge", "Agent connections of the game.", lambda s: s["num_connections"]),
+    ("ah_spectators", "gauge", "Spectators of the game.", lambda s: s["num_spectators"]),
+    ("ah_send_queue_depth", "gauge", "Messages waiting to be sent, over all connections.",
+     lambda s: s["connections"]["queue_depth_total"]),
+    ("ah_send_queue_depth_max", "gauge", "Messages waiting to be sent on the slowest connection.",
+     lambda s: s["connections"]["queue_depth_max"]),
+    ("ah_last_send_latency_p50_seconds", "gauge", "Median over the connections of their last send time.",
+     lambda s: s["connections"]["last_send_latency_p50"]),
+    ("ah_last_send_latency_max_seconds", "gauge", "Longest last send time of a connection.",
+     lambda s: s["connections"]["last_send_latency_max"]),
+    ("ah_connection_messages_sent_total", "counter", "Messages sent to the agents of the game.",
+     lambda s: s["connections"]["sent"]),
+    ("ah_connection_messages_dropped_total", "counter", "Messages replaced by a newer one before they were sent.",
+     lambda s: s["connections"]["dropped"]),
+    ("ah_connection_failures_total", "counter", "Connections dropped after a failed send.",
+     lambda s: s["connections"]["failed"]),
+    ("ah_connection_overflows_total", "counter", "Connections dropped because their queue was full.",
+     lambda s: s["connections"]["overflowed"]),
+)
+
+
+def _describe(name:str, kind:str, help_text:Optional[str]=None) -> List[str]:
+    help_text = _HELP.get(name, name) if help_text is None else help_text
+    return [
+        "# HELP {} {}".format(name, help_text.replace("\\", "\\\\").replace("\n", "\\n")),
+        "# TYPE {} {}".format(name, kind),
+    ]
+
+
+def render_prometheus(export:dict, lobbies:Optional[List[dict]]=None) -> str:
+    """The prometheus text exposition of an export plus the per lobby series."""
+    lines = _describe("ah_metrics_enabled", "gauge")
+    lines.append("ah_metrics_enabled {}".format(int(export["enabled"])))
+    lines += _describe("ah_uptime_seconds", "gauge")
+    lines.append("ah_uptime_seconds {}".format(_number(export["uptime"])))
+
+    def by_name(items):
+        grouped: Dict[str, list] = {}
+        for item in items:
+            grouped.setdefault(item["name"], []).append(item)
+        return sorted(grouped.items())
+
+    for name, counters in by_name(export["counters"]):
+        lines += _describe(name, "counter")
+        for c in counters:
+            lines.append("{}{} {}".format(name, _labels(c["labels"]), _number(c["value"])))
+
+    for name, rates in by_name(export["rates"]):
+        gauge = name[:-len("_total")] if name.endswith("_total") else name
+        lines += _describe("{}_per_second".format(gauge), "gauge")
+        for r in rates:
+            lines.append("{}_per_second{} {}".format(gauge, _labels(r["labels"]), _number(r["per_second"])))
+
+    for name, histograms in by_name(export["histograms"]):
+        lines += _describe(name, "histogram")
+        for h in histograms:
+            cumulative = 0
+            for bound, count in zip(list(h["buckets"]) + ["+Inf"], h["counts"]):
+                cumulative += count
+                labels = dict(h["labels"], le=bound if bound == "+Inf" else _number(float(bound)))
+                lines.append("{}_bucket{} {}".format(name, _labels(labels), cumulative))
+            lines.append("{}_sum{} {}".format(name, _labels(h["labels"]), _number(h["sum"])))
+            lines.append("{}_count{} {}".format(name, _labels(h["labels"]), h["count"]))
+
+    for name, kind, help_text, value in _LOBBY_SERIES:
+        lines += _describe(name, kind, help_text)
+        for summary in lobbies or []:
+            labels = {"game": summary["game_id"]}
+            if "shard" in summary:
+                labels["shard"] = summary["shard"]
+            lines.append("{}{} {}".format(name, _labels(labels), _number(value(summary))))
+
+    return "\n".join(lines) + "\n"
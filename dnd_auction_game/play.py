@@ -1,4 +1,5 @@
 import sys
+import os
 import random
 import asyncio
 import json
@@ -6,20 +7,29 @@ import websockets
 
 
 class AuctionGameRunner:
-    def __init__(self, host:str, play_token:str, n_rounds=5, time_per_round:float=1.0, port:int=8000):
+    def __init__(self, host:str, play_token:str, n_rounds=5, time_per_round:float=None, port:int=8000,
+                 round_mode:str=None, min_round_time:float=None, game_id:str=None):
         self.host = host
         self.port = port
         self.n_rounds = n_rounds
         self.play_token = play_token
+        self.game_id = game_id
         
+        # None keeps the server's settings. In "event" mode a round ends when every agent
+        # has answered (after at least min_round_time), or after time_per_round seconds.
         self.time_per_round = time_per_round
+        self.round_mode = round_mode
+        self.min_round_time = min_round_time
         
     def run(self):
         asyncio.run(self._internal_run())
         
         
     async def _internal_run(self):
-        connection_str = "ws://{}:{}/ws_run/{}".format(self.host, self.port, self.play_token)
+        if self.game_id is None:
+            connection_str = "ws://{}:{}/ws_run/{}".format(self.host, self.port, self.play_token)
+        else:
+            connection_str = "ws://{}:{}/ws_run/{}/{}".format(self.host, self.port, self.game_id, self.play_token)
         print("connecting to: {}".format(connection_str))
         
 
@@ -27,6 +37,12 @@ class AuctionGameRunner:
             print("<connected - starting game>")
 
             game_info = {"num_rounds": self.n_rounds}
+            if self.round_mode is not None:
+                game_info["round_mode"] = self.round_mode
+            if self.min_round_time is not None:
+                game_info["min_round_time"] = self.min_round_time
+            if self.time_per_round is not None:
+                game_info["max_round_time"] = self.time_per_round
             await sock.send(json.dumps(game_info))
 
             server_info_raw = await sock.recv()
@@ -49,8 +65,15 @@ if __name__ == "__main__":
         play_token = sys.argv[2]
     else:
         play_token = "play123"
+
+    round_mode = None
+    if len(sys.argv) >= 4:
+        round_mode = sys.argv[3]
+
+    # AH_GAME_ID picks a lobby on a multi-game server, unset plays the default game
+    game_id = os.environ.get("AH_GAME_ID") or None
         
-    runner = AuctionGameRunner(host, n_rounds=n_rounds, play_token=play_token)
+    runner = AuctionGameRunner(host, n_rounds=n_rounds, play_token=play_token, round_mode=round_mode, game_id=game_id)
     print("Running the game for: {} rounds.".format(n_rounds))
     runner.run()
     
@@ -0,0 +1,312 @@
+import json
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Wire encodings. json (text frames) is the default; agents can ask for msgpack
+# (binary frames) in their handshake if it is installed on both sides.
+ENCODINGS = ("json", "msgpack")
+
+# values per piece when encoding the economy schedule, see encode_schedule
+SCHEDULE_CHUNK = 1 << 15
+
+# bank_state key -> legacy per-round key holding the remainder of the schedule
+ECONOMY_KEYS = {
+    "gold_income_per_round": "remainder_gold_income",
+    "bank_interest_per_round": "remainder_bank_interest",
+    "bank_limit_per_round": "remainder_bank_limit",
+}
+
+
+def encode_json(message:dict) -> str:
+    """The compact json text sent over the websocket (same as starlette's send_json)."""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_msgpack(message:dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def encode_message(message:dict, encoding:str="json") -> Union[str, bytes]:
+    """A message as sent in `encoding`: json text or msgpack bytes."""
+    if encoding == "msgpack":
+        return encode_msgpack(message)
+    return encode_json(message)
+
+
+def decode_message(data:Union[str, bytes]):
+    """Decode a received frame; the frame type tells the encoding."""
+    if isinstance(data, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("received a binary message, but msgpack is not installed")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def encode_schedule(schedule:Dict[str, Sequence], encoding:str="json") -> Union[str, bytes]:
+    """encode_message(schedule, encoding), done piece by piece.
+
+    Encoding a list is one call that holds the GIL until it is done; in pieces of
+    SCHEDULE_CHUNK values the event loop gets to run in between, so the schedule
+    of a long game can be encoded in a worker thread without stalling the server.
+    """
+    def chunks(values):
+        return (values[i:i + SCHEDULE_CHUNK] for i in range(0, len(values), SCHEDULE_CHUNK))
+
+    if encoding == "msgpack":
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [packer.pack_map_header(len(schedule))]
+        for key, values in schedule.items():
+            parts.append(packer.pack(key))
+            parts.append(packer.pack_array_header(len(values)))
+            for chunk in chunks(values):
+                # without the array header of the piece: 1 byte up to 15 values, else 3
+                parts.append(packer.pack(list(chunk))[1 if len(chunk) < 16 else 3:])
+        return b"".join(parts)
+
+    parts = []
+    for key, values in schedule.items():
+        items = ",".join(encode_json(list(chunk))[1:-1] for chunk in chunks(values))
+        parts.append("{}:[{}]".format(encode_json(key), items))
+    return "{" + ",".join(parts) + "}"
+
+
+def encode_with(message:dict, key:str, encoded_value:Union[str, bytes], encoding:str="json") -> Union[str, bytes]:
+    """encode_message of `message` plus `key`, whose value is already encoded."""
+    if encoding == "msgpack":
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [packer.pack_map_header(len(message) + 1)]
+        for k, v in message.items():
+            parts.append(packer.pack(k))
+            parts.append(packer.pack(v))
+        parts.append(packer.pack(key))
+        parts.append(encoded_value)
+        return b"".join(parts)
+
+    text = encode_json(message)
+    separator = "," if message else ""
+    return "{}{}{}:{}}}".format(text[:-1], separator, encode_json(key), encoded_value)
+
+
+def negotiate_encoding(requested) -> str:
+    """The encoding the server uses for an agent that asked for `requested`."""
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+
+def bank_state_from_round(round_data:dict, schedule:Optional[Dict[str, Sequence]]) -> Dict[str, list]:
+    """bank_state for make_bid, from either protocol.
+
+    Legacy round messages carry the remainder lists themselves; otherwise they are
+    cut from the schedule that was sent once with the first round. Either way
+    make_bid gets plain lists of its own, as it always did.
+    """
+    if schedule is None or ECONOMY_KEYS["gold_income_per_round"] in round_data:
+        return {key: round_data[remainder_key] for key, remainder_key in ECONOMY_KEYS.items()}
+    return {key: list(schedule[key][round_data["round"]:]) for key in ECONOMY_KEYS}
+
+
+def add_remainders(state:dict, schedule:Dict[str, Sequence]) -> dict:
+    """The legacy round message: the state plus the rest of the schedule from this round on."""
+    message = dict(state)
+    for key, remainder_key in ECONOMY_KEYS.items():
+        message[remainder_key] = schedule[key][state["round"]:]
+    return message
+
+
+def economy_step(gold:int, schedule:Dict[str, Sequence], round:int) -> int:
+    """Gold after the bank interest and income that AuctionHouse pays at the start of `round`."""
+    limit = schedule["bank_limit_per_round"][round]
+    rate = schedule["bank_interest_per_round"][round]
+    return gold + int(min(gold, limit) * (rate - 1)) + schedule["gold_income_per_round"][round]
+
+
+class StateHistory:
+    """Gold and points of every agent for the last `keep` rounds.
+
+    Agents that use the delta protocol get only the states that differ from
+    what they can predict themselves: their states of the last round they
+    acknowledged, plus the interest and income of the rounds since then (see
+    economy_step). Usually that is only the agents that won, lost or bought
+    from the pool. Every `keep` rounds everyone gets a full keyframe instead.
+    """
+
+    def __init__(self, keep:int=16):
+        self.keep = max(1, keep)
+        self._rounds: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __contains__(self, round:int) -> bool:
+        return round in self._rounds
+
+    def clear(self):
+        self._rounds = {}
+
+    def record(self, round:int, gold:np.ndarray, points:np.ndarray):
+        self._rounds[round] = (np.array(gold, copy=True), np.array(points, copy=True))
+        for old in [r for r in self._rounds if r <= round - self.keep]:
+            del self._rounds[old]
+
+    def changed(self, round:int, base:int, schedule:Dict[str, Sequence]) -> np.ndarray:
+        """Registry indices of the agents whose state at `round` is not the predicted one."""
+        gold, points = self._rounds[round]
+        base_gold, base_points = self._rounds[base]
+        n = len(base_gold)
+
+        # same arithmetic as AuctionHouse.prepare_auctions_and_pool
+        predicted = base_gold.copy()
+        for r in range(base + 1, round + 1):
+            predicted += (np.minimum(predicted, schedule["bank_limit_per_round"][r]) * (schedule["bank_interest_per_round"][r] - 1)).astype(np.int64)
+            predicted += schedule["gold_income_per_round"][r]
+
+        changed = np.ones(len(gold), dtype=bool)
+        changed[:n] = (gold[:n] != predicted) | (points[:n] != base_points)
+        return np.flatnonzero(changed)
+
+
+def apply_states_delta(round_data:dict, known_states:Dict[int, dict], schedule:Optional[Dict[str, Sequence]]) -> Optional[dict]:
+    """The full states of a round message, from either a keyframe or a delta.
+
+    `known_states` maps rounds to the states already reconstructed. Returns None
+    if the delta is against a round that is not known (the agent should resync).
+    """
+    if "states" in round_data:
+        return round_data["states"]
+
+    base_round = round_data["states_base"]
+    base = known_states.get(base_round)
+    if base is None or schedule is None:
+        return None
+
+    states = {}
+    for a_id, state in base.items():
+        gold = state["gold"]
+        for r in range(base_round + 1, round_data["round"] + 1):
+            gold = economy_step(gold, schedule, r)
+        states[a_id] = {"gold": gold, "points": state["points"]}
+    states.update(round_data["states_delta"])
+    return states
+
+
+class Payloads:
+    """One message sent to every connection, encoded once per encoding."""
+
+    droppable = False
+
+    def __init__(self, message:dict):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encoded_for(self, connection) -> Union[str, bytes]:
+        encoding = connection.encoding
+        encoded = self._encoded.get(encoding)
+        if encoded is None:
+            encoded = encode_message(self.message, encoding)
+            self._encoded[encoding] = encoded
+        return encoded
+
+    def sent(self, connection):
+        pass
+
+
+class RoundPayloads:
+    """The variants of one round state that are sent to the connected agents.
+
+    Agents that asked for the economy schedule in their handshake get it once,
+    attached to the first round they receive, and only the round state after
+    that. Other agents get the legacy message with the remainder lists. Agents
+    that use the schedule and asked for deltas get "states_delta" (see
+    StateHistory) against "states_base", the last round they acknowledged,
+    instead of "states", unless a keyframe is due. Each variant is built once
+    per round, and encoded once per wire encoding.
+    """
+
+    # a newer round supersedes this one if it is still waiting to be sent
+    droppable = True
+
+    def __init__(self, state:dict, schedule:Dict[str, Sequence], history:Optional[StateHistory]=None,
+                 encoded_schedule:Optional[Dict[str, Union[str, bytes]]]=None):
+        self.state = state
+        self.schedule = schedule
+        self.history = history
+        # the schedule already encoded per encoding (see encode_schedule), spliced into the message
+        self.encoded_schedule = encoded_schedule or {}
+        self._variants: Dict[tuple, dict] = {}
+        self._encoded: Dict[tuple, Union[str, bytes]] = {}
+        self._ids: Optional[list] = None
+
+    def _economy_key(self, connection) -> str:
+        if not connection.economy_schedule:
+            return "legacy"
+        if not connection.schedule_sent:
+            return "schedule"
+        return "round"
+
+    def _delta_base(self, connection) -> Optional[int]:
+        base = connection.acked_round
+        round = self.state["round"]
+        if not connection.delta or not connection.economy_schedule or self.history is None or base is None:
+            return None
+        if base >= round or round % self.history.keep == 0 or base not in self.history or round not in self.history:
+            return None
+        return base
+
+    def variant_key(self, connection) -> tuple:
+        return self._economy_key(connection), self._delta_base(connection)
+
+    def for_connection(self, connection) -> dict:
+        key = self.variant_key(connection)
+        payload = self._variants.get(key)
+        if payload is None:
+            payload = self._build(key)
+            self._variants[key] = payload
+        return payload
+
+    def encoded_for(self, connection) -> Union[str, bytes]:
+        key = self.variant_key(connection) + (connection.encoding,)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            payload = self.for_connection(connection)
+            encoded_schedule = self.encoded_schedule.get(connection.encoding)
+            if key[0] == "schedule" and encoded_schedule is not None:
+                message = {k: v for k, v in payload.items() if k != "economy"}
+                encoded = encode_with(message, "economy", encoded_schedule, connection.encoding)
+            else:
+                encoded = encode_message(payload, connection.encoding)
+            self._encoded[key] = encoded
+        return encoded
+
+    def _build(self, key:tuple) -> dict:
+        economy_key, base = key
+        if economy_key == "legacy":
+            payload = add_remainders(self.state, self.schedule)
+        elif economy_key == "schedule":
+            payload = dict(self.state)
+            payload["economy"] = self.schedule
+        else:
+            payload = self.state
+
+        if base is not None:
+            payload = dict(payload)
+            payload["states_base"] = base
+            payload["states_delta"] = self._states_delta(base)
+            del payload["states"]
+        return payload
+
+    def _states_delta(self, base:int) -> dict:
+        states = self.state["states"]
+        if self._ids is None:
+            # agents.to_dict() is in registry order, which the history indexes
+            self._ids = list(states)
+        changed = self.history.changed(self.state["round"], base, self.schedule)
+        return {self._ids[i]: states[self._ids[i]] for i in changed.tolist()}
+
+    def sent(self, connection):
+        if connection.economy_schedule:
+            connection.schedule_sent = True
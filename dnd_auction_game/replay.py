@@ -0,0 +1,207 @@
+import importlib
+import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.game_logger import iter_log_lines
+from dnd_auction_game.sim import BidCallback, GameSimulator
+
+
+def read_rounds(path:str) -> Tuple[Optional[dict], Iterator[Tuple[dict, Optional[dict]]]]:
+    """(header, iterator of (round state, next round state)) of a server log, streamed.
+
+    The next round is needed to know the rolls of a round's auctions and the
+    bids placed on them; it is None for the last round. Raises ValueError if
+    the log holds more than one game (older servers appended every game to
+    the same log), as its rounds would be replayed with the wrong seed and economy.
+    """
+    lines = (json.loads(line) for line in iter_log_lines(path))
+    header = None
+    first = next(lines, None)
+    if first is not None and first.get("type") == "header":
+        header = first
+        first = next(lines, None)
+
+    def next_round():
+        entry = next(lines, None)
+        while entry is not None and "round" not in entry:
+            if entry.get("type") == "header":
+                raise ValueError("'{}' holds more than one game, only logs of a single game can be replayed".format(path))
+            entry = next(lines, None)
+        return entry
+
+    def pairs():
+        current = first
+        while current is not None:
+            following = next_round()
+            yield current, following
+            current = following
+
+    return header, pairs()
+
+
+class ReplayAuctionHouse(AuctionHouse):
+    """An AuctionHouse whose auctions and rolls come from a log instead of the dice."""
+
+    def __init__(self, seed:Optional[int]=None):
+        super().__init__(game_token="replay", play_token="replay", save_logs=False, seed=seed)
+        self.next_auctions: Dict[str, dict] = {}
+        self.next_rolls: Dict[str, int] = {}
+
+    def use_economy(self, schedule:Dict[str, list]):
+        """Play with a recorded economy schedule (see AuctionHouse.economy_schedule)."""
+        self.gold_income_per_round = np.asarray(schedule["gold_income_per_round"])
+        self.bank_interest_per_round = np.asarray(schedule["bank_interest_per_round"])
+        self.bank_limit_per_round = np.asarray(schedule["bank_limit_per_round"])
+        self._economy_schedule = schedule
+
+    def _generate_auctions(self):
+        auctions = {auction_id: dict(info) for auction_id, info in self.next_auctions.items()}
+        return auctions, dict(self.next_rolls)
+
+
+class LogReplay(GameSimulator):
+    """Replays a recorded game with some of its agents played by new make_bid callbacks.
+
+    Every round offers the recorded auctions with their recorded rolls. The
+    other agents place the bids and pool buys they placed in the log, and
+    AuctionHouse settles them as in the real game, so a swapped agent that
+    outbids them changes who wins. With the seed and economy from the log
+    header, replaying without swapping anyone reproduces the logged states.
+    The log is streamed, one round ahead.
+    """
+
+    def __init__(self, path:str, agents:Dict[str, BidCallback]):
+        header, self._rounds = read_rounds(path)
+        self._current = next(self._rounds, None)
+        if self._current is None:
+            raise ValueError("'{}' has no rounds".format(path))
+
+        first, _ = self._current
+        economy = (header or {}).get("economy") or first.get("economy")
+        if economy is None:
+            raise ValueError("'{}' has no economy schedule, only logs with a header can be replayed".format(path))
+
+        num_rounds = (header or {}).get("num_rounds") or len(economy["gold_income_per_round"])
+        auction_house = ReplayAuctionHouse(seed=(header or {}).get("seed"))
+        super().__init__({}, num_rounds=num_rounds, auction_house=auction_house)
+        self.economy = economy
+
+        # the agents that were there when the game started, in the same order
+        for a_id in first["states"]:
+            auction_house.add_agent(a_id, a_id, "replay")
+
+        unknown = [a_id for a_id in agents if a_id not in auction_house.agents]
+        if unknown:
+            raise ValueError("agents not in the first round of the log: {}".format(unknown))
+
+        self.callbacks = dict(agents)
+        self.errors = {a_id: 0 for a_id in self.callbacks}
+        self.logged_states: Dict[str, dict] = first["states"]
+
+    def start(self):
+        super().start()
+        self.auction_house.use_economy(self.economy)
+
+    def step(self) -> dict:
+        auction_house = self.auction_house
+        line, following = self._current
+
+        for a_id in line["states"]:
+            if a_id not in auction_house.agents:
+                auction_house.add_agent(a_id, a_id, "replay")
+
+        auction_house.next_auctions = line["auctions"]
+        auction_house.next_rolls = {}
+        if following is not None:
+            auction_house.next_rolls = {auction_id: info["reward"] for auction_id, info in following["prev_auctions"].items()}
+
+        round_data = super().step()
+        self.logged_states = line["states"]
+
+        # the recorded agents bid what they bid in the log
+        if following is not None:
+            for auction_id, info in following["prev_auctions"].items():
+                for bid in info["bids"]:
+                    if bid["a_id"] not in self.callbacks:
+                        auction_house.register_bid(bid["a_id"], auction_id, bid["gold"])
+
+            for a_id, points in following["prev_pool_buys"].items():
+                if a_id not in self.callbacks and points > 0:
+                    auction_house.register_pool_buy(a_id, points)
+
+        self._current = next(self._rounds, None)
+        if self._current is None:
+            auction_house.is_active = False
+            auction_house.is_done = True
+
+        return round_data
+
+
+def replay(path:str, agents:Dict[str, BidCallback]) -> Dict[str, dict]:
+    """Replay a server log with the agents {a_id: make_bid} swapped in, return the final
+    gold and points of every agent (like sim.simulate)."""
+    return LogReplay(path, agents).run()
+
+
+def rank(results:Dict[str, dict], a_id:str) -> int:
+    points = results[a_id]["points"]
+    return 1 + sum(1 for r in results.values() if r["points"] > points)
+
+
+def _evaluate_one(path:str, a_ids:List[str], candidate:BidCallback) -> dict:
+    game = LogReplay(path, {a_id: candidate for a_id in a_ids})
+    results = game.run()
+    return {
+        a_id: {
+            "points": results[a_id]["points"],
+            "gold": results[a_id]["gold"],
+            "rank": rank(results, a_id),
+            "logged_points": game.logged_states.get(a_id, {}).get("points"),
+            "errors": game.errors[a_id],
+        }
+        for a_id in a_ids
+    }
+
+
+def evaluate(path:str, candidates:Dict[str, BidCallback], a_ids:Union[str, Iterable[str]],
+             max_workers:Optional[int]=None) -> Dict[str, dict]:
+    """Replay the log once per candidate make_bid, in worker processes.
+
+    Each candidate plays the agents `a_ids` of the log. Candidates are sent to
+    the workers by reference, so they must be functions defined at module level.
+    Returns {candidate: {a_id: {points, gold, rank, logged_points, errors}}}.
+    """
+    a_ids = [a_ids] if isinstance(a_ids, str) else list(a_ids)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+        futures = {name: pool.submit(_evaluate_one, path, a_ids, candidate) for name, candidate in candidates.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def load_callback(spec:str) -> BidCallback:
+    """'package.module:function' -> the function"""
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "make_bid")
+
+
+def main():
+    if len(sys.argv) < 4:
+        print("usage: python -m dnd_auction_game.replay LOG AGENT_ID module:make_bid [module:make_bid ...]")
+        sys.exit(1)
+
+    path, a_id = sys.argv[1], sys.argv[2]
+    candidates = {spec: load_callback(spec) for spec in sys.argv[3:]}
+    for name, result in evaluate(path, candidates, a_id).items():
+        r = result[a_id]
+        print("{}: points {} (logged {}), rank {}, gold {}, errors {}".format(
+            name, r["points"], r["logged_points"], r["rank"], r["gold"], r["errors"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,11 @@ def main():
             print("<ERROR: port must be an integer>")
             sys.exit(1)
 
-    url = f"http://{host}:{port}/reset/{play_token}"
+    game_id = os.environ.get("AH_GAME_ID")
+    if game_id:
+        url = f"http://{host}:{port}/reset/{game_id}/{play_token}"
+    else:
+        url = f"http://{host}:{port}/reset/{play_token}"
     print(f"Connecting to: {url}")
 
     try:
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from typing import Iterable, Optional, Set
+
+
+# seconds an event mode round lasts at least when no agent is connected
+IDLE_ROUND_TIME = 0.1
+
+
+class RoundScheduler:
+    """Decides when the current round of a game is closed.
+
+    In "fixed" mode every round lasts max_round_time seconds, like the original
+    one second tick. In "event" mode the round closes as soon as every agent that
+    was connected when it started has submitted (but not before min_round_time),
+    or when max_round_time has passed. With no agent to wait for, a round lasts
+    max_round_time (at least IDLE_ROUND_TIME), so an empty game doesn't spin.
+    """
+
+    MODES = ("fixed", "event")
+
+    def __init__(self, mode:str="fixed", min_round_time:float=0.0, max_round_time:float=1.0):
+        self.mode = "fixed"
+        self.min_round_time = 0.0
+        self.max_round_time = 1.0
+        self.configure(mode, min_round_time, max_round_time)
+        self._defaults = (self.mode, self.min_round_time, self.max_round_time)
+
+        self.round = -1
+        self._round_started = 0.0
+        self._expected: Set[str] = set()
+        self._submitted: Set[str] = set()
+        # agents that tag their answers with the round, their untagged messages don't count
+        self._tagging: Set[str] = set()
+        self._all_in: Optional[asyncio.Event] = None
+        self._started: Optional[asyncio.Event] = None
+
+    def configure(self, mode:Optional[str]=None, min_round_time:Optional[float]=None, max_round_time:Optional[float]=None):
+        if mode is not None:
+            if mode not in self.MODES:
+                raise ValueError("unknown round mode: '{}'".format(mode))
+            self.mode = mode
+
+        if min_round_time is not None:
+            self.min_round_time = max(0.0, float(min_round_time))
+        if max_round_time is not None:
+            self.max_round_time = max(0.0, float(max_round_time))
+        self.max_round_time = max(self.max_round_time, self.min_round_time)
+
+    def reset(self):
+        self.configure(*self._defaults)
+        self.round = -1
+        self._expected = set()
+        self._submitted = set()
+        self._tagging = set()
+
+    def _events(self):
+        # created lazily so they belong to the running event loop
+        if self._all_in is None:
+            self._all_in = asyncio.Event()
+            self._started = asyncio.Event()
+        return self._all_in, self._started
+
+    def round_started(self, round:int, expected:Iterable[str]):
+        """Call before broadcasting `round`, with the ids of the connected agents."""
+        all_in, _ = self._events()
+        self.round = round
+        self._round_started = time.monotonic()
+        self._expected = set(expected)
+        self._submitted = set()
+        all_in.clear()
+        self._check()
+
+    def submitted(self, a_id:str, round:Optional[int]=None):
+        """An agent sent its bids. Only answers to the current round count, untagged
+        ones only from agents that never tag (older clients)."""
+        if round is None:
+            if a_id in self._tagging:
+                return
+        else:
+            self._tagging.add(a_id)
+            if round != self.round:
+                return
+        self._submitted.add(a_id)
+        self._check()
+
+    def agent_left(self, a_id:str):
+        self._expected.discard(a_id)
+        self._tagging.discard(a_id)
+        self._check()
+
+    def _check(self):
+        if self._all_in is not None and self._expected <= self._submitted:
+            self._all_in.set()
+
+    def game_started(self):
+        _, started = self._events()
+        started.set()
+
+    async def wait_for_game(self, timeout:float):
+        """Idle until a game is started (or the timeout passes)."""
+        _, started = self._events()
+        try:
+            await asyncio.wait_for(started.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        started.clear()
+
+    async def wait_round_end(self):
+        if self.mode == "fixed":
+            await asyncio.sleep(self.max_round_time)
+            return
+
+        if not self._expected:
+            remaining = self._round_started + max(self.max_round_time, IDLE_ROUND_TIME) - time.monotonic()
+            await asyncio.sleep(max(0.0, remaining))
+            return
+
+        all_in, _ = self._events()
+        remaining = self._round_started + self.max_round_time - time.monotonic()
+        if remaining > 0:
+            try:
+                await asyncio.wait_for(all_in.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        remaining_min = self._round_started + self.min_round_time - time.monotonic()
+        await asyncio.sleep(max(0.0, remaining_min))
@@ -0,0 +1,403 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import tempfile
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import (
+    WebSocket,
+    WebSocketDisconnect,
+)
+
+from dnd_auction_game import metrics
+from dnd_auction_game.game_logger import flush_all
+from dnd_auction_game.leadboard import LeadboardSnapshot
+from dnd_auction_game.lobby import LobbyManager
+from dnd_auction_game.protocol import encode_json
+
+
+# Sharded mode: games live in worker processes, each running a LobbyManager on
+# its own event loop. The front end (the uvicorn app) keeps the websockets and
+# relays every one of them over its own local stream to the shard owning the game.
+#
+# Every stream carries frames of one type byte, a 4 byte length and the payload.
+FRAME_OPEN = b"O"     # front end -> shard, json: what the stream is for
+FRAME_ACCEPT = b"A"   # shard -> front end, accept the websocket
+FRAME_TEXT = b"T"
+FRAME_BYTES = b"B"
+FRAME_CLOSE = b"C"
+FRAME_RESULT = b"R"   # shard -> front end, json answer to a call
+
+_HEADER = struct.Struct(">cI")
+
+# methods of LobbyManager that the front end may call on a shard
+CALLS = ("reset", "leadboard_data", "leadboard_page", "leadboard_export", "summaries", "metrics")
+
+
+async def read_frame(reader:asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    """Next (type, payload) on the stream, (FRAME_CLOSE, b"") once it has ended."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        kind, length = _HEADER.unpack(header)
+        payload = await reader.readexactly(length) if length else b""
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return FRAME_CLOSE, b""
+    return kind, payload
+
+
+class FrameWriter:
+    """Writes whole frames; safe to use from several tasks at once."""
+
+    def __init__(self, writer:asyncio.StreamWriter):
+        self.writer = writer
+        self.closed = False
+        self._lock = asyncio.Lock()
+
+    async def send(self, kind:bytes, payload:bytes=b""):
+        if self.closed:
+            raise ConnectionError("stream closed")
+        async with self._lock:
+            self.writer.write(_HEADER.pack(kind, len(payload)) + payload)
+            await self.writer.drain()
+
+    async def close(self):
+        if self.closed:
+            return
+        try:
+            await self.send(FRAME_CLOSE)
+        except Exception:
+            pass
+        self.closed = True
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class RelayWebSocket:
+    """The side of a relayed websocket that a Lobby in a shard talks to.
+
+    Implements the part of starlette's WebSocket used by Lobby and
+    ConnectionManager, on top of a frame stream from the front end.
+    """
+
+    def __init__(self, reader:asyncio.StreamReader, frames:FrameWriter):
+        self.reader = reader
+        self.frames = frames
+        self.accepted = False
+
+    async def accept(self):
+        await self.frames.send(FRAME_ACCEPT)
+        self.accepted = True
+
+    async def receive(self) -> dict:
+        """The next message as an ASGI websocket event, like WebSocket.receive()."""
+        kind, payload = await read_frame(self.reader)
+        while kind not in (FRAME_TEXT, FRAME_BYTES, FRAME_CLOSE):
+            kind, payload = await read_frame(self.reader)
+
+        if kind == FRAME_CLOSE:
+            return {"type": "websocket.disconnect", "code": 1000}
+        if kind == FRAME_BYTES:
+            return {"type": "websocket.receive", "bytes": payload}
+        return {"type": "websocket.receive", "text": payload.decode("utf-8")}
+
+    async def receive_text(self) -> str:
+        message = await self.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message["code"])
+        if message.get("text") is None:
+            raise RuntimeError("expected a text message")
+        return message["text"]
+
+    async def receive_json(self):
+        return json.loads(await self.receive_text())
+
+    async def send_text(self, text:str):
+        await self.frames.send(FRAME_TEXT, text.encode("utf-8"))
+
+    async def send_bytes(self, data:bytes):
+        await self.frames.send(FRAME_BYTES, data)
+
+    async def send_json(self, message:dict):
+        await self.send_text(encode_json(message))
+
+    async def close(self):
+        await self.frames.close()
+
+
+class ShardWorker:
+    """Serves the lobbies of one shard to the front end."""
+
+    def __init__(self, shard_id:int, lobbies:LobbyManager):
+        self.shard_id = shard_id
+        self.lobbies = lobbies
+
+    async def handle_stream(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        frames = FrameWriter(writer)
+        try:
+            kind, payload = await read_frame(reader)
+            if kind != FRAME_OPEN:
+                return
+            request = json.loads(payload)
+
+            if request["kind"] == "call":
+                result = await self._call(request)
+                await frames.send(FRAME_RESULT, json.dumps(result).encode("utf-8"))
+                return
+
+            websocket = RelayWebSocket(reader, frames)
+            if request["kind"] == "agent":
+                await self.lobbies.handle_agent(websocket, request["game_id"], request["token"])
+            elif request["kind"] == "runner":
+                await self.lobbies.handle_runner(websocket, request["game_id"], request["token"])
+            elif request["kind"] == "spectator":
+                await self.lobbies.handle_spectator(websocket, request["game_id"])
+
+        except Exception as e:
+            print("shard {}: error in stream: {}".format(self.shard_id, e))
+
+        finally:
+            await frames.close()
+
+    async def _call(self, request:dict):
+        method = request.get("method")
+        if method not in CALLS:
+            return None
+        return await getattr(self.lobbies, method)(*request.get("args", []))
+
+
+async def _serve_shard(shard_id:int, address, ready):
+    lobbies = LobbyManager.from_env()
+    worker = ShardWorker(shard_id, lobbies)
+    await lobbies.start()
+
+    if isinstance(address, str):
+        server = await asyncio.start_unix_server(worker.handle_stream, path=address)
+    else:
+        server = await asyncio.start_server(worker.handle_stream, host=address[0], port=address[1])
+        address = server.sockets[0].getsockname()[:2]
+
+    ready.put((shard_id, address))
+    async with server:
+        await server.serve_forever()
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
+def run_shard(shard_id:int, address, ready):
+    """Entry point of a shard worker process."""
+    # the front end stops shards with SIGTERM, exit cleanly so the logs get flushed
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    try:
+        asyncio.run(_serve_shard(shard_id, address, ready))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        flush_all()
+
+
+def shard_of(game_id:str, n_shards:int) -> int:
+    # crc32 rather than hash(): it has to be the same in every process
+    return zlib.crc32(game_id.encode("utf-8")) % n_shards
+
+
+class ShardRouter:
+    """Front end of the sharded mode.
+
+    Starts `n_shards` worker processes and routes every game to one of them by
+    its id. Offers the same async methods as LobbyManager, so the server routes
+    do not care where the games run. Reads that span all games (summaries) are
+    gathered from every shard.
+    """
+
+    def __init__(self, n_shards:int, socket_dir:Optional[str]=None, start_timeout:float=30.0):
+        self.n_shards = max(1, n_shards)
+        self.socket_dir = socket_dir
+        self.start_timeout = start_timeout
+        self.processes: List[multiprocessing.Process] = []
+        self.addresses: List = [None] * self.n_shards
+        # leaderboards are cached here and only fetched from the shard when they changed
+        self._snapshots: Dict[str, LeadboardSnapshot] = {}
+
+    @staticmethod
+    def valid_game_id(game_id:str) -> bool:
+        return LobbyManager.valid_game_id(game_id)
+
+    def shard_of(self, game_id:str) -> int:
+        return shard_of(game_id, self.n_shards)
+
+    def _requested_addresses(self) -> list:
+        if not hasattr(socket, "AF_UNIX"):
+            return [("127.0.0.1", 0)] * self.n_shards
+        if self.socket_dir is None:
+            self.socket_dir = tempfile.mkdtemp(prefix="auction_shards_")
+        return [os.path.join(self.socket_dir, "shard_{}.sock".format(i)) for i in range(self.n_shards)]
+
+    async def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        ready = ctx.Queue()
+        for shard_id, address in enumerate(self._requested_addresses()):
+            process = ctx.Process(target=run_shard, args=(shard_id, address, ready), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        loop = asyncio.get_running_loop()
+        for _ in range(self.n_shards):
+            shard_id, address = await loop.run_in_executor(None, ready.get, True, self.start_timeout)
+            self.addresses[shard_id] = address
+        print("<started {} shards>".format(self.n_shards))
+
+    async def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.processes = []
+
+        for address in self.addresses:
+            if isinstance(address, str) and os.path.exists(address):
+                os.remove(address)
+        if self.socket_dir is not None and os.path.isdir(self.socket_dir) and not os.listdir(self.socket_dir):
+            os.rmdir(self.socket_dir)
+
+    async def _open(self, address, request:dict) -> Tuple[asyncio.StreamReader, FrameWriter]:
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(address[0], address[1])
+
+        frames = FrameWriter(writer)
+        await frames.send(FRAME_OPEN, json.dumps(request).encode("utf-8"))
+        return reader, frames
+
+    async def _call(self, address, method:str, *args):
+        reader, frames = await self._open(address, {"kind": "call", "method": method, "args": list(args)})
+        try:
+            kind, payload = await read_frame(reader)
+            return json.loads(payload) if kind == FRAME_RESULT else None
+        finally:
+            await frames.close()
+
+    def _address_of(self, game_id:str):
+        return self.addresses[self.shard_of(game_id)]
+
+    async def _relay(self, websocket:WebSocket, game_id:str, kind:str, token:str):
+        if not self.valid_game_id(game_id):
+            return
+
+        reader, frames = await self._open(self._address_of(game_id), {"kind": kind, "game_id": game_id, "token": token})
+        try:
+            # the lobby decides whether the websocket is accepted at all
+            frame, _ = await read_frame(reader)
+            if frame != FRAME_ACCEPT:
+                return
+            await websocket.accept()
+
+            async def to_shard():
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        return
+                    if message.get("text") is not None:
+                        await frames.send(FRAME_TEXT, message["text"].encode("utf-8"))
+                    elif message.get("bytes") is not None:
+                        await frames.send(FRAME_BYTES, message["bytes"])
+
+            async def to_client():
+                while True:
+                    frame, payload = await read_frame(reader)
+                    if frame == FRAME_CLOSE:
+                        return
+                    if frame == FRAME_TEXT:
+                        await websocket.send_text(payload.decode("utf-8"))
+                    elif frame == FRAME_BYTES:
+                        await websocket.send_bytes(payload)
+
+            tasks = [asyncio.create_task(to_shard()), asyncio.create_task(to_client())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            try:
+                await websocket.close()
+            except:
+                pass
+
+        finally:
+            await frames.close()
+
+    async def handle_agent(self, websocket:WebSocket, game_id:str, token:str):
+        await self._relay(websocket, game_id, "agent", token)
+
+    async def handle_runner(self, websocket:WebSocket, game_id:str, play_token:str):
+        await self._relay(websocket, game_id, "runner", play_token)
+
+    async def handle_spectator(self, websocket:WebSocket, game_id:str):
+        await self._relay(websocket, game_id, "spectator", "")
+
+    async def reset(self, game_id:str, play_token:str) -> dict:
+        return await self._call(self._address_of(game_id), "reset", game_id, play_token)
+
+    async def leadboard_data(self, game_id:str) -> Optional[dict]:
+        return await self._call(self._address_of(game_id), "leadboard_data", game_id)
+
+    async def leadboard_page(self, game_id:str) -> Optional[dict]:
+        return await self._call(self._address_of(game_id), "leadboard_page", game_id)
+
+    async def leadboard_snapshot(self, game_id:str) -> Optional[LeadboardSnapshot]:
+        if not self.valid_game_id(game_id):
+            return None
+
+        cached = self._snapshots.get(game_id)
+        export = await self._call(self._address_of(game_id), "leadboard_export", game_id,
+                                  cached.etag if cached is not None else None)
+        if export is None:
+            self._snapshots.pop(game_id, None)
+            return None
+        if "data" not in export:
+            return cached
+
+        snapshot = LeadboardSnapshot(export["etag"], export["data"], export["page"])
+        self._snapshots[game_id] = snapshot
+        return snapshot
+
+    async def summaries(self) -> List[dict]:
+        results = await asyncio.gather(*(self._call(a, "summaries") for a in self.addresses), return_exceptions=True)
+
+        summaries = []
+        for shard_id, result in enumerate(results):
+            if isinstance(result, Exception) or result is None:
+                print("shard {}: no summaries: {}".format(shard_id, result))
+                continue
+            for summary in result:
+                summary["shard"] = shard_id
+                summaries.append(summary)
+        return summaries
+
+    async def metrics(self) -> dict:
+        """The metrics of every shard summed with those of the front end, and all lobby summaries."""
+        results = await asyncio.gather(*(self._call(a, "metrics") for a in self.addresses), return_exceptions=True)
+
+        exports = [metrics.export()]
+        lobbies = []
+        for shard_id, result in enumerate(results):
+            if isinstance(result, Exception) or result is None:
+                print("shard {}: no metrics: {}".format(shard_id, result))
+                continue
+            exports.append(result["process"])
+            for summary in result["lobbies"]:
+                summary["shard"] = shard_id
+                lobbies.append(summary)
+        return {"process": metrics.merge(exports), "lobbies": lobbies}
@@ -0,0 +1,117 @@
+import copy
+from typing import Callable, Dict, List, Optional, Union
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.protocol import bank_state_from_round
+
+
+BidCallback = Callable[..., dict]
+
+
+class GameSimulator:
+    """Runs a full game in-process by driving AuctionHouse directly.
+
+    Each round follows the same order as server.server_tick: pool buys and bids
+    from the previous round are resolved, a new round state is prepared and then
+    every agent's make_bid callback is invoked with the same arguments that
+    AuctionGameClient would pass it. No sockets, JSON or sleeps are involved.
+
+    Every callback gets its own copies of the round state and plain bank_state
+    lists, like a networked agent, so it can change them without affecting the
+    other agents or the game log.
+    """
+
+    def __init__(self, agents:Union[Dict[str, BidCallback], List[BidCallback]], num_rounds:int=10,
+                 auction_house:Optional[AuctionHouse]=None, save_logs:bool=False, seed:Optional[int]=None):
+
+        if auction_house is None:
+            auction_house = AuctionHouse(game_token="sim", play_token="sim", save_logs=save_logs, seed=seed)
+        self.auction_house = auction_house
+        self.num_rounds = max(1, int(num_rounds))
+
+        if isinstance(agents, dict):
+            named_agents = list(agents.items())
+        else:
+            named_agents = [(getattr(cb, "__name__", "agent"), cb) for cb in agents]
+
+        self.callbacks: Dict[str, BidCallback] = {}
+        for i, (name, callback) in enumerate(named_agents):
+            a_id = "sim_agent_{}".format(i)
+            self.callbacks[a_id] = callback
+            self.auction_house.add_agent(name[0:64], a_id, "sim")
+
+        self.errors: Dict[str, int] = {a_id: 0 for a_id in self.callbacks}
+
+    def start(self):
+        self.auction_house.start_game(self.num_rounds)
+
+    def step(self) -> dict:
+        auction_house = self.auction_house
+        auction_house.process_pool_buys()
+        auction_house.process_all_bids()
+        round_data = auction_house.prepare_auctions_and_pool()
+
+        schedule = auction_house.economy_schedule()
+        arguments = (round_data["states"], round_data["auctions"], round_data["prev_auctions"],
+                     round_data["pool"], round_data["prev_pool_buys"])
+
+        for a_id, callback in self.callbacks.items():
+            states, auctions, prev_auctions, pool, prev_pool_buys = copy.deepcopy(arguments)
+            try:
+                bids_and_pool = callback(a_id,
+                                         round_data["round"],
+                                         states,
+                                         auctions,
+                                         prev_auctions,
+                                         pool,
+                                         prev_pool_buys,
+                                         bank_state_from_round(round_data, schedule))
+            except Exception as e:
+                print("error in make_bid for agent {}: {}".format(a_id, e))
+                self.errors[a_id] += 1
+                continue
+
+            if not bids_and_pool:
+                continue
+
+            try:
+                pool = bids_and_pool.get("pool", 0)
+                if pool > 0:
+                    auction_house.register_pool_buy(a_id, pool)
+
+                for auction_id, gold in bids_and_pool.get("bids", {}).items():
+                    auction_house.register_bid(a_id, auction_id, gold)
+
+            except Exception as e:
+                print("error registering bids for agent {}: {}".format(a_id, e))
+                self.errors[a_id] += 1
+
+        if auction_house.round_counter >= auction_house.num_rounds_in_game:
+            auction_house.is_active = False
+            auction_house.is_done = True
+
+        return round_data
+
+    def run(self) -> Dict[str, dict]:
+        self.start()
+        while not self.auction_house.is_done:
+            self.step()
+
+        return self.results()
+
+    def results(self) -> Dict[str, dict]:
+        agents = self.auction_house.agents
+        results = {}
+        for a_id, name, gold, points in zip(agents.ids, agents.names, agents.gold.tolist(), agents.points.tolist()):
+            results[a_id] = {
+                "name": name,
+                "gold": gold,
+                "points": points,
+            }
+        return results
+
+
+def simulate(agents:Union[Dict[str, BidCallback], List[BidCallback]], num_rounds:int=10, save_logs:bool=False,
+             seed:Optional[int]=None) -> Dict[str, dict]:
+    """Play one headless game and return the final gold and points per agent id."""
+    return GameSimulator(agents, num_rounds=num_rounds, save_logs=save_logs, seed=seed).run()
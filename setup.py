@@ -50,7 +50,11 @@ setup(
           'fastapi',
           'uvicorn',
           'websockets',
-          'Jinja2'
+          'Jinja2',
+          'numpy'
       ],
+    extras_require={
+        'msgpack': ['msgpack'],
+    },
 )
 
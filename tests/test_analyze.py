@@ -0,0 +1,74 @@
+import json
+from collections import Counter
+
+from dnd_auction_game.analyze import LogStats, analyze, columnar_stats
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.game_logger import flush_all, iter_log_lines
+from dnd_auction_game.logs import convert_log, load_log
+from dnd_auction_game.sim import GameSimulator
+
+
+def bid_two(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    # everyone bids the same on the same auctions, so most of them end in a tie
+    return {"bids": {auction_id: 2 for auction_id in list(auctions)[:3]}}
+
+
+def bid_round(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    return {"bids": {auction_id: 1 + round % 3 for auction_id in list(auctions)[:3]}}
+
+
+def tied_game(tmp_path, monkeypatch):
+    """The log of a game with many ties, and who really won every auction."""
+    monkeypatch.chdir(tmp_path)
+    auction_house = AuctionHouse("play", "play", save_logs=True, seed=5)
+    game = GameSimulator([bid_two, bid_two, bid_round], num_rounds=30, auction_house=auction_house)
+
+    winners = Counter()
+    resolve = auction_house.process_all_bids
+
+    def counting_resolve():
+        resolve()
+        winners.update(auction_house.current_winners.values())
+
+    auction_house.process_all_bids = counting_resolve
+    game.run()
+    assert flush_all()
+    return auction_house.log_file, winners
+
+
+def test_ties_count_for_the_agent_the_server_picked(tmp_path, monkeypatch):
+    path, winners = tied_game(tmp_path, monkeypatch)
+
+    stats = analyze([path], workers=1)
+    columnar = columnar_stats(load_log(convert_log(path, str(tmp_path / "log.cols"))))
+    for rows in (stats.table(), columnar.table()):
+        assert {row["a_id"]: row["wins"] for row in rows if row["wins"]} == dict(winners)
+        assert all(row["unresolved_ties"] == 0 for row in rows)
+        assert sum(row["ties"] for row in rows) > 0
+    assert stats.table() == columnar.table()
+
+
+def test_ties_of_older_logs_are_unresolved(tmp_path, monkeypatch):
+    path, winners = tied_game(tmp_path, monkeypatch)
+
+    # a log from before the winner was recorded
+    old_path = str(tmp_path / "old.jsonln")
+    with open(old_path, "w") as fp:
+        for line in iter_log_lines(path):
+            entry = json.loads(line)
+            for info in entry.get("prev_auctions", {}).values():
+                info.pop("winner", None)
+            fp.write(json.dumps(entry) + "\n")
+
+    stats = LogStats()
+    for line in iter_log_lines(old_path):
+        stats.add_round(json.loads(line))
+    columnar = columnar_stats(load_log(convert_log(old_path)))
+
+    for rows in (stats.table(), columnar.table()):
+        for row in rows:
+            assert row["unresolved_ties"] == row["ties"]
+            assert row["wins"] <= winners[row["a_id"]]
+            decided = row["auctions"] - row["unresolved_ties"]
+            assert row["win_rate"] == (row["wins"] / decided if decided else 0.0)
+        assert sum(row["unresolved_ties"] for row in rows) > 0
@@ -0,0 +1,28 @@
+import json
+
+from dnd_auction_game.protocol import add_remainders, bank_state_from_round
+
+
+SCHEDULE = {
+    "gold_income_per_round": [1000, 1010, 990, 1020],
+    "bank_interest_per_round": [1.1, 1.05, 1.2, 1.0],
+    "bank_limit_per_round": [2000, 2100, 1900, 2000],
+}
+
+
+def test_bank_state_is_plain_lists_with_either_protocol():
+    state = {"round": 1, "states": {}}
+    legacy = bank_state_from_round(add_remainders(state, SCHEDULE), None)
+    cached = bank_state_from_round(state, SCHEDULE)
+    assert cached == legacy
+
+    for bank_state in (legacy, cached):
+        assert all(type(values) is list for values in bank_state.values())
+        assert bank_state["gold_income_per_round"] == [1010, 990, 1020]
+        json.dumps(bank_state)
+
+    # what existing make_bid callbacks do with them
+    cached["gold_income_per_round"].append(0)
+    extended = cached["bank_limit_per_round"] + [0]
+    assert extended[-1] == 0
+    assert SCHEDULE["gold_income_per_round"] == [1000, 1010, 990, 1020]
@@ -0,0 +1,87 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from dnd_auction_game.sim import GameSimulator
+
+
+def baseline_resolve(house):
+    """process_all_bids of the original per-auction implementation, on plain python values.
+
+    The only change is that the tie swap draws from the house's priority_rng
+    (a copy of it) instead of the global `random`, so both pick the same loser.
+    Returns (gold, points, priority, gold_in_pool).
+    """
+    gold = house.agents.gold.tolist()
+    points_of = house.agents.points.tolist()
+    priority = house.agents.priority.tolist()
+    rng = copy.deepcopy(house.priority_rng)
+
+    bids_per_auction = {}
+    auctions, agents, bid_gold = house.current_bids.columns()
+    for auction_idx, a, g in zip(auctions.tolist(), agents.tolist(), bid_gold.tolist()):
+        bids_per_auction.setdefault(house.current_bids.auction_ids[auction_idx], []).append((a, g))
+
+    gold_from_non_winning_bids = 0
+    for auction_id, bids in bids_per_auction.items():
+        points = house.current_rolls.get(auction_id)
+        if points is None:
+            continue
+        win_amount = max(bids, key=lambda x: x[1])[1]
+        tied = [a for a, bid in bids if bid == win_amount]
+        if len(tied) == 1:
+            winner = tied[0]
+        else:
+            winner = max(tied, key=lambda a: priority[a])
+            losers_tied = [a for a in tied if a != winner]
+            weights = np.array([1.0 / max(priority[a], 1) for a in losers_tied])
+            swap_with = losers_tied[rng.choice(len(losers_tied), p=weights / weights.sum())]
+            priority[winner], priority[swap_with] = priority[swap_with], priority[winner]
+
+        for a, bid in bids:
+            if a == winner and bid == win_amount:
+                points_of[a] += points
+            else:
+                back_value = int(bid * house.gold_back_fraction)
+                gold_from_non_winning_bids += max(0, bid - back_value)
+                gold[a] += back_value
+
+    gold_in_pool = len(gold) if not bids_per_auction else \
+        max(len(gold), int(gold_from_non_winning_bids * house.convert_to_pool_fraction))
+    return gold, points_of, priority, gold_in_pool
+
+
+def tie_maker(seed):
+    rng = random.Random(seed)
+
+    def make_bid(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+        # a handful of small amounts, so most auctions end in a tie
+        gold = states[agent_id]["gold"]
+        bids = {auction_id: rng.choice((1, 2, 3, 5, gold // 4)) for auction_id in auctions if rng.random() < 0.6}
+        return {"bids": bids}
+
+    return make_bid
+
+
+@pytest.mark.parametrize("seed", [1, 7, 42])
+def test_vectorized_resolution_matches_the_baseline(seed):
+    game = GameSimulator([tie_maker(seed * 100 + i) for i in range(12)], num_rounds=25, seed=seed)
+    house = game.auction_house
+    resolve = house.process_all_bids
+    n_ties = []
+
+    def checked_resolve():
+        expected = baseline_resolve(house)
+        if len(house.current_bids):
+            n_ties.append(int((house.current_bids.top_bids()[4] > 1).sum()))
+        resolve()
+        assert house.agents.gold.tolist() == expected[0]
+        assert house.agents.points.tolist() == expected[1]
+        assert house.agents.priority.tolist() == expected[2]
+        assert house.gold_in_pool == expected[3]
+
+    house.process_all_bids = checked_resolve
+    game.run()
+    assert sum(n_ties) > 0
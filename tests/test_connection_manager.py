@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from dnd_auction_game.connection_manager import ConnectionManager
+
+
+class SlowWebSocket:
+    """Takes `delay` seconds for every send."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+        self.closed = False
+
+    async def send_text(self, data):
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(data))
+
+    async def close(self):
+        self.closed = True
+
+
+def test_a_full_queue_drops_the_oldest_messages_but_keeps_the_agent():
+    manager = ConnectionManager(max_queue=3, send_timeout=0)
+    websocket = SlowWebSocket(0.05)
+
+    async def flood():
+        await manager.add_connection(websocket, a_id="slow")
+        for i in range(10):
+            await manager.broadcast({"n": i})
+        await manager.disconnect_all(drain_timeout=2.0)
+
+    asyncio.run(flood())
+    stats = manager.stats()
+    received = [message["n"] for message in websocket.sent]
+    # broadcast does not wait for the writer, so all ten piled up in the queue
+    assert received == [7, 8, 9]
+    assert stats["sent"] == 3
+    assert stats["dropped"] == 7
+    assert stats["overflowed"] == 7
+    assert stats["failed"] == 0
+
+
+def test_a_send_over_the_timeout_disconnects_the_agent():
+    manager = ConnectionManager(send_timeout=0.01)
+    websocket = SlowWebSocket(0.1)
+
+    async def send():
+        await manager.add_connection(websocket, a_id="stuck")
+        await manager.broadcast({"n": 0})
+        await asyncio.sleep(0.05)
+
+    asyncio.run(send())
+    assert websocket.closed
+    assert manager.stats()["failed"] == 1
+    assert manager.active_connections == []
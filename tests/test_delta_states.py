@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+from dnd_auction_game.client import AuctionGameClient
+from dnd_auction_game.protocol import RoundPayloads, StateHistory, apply_states_delta, decode_message
+from dnd_auction_game.sim import GameSimulator
+
+
+def bid_some(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    gold = states[agent_id]["gold"]
+    bids = {auction_id: max(1, gold // (3 + i)) for i, auction_id in enumerate(list(auctions)[:2])}
+    return {"bids": bids, "pool": 1 if round % 5 == 0 else 0}
+
+
+def bid_nothing(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    # their states follow the economy, so deltas leave them out
+    return {}
+
+
+class Connection:
+    """What RoundPayloads looks at of an AgentConnection."""
+
+    def __init__(self):
+        self.encoding = "json"
+        self.economy_schedule = True
+        self.schedule_sent = False
+        self.delta = True
+        self.acked_round = None
+
+
+def rounds(num_rounds=30, keep=4):
+    """(full round state, payloads) of every round of a simulated game."""
+    game = GameSimulator([bid_some, bid_nothing] * 3, num_rounds=num_rounds, seed=3)
+    history = StateHistory(keep=keep)
+    game.start()
+    while not game.auction_house.is_done:
+        round_data = game.step()
+        history.record(round_data["round"], game.auction_house.agents.gold, game.auction_house.agents.points)
+        yield round_data, RoundPayloads(round_data, game.auction_house.economy_schedule(), history)
+
+
+def receive(payloads, connection):
+    message = decode_message(payloads.encoded_for(connection))
+    payloads.sent(connection)
+    return message
+
+
+def test_deltas_rebuild_the_full_states():
+    connection = Connection()
+    known_states = OrderedDict()
+    economy = None
+    n_deltas = n_keyframes = 0
+
+    for round_data, payloads in rounds():
+        message = receive(payloads, connection)
+        economy = message.get("economy", economy)
+        if "states_delta" in message:
+            assert len(message["states_delta"]) < len(round_data["states"])
+            n_deltas += 1
+        else:
+            n_keyframes += 1
+
+        assert AuctionGameClient._read_states(message, known_states, economy)
+        assert message["states"] == round_data["states"]
+        connection.acked_round = message["round"]
+
+    assert n_deltas > 0 and n_keyframes > 1
+
+
+def test_unknown_base_asks_for_a_resync():
+    connection = Connection()
+    known_states = OrderedDict()
+    economy = None
+    resynced = False
+
+    for round_data, payloads in rounds():
+        message = receive(payloads, connection)
+        economy = message.get("economy", economy)
+        if "states_delta" in message and not resynced:
+            # as if the agent had lost the round it acknowledged
+            known_states.clear()
+            assert apply_states_delta(message, known_states, economy) is None
+            assert not AuctionGameClient._read_states(message, known_states, economy)
+            # the client then sends {"resync": true}, the server forgets the ack
+            connection.acked_round = None
+            resynced = True
+            continue
+
+        assert AuctionGameClient._read_states(message, known_states, economy)
+        assert message["states"] == round_data["states"]
+        connection.acked_round = message["round"]
+
+    assert resynced
+
+
+def test_changing_the_states_given_to_make_bid_does_not_corrupt_later_rounds():
+    connection = Connection()
+    known_states = OrderedDict()
+    economy = None
+
+    for round_data, payloads in rounds():
+        message = receive(payloads, connection)
+        economy = message.get("economy", economy)
+        assert AuctionGameClient._read_states(message, known_states, economy)
+        assert message["states"] == round_data["states"]
+
+        # what a strategy might do with its arguments
+        for state in message["states"].values():
+            state["gold"] -= 100
+            state["points"] = -1
+        message["states"].clear()
+        connection.acked_round = message["round"]
@@ -0,0 +1,87 @@
+import itertools
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from dnd_auction_game.dice import DiceTable
+
+SMALL = [(2, 1), (2, 4), (3, 3), (4, 2), (6, 1), (6, 3), (8, 2), (20, 1)]
+
+
+def enumerate_points(die, num, bonus):
+    """{points: probability} of every roll of `num` dice, by brute force."""
+    counts = Counter(sum(faces) + bonus for faces in itertools.product(range(1, die + 1), repeat=num))
+    total = die ** num
+    return {points: n / total for points, n in sorted(counts.items())}
+
+
+def sample_points(rng, die, num, bonus):
+    # how the auction house used to roll an auction
+    return sum(rng.randint(1, die) for _ in range(num)) + bonus
+
+
+@pytest.mark.parametrize("die, num", SMALL)
+@pytest.mark.parametrize("bonus", [-5, 0, 7])
+def test_tables_match_enumeration(die, num, bonus):
+    table = DiceTable()
+    exact = enumerate_points(die, num, bonus)
+
+    points, probs = table.pmf(die, num, bonus)
+    assert points.tolist() == list(exact)
+    assert probs == pytest.approx(list(exact.values()))
+    assert probs.sum() == pytest.approx(1.0)
+
+    cumulative = 0.0
+    for k in range(num + bonus - 2, num * die + bonus + 2):
+        cumulative += exact.get(k, 0.0)
+        assert table.cdf(die, num, bonus, k) == pytest.approx(min(cumulative, 1.0))
+        assert table.prob_at_least(die, num, bonus, k) == pytest.approx(sum(p for v, p in exact.items() if v >= k))
+
+    # quantile is the inverse of cdf
+    for k in exact:
+        q = table.cdf(die, num, bonus, k)
+        assert table.quantile(die, num, bonus, q) == k
+        assert table.cdf(die, num, bonus, table.quantile(die, num, bonus, q)) >= q - 1e-12
+    for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+        k = table.quantile(die, num, bonus, q)
+        assert table.cdf(die, num, bonus, k) >= q - 1e-12
+        assert table.cdf(die, num, bonus, k - 1) < q
+
+    mean = sum(v * p for v, p in exact.items())
+    variance = sum((v - mean) ** 2 * p for v, p in exact.items())
+    stats = table.stats(die, num, bonus)
+    assert stats["mean"] == pytest.approx(mean)
+    assert stats["std"] ** 2 == pytest.approx(variance)
+    assert (stats["min"], stats["max"]) == (min(exact), max(exact))
+    assert stats["p50"] == table.quantile(die, num, bonus, 0.5)
+
+
+def test_stats_agree_with_sampled_rolls():
+    table = DiceTable()
+    rng = random.Random(4)
+    for die, num in SMALL:
+        samples = np.array([sample_points(rng, die, num, 3) for _ in range(20000)])
+        stats = table.stats(die, num, 3)
+        # five standard errors
+        assert abs(samples.mean() - stats["mean"]) < 5 * stats["std"] / np.sqrt(len(samples))
+        assert samples.std() == pytest.approx(stats["std"], rel=0.05)
+        assert samples.min() >= stats["min"] and samples.max() <= stats["max"]
+
+
+def test_batch_methods_agree_with_the_scalar_ones():
+    table = DiceTable([(6, 1)])
+    dies, nums = zip(*SMALL)
+    bonuses = [-2, 0, 1, 5, -4, 3, 0, 2]
+
+    batch = table.batch_stats(dies, nums, bonuses)
+    for i, (die, num, bonus) in enumerate(zip(dies, nums, bonuses)):
+        stats = table.stats(die, num, bonus)
+        for name, value in stats.items():
+            assert batch[name][i] == pytest.approx(value), name
+
+    for k in (-10, 0, 4, 9, 30):
+        batch_p = table.batch_prob_at_least(dies, nums, bonuses, k)
+        expected = [table.prob_at_least(d, n, b, k) for d, n, b in zip(dies, nums, bonuses)]
+        assert batch_p == pytest.approx(expected)
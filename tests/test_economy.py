@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from dnd_auction_game import economy
+
+
+def baseline_walk(walk, start, min_value, max_value, reset_every):
+    """The per-round update of the original generate_gold_random_walk & co.
+
+    Instead of python's `random` it takes its steps and reset values from the same
+    per-block draws the block generator uses, so the values must come out identical.
+    """
+    def draws(index):
+        # (reset value, step) that the walk uses at `index`
+        b = (index - 1) // walk.block_rounds
+        first_round = 1 + b * walk.block_rounds
+        n_segments = min(walk.segments_per_block, -(-(walk.n_steps - first_round) // reset_every))
+        seed = np.random.SeedSequence(walk._seed.entropy, spawn_key=walk._seed.spawn_key + (b,))
+        resets, steps = walk._draws(np.random.default_rng(seed), n_segments, reset_every - 1)
+        segment, j = divmod(index - first_round, reset_every)
+        return resets[segment].item(), steps[segment, j - 1].item() if j > 0 else None
+
+    values = [start]
+    for i in range(walk.n_steps - 1):
+        reset, step = draws(i + 1)
+        if i % reset_every == 0:
+            values.append(reset)
+            continue
+
+        next_value = values[-1] + step
+        if next_value < min_value:
+            next_value = min_value
+        if next_value > max_value:
+            next_value = max_value
+        values.append(next_value)
+
+    return values
+
+
+WALKS = [
+    (economy.gold_random_walk, 1000, 10, 3000, 500),
+    (economy.bank_limit_random_walk, 5000, 50, 20000, 300),
+    (economy.interest_rate_random_walk, 1.00, 1.0, 1.1, 250),
+]
+
+
+@pytest.mark.parametrize("make_walk, start, min_value, max_value, reset_every", WALKS)
+@pytest.mark.parametrize("n_steps", [1, 2, 251, 3333])
+def test_block_walks_match_the_per_round_update(make_walk, start, min_value, max_value, reset_every, n_steps, monkeypatch):
+    # small blocks, so the walk crosses several block boundaries
+    monkeypatch.setattr(economy, "BLOCK_ROUNDS", 1000)
+    walk = make_walk(n_steps, np.random.SeedSequence(11))
+    expected = baseline_walk(walk, start, min_value, max_value, reset_every)
+
+    assert walk.tolist() == expected
+    assert [walk[i] for i in range(n_steps)] == expected
+    assert walk[n_steps // 3:n_steps - 1] == expected[n_steps // 3:n_steps - 1]
+    assert walk[0] == start
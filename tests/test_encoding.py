@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from websockets.exceptions import ConnectionClosedOK
+
+from dnd_auction_game import client as client_module
+from dnd_auction_game import protocol
+from dnd_auction_game.client import AuctionGameClient
+from dnd_auction_game.protocol import RoundPayloads, decode_message, negotiate_encoding
+from dnd_auction_game.server import app, games
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # one server for the module, its lobbies belong to the event loop it started on.
+    # The game logs are written in the background, keep them out of the tree until the server stopped.
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("logs"))
+        with TestClient(app) as client:
+            yield client
+
+
+def first_round(client, game_id, agent_info):
+    """The first round frame the server sends to an agent with this handshake."""
+    with client.websocket_connect("/ws/{}/play123".format(game_id)) as agent:
+        agent.send_text(json.dumps(agent_info))
+
+        deadline = time.monotonic() + 5.0
+        while time.monotonic() < deadline:
+            lobby = games.get(game_id)
+            if lobby is not None and agent_info["a_id"] in lobby.auction_house.agents:
+                break
+            time.sleep(0.01)
+
+        with client.websocket_connect("/ws_run/{}/play123".format(game_id)) as runner:
+            runner.send_json({"num_rounds": 2, "round_mode": "event", "max_round_time": 0.05})
+            runner.receive_json()
+
+        return agent.receive()
+
+
+def agent_info(a_id, **options):
+    return dict({"a_id": a_id, "name": "agent", "player_id": "test"}, **options)
+
+
+def test_msgpack_client_gets_binary_frames(client):
+    frame = first_round(client, "enc_msgpack", agent_info("agent_msgpack", encoding="msgpack", economy_schedule=True))
+    assert frame.get("bytes") is not None
+    message = msgpack.unpackb(frame["bytes"], raw=False)
+    assert message["round"] == 0
+    assert set(message["economy"]) == set(protocol.ECONOMY_KEYS)
+
+
+def test_msgpack_falls_back_to_json_without_msgpack(client, monkeypatch):
+    monkeypatch.setattr(protocol, "msgpack", None)
+    assert negotiate_encoding("msgpack") == "json"
+
+    frame = first_round(client, "enc_fallback", agent_info("agent_fallback", encoding="msgpack", economy_schedule=True))
+    assert frame.get("text") is not None
+    message = json.loads(frame["text"])
+    assert message["round"] == 0
+    assert "economy" in message
+
+
+def test_old_json_client_gets_the_legacy_message(client):
+    frame = first_round(client, "enc_legacy", agent_info("agent_legacy"))
+    message = json.loads(frame["text"])
+    assert "economy" not in message and "states" in message
+    for remainder_key in protocol.ECONOMY_KEYS.values():
+        assert len(message[remainder_key]) == 2
+
+
+class FakeSocket:
+    """Serves the given frames to AuctionGameClient and keeps what it sends back."""
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.sent = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def recv(self):
+        if not self.frames:
+            raise ConnectionClosedOK(None, None)
+        return self.frames.pop(0)
+
+
+def test_client_answers_in_the_encoding_the_server_chose(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    schedule = {key: [1000, 1000, 1000] for key in protocol.ECONOMY_KEYS}
+    state = {"round": 0, "states": {"x": {"gold": 1000, "points": 0}}, "auctions": {"a1": {"die": 6, "num": 1, "bonus": 0}},
+             "prev_auctions": {}, "pool": 0, "prev_pool_buys": {}}
+
+    class Connection:
+        economy_schedule = True
+        schedule_sent = False
+        delta = False
+        acked_round = None
+
+        def __init__(self, encoding):
+            self.encoding = encoding
+
+    def make_bid(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+        assert bank_state["gold_income_per_round"] == [1000, 1000, 1000]
+        return {"bids": {"a1": 1}}
+
+    for requested, server_encoding, frame_type in (("msgpack", "msgpack", bytes), ("msgpack", "json", str),
+                                                  ("json", "json", str)):
+        frame = RoundPayloads(state, schedule).encoded_for(Connection(server_encoding))
+        sock = FakeSocket([frame])
+        monkeypatch.setattr(client_module.websockets, "connect", lambda url, sock=sock: sock)
+
+        agent = AuctionGameClient("localhost", "tester", encoding=requested)
+        asyncio.run(agent._internal_run(make_bid))
+
+        handshake, answer = sock.sent
+        assert json.loads(handshake)["encoding"] == requested
+        assert isinstance(answer, frame_type)
+        assert decode_message(answer) == {"bids": {"a1": 1}, "round": 0}
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pytest
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.game_logger import flush_all
+from dnd_auction_game.logs import LogReader, convert_log, load_log, read_jsonln
+from dnd_auction_game.replay import replay
+from dnd_auction_game.sim import GameSimulator
+
+
+def bid_one(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    return {"bids": {auction_id: 1 for auction_id in list(auctions)[:2]}}
+
+
+def play(auction_house, num_rounds):
+    GameSimulator({"a": bid_one, "b": bid_one}, num_rounds=num_rounds, auction_house=auction_house).run()
+    assert flush_all()
+
+
+def test_every_game_gets_its_own_log(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    auction_house = AuctionHouse("play", "play", save_logs=True, seed=1)
+    assert auction_house.log_file is None  # nobody joined yet
+
+    play(auction_house, 40)
+    first = auction_house.log_file
+    auction_house.reset()
+    play(auction_house, 40)
+    second = auction_house.log_file
+    assert first != second
+
+    for path in (first, second):
+        with LogReader(path) as reader:
+            assert reader.header()["num_rounds"] == 40
+            rounds = [entry["round"] for entry in reader.range(0)]
+            assert rounds == list(range(rounds[0], rounds[0] + 40))
+            assert [entry["round"] for entry in reader.range(38, 41)] == [r for r in rounds if r >= 38]
+            assert reader.round(5)["round"] == 5
+        assert os.stat(path).st_mode & 0o111 == 0
+
+
+def two_games(tmp_path):
+    """The logs of two games, and both in one file like the server used to write them."""
+    auction_house = AuctionHouse("play", "play", save_logs=True, seed=1)
+    play(auction_house, 5)
+    first = auction_house.log_file
+    auction_house.reset()
+    play(auction_house, 5)
+
+    merged = str(tmp_path / "merged.jsonln")
+    with open(merged, "w", encoding="utf-8") as fp:
+        for path in (first, auction_house.log_file):
+            with open(path, "r", encoding="utf-8") as src:
+                fp.write(src.read())
+    return first, merged
+
+
+def test_reader_rejects_a_log_with_two_games(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _, merged = two_games(tmp_path)
+    with pytest.raises(ValueError):
+        LogReader(merged)
+
+
+def test_replay_rejects_a_log_with_two_games(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first, merged = two_games(tmp_path)
+    assert set(replay(first, {})) == {"sim_agent_0", "sim_agent_1"}
+    with pytest.raises(ValueError):
+        replay(merged, {})
+
+
+def test_converter_rejects_a_headerless_log_with_two_games(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _, merged = two_games(tmp_path)
+    headerless = str(tmp_path / "headerless.jsonln")
+    with open(merged, "r", encoding="utf-8") as src, open(headerless, "w", encoding="utf-8") as fp:
+        fp.writelines(line for line in src if '"type": "header"' not in line and '"type":"header"' not in line)
+
+    with pytest.raises(ValueError):
+        read_jsonln(headerless)
+    with pytest.raises(ValueError):
+        convert_log(headerless)
+
+
+def test_columnar_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    auction_house = AuctionHouse("play", "play", save_logs=True, seed=3)
+    play(auction_house, 12)
+    path = auction_house.log_file
+
+    parsed = read_jsonln(path)
+    out_dir = convert_log(path, str(tmp_path / "game.cols"))
+    mapped = load_log(out_dir)
+    assert isinstance(mapped["gold"], np.memmap)
+
+    assert sorted(mapped.columns) == sorted(parsed.columns)
+    for name, values in parsed.columns.items():
+        assert mapped[name].dtype == values.dtype, name
+        assert np.array_equal(mapped[name], values), name
+    assert mapped.agents == parsed.agents == ["sim_agent_0", "sim_agent_1"]
+    assert mapped.header == parsed.header
+    assert list(mapped.rounds) == list(range(12))
+
+    with LogReader(path) as reader:
+        state = reader.round(7)
+    row = mapped.round_row(7)
+    for a_id, agent_state in state["states"].items():
+        assert mapped["gold"][row, mapped.agent_index(a_id)] == agent_state["gold"]
+        assert mapped["points"][row, mapped.agent_index(a_id)] == agent_state["points"]
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+
+from dnd_auction_game.agent_registry import GainHistory
+from dnd_auction_game.leadboard import LeadboardRanks
+
+
+class SortedLeadboard:
+    """How the lobby built the leaderboard before: sort every time, slice the gain lists."""
+
+    def __init__(self):
+        self.previous_ranks = {}
+        self.signals = {}
+        self.last_round = -1
+        self.history = []
+
+    def push(self, gains):
+        for i, gain in enumerate(gains):
+            if i == len(self.history):
+                self.history.append([])
+            self.history[i].append(gain)
+
+    def build(self, points, round):
+        order = sorted(range(len(points)), key=lambda i: points[i], reverse=True)
+
+        if round != self.last_round:
+            self.signals = {i: {"move": s["move"], "remaining": s["remaining"] - 1}
+                            for i, s in self.signals.items() if s["remaining"] > 1 and s["move"]}
+            ranks = {}
+            for rank, i in enumerate(order, 1):
+                ranks[i] = rank
+                prev_rank = self.previous_ranks.get(i)
+                if prev_rank is not None:
+                    if rank < prev_rank:
+                        self.signals[i] = {"move": 1, "remaining": 5}
+                    elif rank > prev_rank:
+                        self.signals[i] = {"move": -1, "remaining": 10}
+            self.previous_ranks = ranks
+            self.last_round = round
+
+        moves = [self.signals.get(i, {}).get("move", 0) for i in range(len(points))]
+        averages = []
+        sparklines = []
+        for history in self.history:
+            last_window = history[-10:]
+            averages.append(float(sum(last_window)) / len(last_window) if last_window else 0.0)
+            sparklines.append(np.cumsum(history[-20:]).tolist())
+        return order, moves, averages, sparklines
+
+
+def test_incremental_leadboard_matches_sorting_every_round():
+    rng = random.Random(23)
+    ranks = LeadboardRanks()
+    gains = GainHistory()
+    baseline = SortedLeadboard()
+
+    points = [0, 0, 0]
+    for round in range(80):
+        # late joiners, and a few points so that ties are common
+        if round % 7 == 3:
+            points.append(rng.randint(0, 20))
+        prev_points = list(points)
+        for i in range(len(points)):
+            if rng.random() < 0.4:
+                points[i] += rng.randint(-2, 6)
+        round_gains = np.array(points) - np.array(prev_points)
+        gains.push(round_gains)
+        baseline.push(round_gains.tolist())
+
+        # the page may be built several times per round
+        for _ in range(2):
+            n = len(points)
+            order = ranks.next_round(np.array(points), round)
+            expected_order, moves, averages, sparklines = baseline.build(points, round)
+            assert order == expected_order
+            assert ranks.move.tolist() == moves
+            assert gains.short_average(n).tolist() == averages
+            assert gains.cumulative(n) == sparklines
+
+    assert any(moves) and max(len(p) for p in sparklines) == 20
@@ -0,0 +1,36 @@
+import asyncio
+
+from dnd_auction_game.lobby import LobbyManager
+
+
+class StubLobby:
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.tokens = []
+
+    def start(self):
+        pass
+
+    async def handle_agent(self, websocket, token):
+        self.tokens.append(token)
+
+    async def handle_runner(self, websocket, play_token):
+        self.tokens.append(play_token)
+
+
+def test_lobbies_are_only_created_for_the_right_token():
+    lobbies = LobbyManager(StubLobby, game_token="game", play_token="play")
+
+    async def connect():
+        await lobbies.handle_agent(None, "room1", "wrong")
+        await lobbies.handle_runner(None, "room2", "game")
+        assert lobbies.lobbies == {}
+
+        await lobbies.handle_agent(None, "room1", "game")
+        await lobbies.handle_runner(None, "room2", "play")
+        # an existing lobby checks the token itself
+        await lobbies.handle_agent(None, "room1", "wrong")
+
+    asyncio.run(connect())
+    assert sorted(lobbies.lobbies) == ["room1", "room2"]
+    assert lobbies.lobbies["room1"].tokens == ["game", "wrong"]
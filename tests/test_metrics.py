@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from dnd_auction_game import metrics
+from dnd_auction_game.sim import GameSimulator
+
+
+def samples(text, name):
+    """{labels: value} of the sample lines of one series in prometheus text."""
+    found = {}
+    for line in text.splitlines():
+        if line.startswith(name + "{") or line.startswith(name + " "):
+            series, value = line.rsplit(" ", 1)
+            found[series[len(name):]] = float(value)
+    return found
+
+
+def test_prometheus_text_format():
+    registry = metrics.Registry()
+    registry.inc("ah_bids_rejected_total", 2, reason="gold")
+    registry.inc("ah_bids_rejected_total", 1, reason='say "no"')
+    registry.mark("ah_ws_messages_sent_total", 3)
+    for value in (0.00002, 0.003, 0.003, 0.2, 60.0):
+        registry.observe("ah_tick_seconds", value)
+    lobby = {"game_id": "g1", "shard": 1, "round": 7, "num_players": 3, "num_connections": 2, "num_spectators": 0,
+             "connections": {"queue_depth_total": 4, "queue_depth_max": 3, "last_send_latency_p50": 0.001,
+                             "last_send_latency_max": 0.5, "sent": 10, "dropped": 1, "failed": 0, "overflowed": 0}}
+    text = metrics.render_prometheus(registry.export(), [lobby])
+    lines = text.splitlines()
+    assert text.endswith("\n")
+
+    # every series is introduced by its HELP and TYPE lines
+    types = {}
+    for i, line in enumerate(lines):
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert lines[i - 1].startswith("# HELP {} ".format(name))
+            types[name] = kind
+        elif not line.startswith("#"):
+            name = line.split("{")[0].split(" ")[0]
+            base = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in types:
+                    base = name[:-len(suffix)]
+            assert base in types, line
+
+    assert types["ah_bids_rejected_total"] == "counter"
+    assert types["ah_ws_messages_sent_per_second"] == "gauge"
+    assert types["ah_tick_seconds"] == "histogram"
+    assert types["ah_round"] == "gauge" and types["ah_connection_messages_sent_total"] == "counter"
+
+    assert samples(text, "ah_bids_rejected_total") == {'{reason="gold"}': 2, '{reason="say \\"no\\""}': 1}
+    assert samples(text, "ah_round") == {'{game="g1",shard="1"}': 7}
+
+    buckets = samples(text, "ah_tick_seconds_bucket")
+    assert len(buckets) == len(metrics.LATENCY_BUCKETS) + 1
+    assert buckets['{le="5e-05"}'] == 1
+    assert buckets['{le="0.005"}'] == 3
+    assert buckets['{le="10.0"}'] == 4
+    assert buckets['{le="+Inf"}'] == 5
+    counts = list(buckets.values())
+    assert counts == sorted(counts)
+    assert samples(text, "ah_tick_seconds_count") == {"": 5}
+    assert samples(text, "ah_tick_seconds_sum")[""] == pytest.approx(60.20602)
+
+
+def test_merge_adds_up_the_processes():
+    first, second = metrics.Registry(), metrics.Registry()
+    first.inc("ah_rounds_total", 5)
+    second.inc("ah_rounds_total", 7)
+    second.inc("ah_bids_received_total", 2)
+    first.observe("ah_tick_seconds", 0.001)
+    second.observe("ah_tick_seconds", 0.001)
+    second.observe("ah_tick_seconds", 3.0)
+    second.observe("ah_log_write_seconds", 0.01)
+    exports = [first.export(), second.export()]
+    exports[0]["uptime"], exports[1]["uptime"] = 10.0, 4.0
+    exports[1]["enabled"] = True
+
+    merged = metrics.merge(exports)
+    assert merged["enabled"] is True
+    assert merged["uptime"] == 10.0
+    assert {c["name"]: c["value"] for c in merged["counters"]} == {"ah_rounds_total": 12, "ah_bids_received_total": 2}
+
+    histograms = {h["name"]: h for h in merged["histograms"]}
+    tick = histograms["ah_tick_seconds"]
+    assert (tick["count"], tick["sum"]) == (3, pytest.approx(3.002))
+    assert tick["counts"] == [a + b for a, b in zip(exports[0]["histograms"][0]["counts"],
+                                                   exports[1]["histograms"][0]["counts"])]
+    assert histograms["ah_log_write_seconds"]["count"] == 1
+    # the exports themselves are left alone
+    assert first.export()["histograms"][0]["count"] == 1
+
+    assert metrics.merge([]) == {"enabled": False, "uptime": 0.0, "counters": [], "histograms": [], "rates": []}
+
+
+def test_metrics_are_off_unless_asked_for(monkeypatch):
+    code = "from dnd_auction_game import metrics; print(metrics.ENABLED)"
+    env = {"PATH": ""}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for value, enabled in ((None, "False"), ("0", "False"), ("1", "True")):
+        if value is not None:
+            env["AH_METRICS"] = value
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env, cwd=root)
+        assert out.stdout.strip() == enabled
+
+    def bid_all(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+        return {"bids": {auction_id: 1 for auction_id in auctions}}
+
+    def play():
+        monkeypatch.setattr(metrics, "_registry", metrics.Registry())
+        game = GameSimulator([bid_all, bid_all], num_rounds=3, seed=2)
+        game.run()
+        return {c["name"]: c["value"] for c in metrics.export()["counters"]}
+
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    assert metrics.timer("ah_tick_seconds") is metrics._NULL_TIMER
+    with metrics.timer("ah_tick_seconds"):
+        pass
+    assert play() == {}
+    assert metrics.export()["histograms"] == []
+
+    metrics.enable()
+    assert play()["ah_bids_received_total"] > 0
@@ -0,0 +1,44 @@
+import pytest
+
+from dnd_auction_game import protocol
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.protocol import RoundPayloads, decode_message, encode_message, encode_schedule
+
+
+class Connection:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.economy_schedule = True
+        self.schedule_sent = False
+        self.delta = False
+        self.acked_round = None
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+@pytest.mark.parametrize("chunk", [7, 16, 1000, 1 << 15])
+def test_the_schedule_encodes_the_same_in_pieces(encoding, chunk, monkeypatch):
+    monkeypatch.setattr(protocol, "SCHEDULE_CHUNK", chunk)
+    auction_house = AuctionHouse("play", "play", seed=2)
+    auction_house.prepare_game(2500)
+    schedule = auction_house.economy_schedule()
+
+    assert encode_schedule(schedule, encoding) == encode_message(schedule, encoding)
+
+    state = {"round": 0, "states": {"a": {"gold": 1000, "points": 0}}, "pool": 3}
+    spliced = RoundPayloads(state, schedule, encoded_schedule={encoding: encode_schedule(schedule, encoding)})
+    plain = RoundPayloads(state, schedule)
+    message = decode_message(spliced.encoded_for(Connection(encoding)))
+    assert message == decode_message(plain.encoded_for(Connection(encoding)))
+    assert message["economy"]["bank_interest_per_round"] == schedule["bank_interest_per_round"]
+
+
+def test_start_game_keeps_a_prepared_schedule():
+    auction_house = AuctionHouse("play", "play", seed=2)
+    auction_house.prepare_game(100)
+    schedule = auction_house.economy_schedule()
+    auction_house.start_game(100)
+    assert auction_house.economy_schedule() is schedule
+
+    fresh = AuctionHouse("play", "play", seed=2)
+    fresh.start_game(100)
+    assert fresh.economy_schedule() == schedule
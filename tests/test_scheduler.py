@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from dnd_auction_game.scheduler import IDLE_ROUND_TIME, RoundScheduler
+
+
+def all_in(scheduler):
+    return scheduler._all_in.is_set()
+
+
+def test_only_answers_to_the_current_round_count():
+    scheduler = RoundScheduler(mode="event")
+
+    async def play():
+        scheduler.round_started(3, ["a", "b"])
+        scheduler.submitted("a", 2)
+        scheduler.submitted("b", 3)
+        assert not all_in(scheduler)
+
+        # "a" tags its answers, so an untagged message from it is not an answer
+        scheduler.submitted("a", None)
+        assert not all_in(scheduler)
+
+        scheduler.submitted("a", 3)
+        assert all_in(scheduler)
+
+    asyncio.run(play())
+
+
+def test_untagged_answers_count_for_agents_that_never_tag():
+    scheduler = RoundScheduler(mode="event")
+
+    async def play():
+        scheduler.round_started(0, ["legacy", "new"])
+        scheduler.submitted("legacy", None)
+        scheduler.submitted("new", 0)
+        assert all_in(scheduler)
+
+        scheduler.round_started(1, ["legacy", "new"])
+        scheduler.submitted("new", None)
+        scheduler.submitted("legacy", None)
+        assert not all_in(scheduler)
+
+        # a reconnect may be an older client
+        scheduler.agent_left("new")
+        scheduler.round_started(2, ["legacy", "new"])
+        scheduler.submitted("new", None)
+        scheduler.submitted("legacy", None)
+        assert all_in(scheduler)
+
+    asyncio.run(play())
+
+
+def test_an_empty_event_round_does_not_end_at_once():
+    scheduler = RoundScheduler(mode="event", min_round_time=0.0, max_round_time=0.0)
+
+    async def play():
+        started = time.monotonic()
+        for round in range(3):
+            scheduler.round_started(round, [])
+            await scheduler.wait_round_end()
+        return time.monotonic() - started
+
+    assert asyncio.run(play()) >= 3 * IDLE_ROUND_TIME * 0.9
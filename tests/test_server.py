@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+from dnd_auction_game import server
+from dnd_auction_game.server import app
+
+
+def test_leadboard_of_an_unknown_game_is_a_404():
+    client = TestClient(app)
+
+    response = client.get("/api/leadboard/nobody-here")
+    assert response.status_code == 404
+    assert response.json() == {"ok": False, "error": "unknown game"}
+    assert "etag" not in response.headers
+
+    response = client.get("/api/leadboard")
+    assert response.status_code == 200
+    assert "etag" in response.headers
+
+
+def test_leadboard_of_a_game_whose_shard_did_not_answer_is_a_404(monkeypatch):
+    async def no_answer(game_id):
+        return None
+
+    monkeypatch.setattr(server.games, "leadboard_snapshot", no_answer)
+    client = TestClient(app)
+    for url in ("/api/leadboard", "/api/leadboard/default", "/"):
+        assert client.get(url).status_code == 404
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import subprocess
+import sys
+import zlib
+
+from dnd_auction_game import metrics
+from dnd_auction_game.shard import (
+    FRAME_BYTES,
+    FRAME_CLOSE,
+    FRAME_OPEN,
+    FRAME_TEXT,
+    FrameWriter,
+    RelayWebSocket,
+    ShardRouter,
+    read_frame,
+    shard_of,
+)
+
+
+class BufferWriter:
+    """Stands in for the StreamWriter under a FrameWriter, keeps the bytes written."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def test_frames_round_trip_through_partial_reads():
+    async def play():
+        out = BufferWriter()
+        frames = FrameWriter(out)
+        await frames.send(FRAME_TEXT, "hé, round 3".encode("utf-8"))
+        await frames.send(FRAME_OPEN, b"{}")
+        await frames.send(FRAME_BYTES, bytes(range(256)) * 40)
+        await frames.send(FRAME_TEXT)
+
+        # the relay sees the stream in pieces of a few bytes at a time
+        reader = asyncio.StreamReader()
+
+        async def feed():
+            for i in range(0, len(out.data), 7):
+                reader.feed_data(bytes(out.data[i:i + 7]))
+                await asyncio.sleep(0)
+            reader.feed_eof()
+
+        feeding = asyncio.create_task(feed())
+        websocket = RelayWebSocket(reader, frames)
+        received = [await websocket.receive() for _ in range(4)]
+        await feeding
+        return received
+
+    text, data, empty, closed = asyncio.run(play())
+    assert text == {"type": "websocket.receive", "text": "hé, round 3"}
+    # the open frame is not a message and is skipped
+    assert data == {"type": "websocket.receive", "bytes": bytes(range(256)) * 40}
+    assert empty == {"type": "websocket.receive", "text": ""}
+    assert closed == {"type": "websocket.disconnect", "code": 1000}
+
+
+def test_a_frame_cut_short_reads_as_closed():
+    async def play():
+        out = BufferWriter()
+        await FrameWriter(out).send(FRAME_BYTES, b"0123456789")
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(out.data[:-3]))
+        reader.feed_eof()
+        return await read_frame(reader)
+
+    assert asyncio.run(play()) == (FRAME_CLOSE, b"")
+
+
+def test_games_route_to_the_same_shard_in_every_process():
+    game_ids = ["default", "game_1", "game_2", "tournament-final", "x" * 64]
+    expected = [zlib.crc32(game_id.encode("utf-8")) % 4 for game_id in game_ids]
+    assert [shard_of(game_id, 4) for game_id in game_ids] == expected
+
+    router = ShardRouter(4)
+    router.addresses = ["shard_{}".format(i) for i in range(4)]
+    assert [router._address_of(game_id) for game_id in game_ids] == ["shard_{}".format(s) for s in expected]
+    assert {shard_of("game_{}".format(i), 4) for i in range(100)} == {0, 1, 2, 3}
+    assert ShardRouter(0).shard_of("default") == 0
+
+    # a new process hashes strings differently, the route has to stay the same
+    code = "from dnd_auction_game.shard import shard_of; print([shard_of(g, 4) for g in {!r}])".format(game_ids)
+    for hash_seed in ("1", "2"):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             env={"PYTHONHASHSEED": hash_seed, "PATH": ""},
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        assert out.stdout.strip() == str(expected)
+
+
+def test_metrics_of_the_shards_are_summed(monkeypatch):
+    def process(sent, latencies):
+        registry = metrics.Registry()
+        registry.inc("ah_ws_messages_sent_total", sent)
+        registry.inc("ah_bids_rejected_total", 1, reason="gold")
+        for latency in latencies:
+            registry.observe("ah_send_latency_seconds", latency)
+        return registry.export()
+
+    shard_exports = {
+        "shard_0": {"process": process(3, [0.001, 0.2]), "lobbies": [{"game_id": "a"}]},
+        "shard_1": None,
+        "shard_2": {"process": process(4, [20.0]), "lobbies": [{"game_id": "b"}, {"game_id": "c"}]},
+    }
+
+    async def call(address, method, *args):
+        assert method == "metrics"
+        return shard_exports[address]
+
+    monkeypatch.setattr(metrics, "_registry", metrics.Registry())
+    router = ShardRouter(3)
+    router.addresses = list(shard_exports)
+    monkeypatch.setattr(router, "_call", call)
+    result = asyncio.run(router.metrics())
+
+    counters = {(c["name"], tuple(c["labels"].items())): c["value"] for c in result["process"]["counters"]}
+    assert counters == {("ah_ws_messages_sent_total", ()): 7, ("ah_bids_rejected_total", (("reason", "gold"),)): 2}
+
+    histogram, = result["process"]["histograms"]
+    assert histogram["count"] == 3
+    assert histogram["sum"] == 0.001 + 0.2 + 20.0
+    assert sum(histogram["counts"]) == 3 and histogram["counts"][-1] == 1
+
+    # the shard that did not answer is left out
+    assert [(s["game_id"], s["shard"]) for s in result["lobbies"]] == [("a", 0), ("b", 2), ("c", 2)]
@@ -0,0 +1,40 @@
+import json
+
+from dnd_auction_game.sim import GameSimulator
+
+
+def vandal(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+    # everything it was given is its own to change
+    states.clear()
+    for auction in auctions.values():
+        auction["die"] = -1
+    auctions["fake"] = {"die": 6, "num": 1, "bonus": 0}
+    for auction in prev_auctions.values():
+        auction["bids"].append({"a_id": "nobody", "gold": 10**9})
+    prev_pool_buys["nobody"] = 1
+    bank_state["gold_income_per_round"].clear()
+    return {}
+
+
+def test_callbacks_get_their_own_arguments():
+    seen = []
+
+    def observer(agent_id, round, states, auctions, prev_auctions, pool, prev_pool_buys, bank_state):
+        seen.append((json.loads(json.dumps([states, auctions, prev_auctions, prev_pool_buys])), bank_state))
+        bids = {auction_id: 1 for auction_id in auctions}
+        return {"bids": bids}
+
+    game = GameSimulator([vandal, observer, vandal], num_rounds=5, seed=1)
+    game.start()
+    for _ in range(5):
+        round_data = game.step()
+        (states, auctions, prev_auctions, prev_pool_buys), bank_state = seen[-1]
+        assert states == round_data["states"]
+        assert auctions == round_data["auctions"]
+        assert "fake" not in auctions
+        assert all(auction["die"] > 0 for auction in auctions.values())
+        assert prev_auctions == round_data["prev_auctions"]
+        assert "nobody" not in prev_pool_buys
+
+        assert all(type(values) is list for values in bank_state.values())
+        assert len(bank_state["gold_income_per_round"]) == game.auction_house.num_rounds_in_game - round_data["round"]